@@ -22,7 +22,7 @@ class ExistsChatRoute(CriaRoute):
         path="/bots/chats/{chat_id}/exists",
         name="Check If Chat Exists",
         summary="Check if the chat with a given Id exists",
-        description="Check if the chat with a given Id exists",
+        description="Check if the chat with a given Id exists. Set 'refresh' to also extend its expiry.",
     )
     @catch_exceptions(
         ResponseModel
@@ -30,13 +30,17 @@ class ExistsChatRoute(CriaRoute):
     async def execute(
             self,
             request: Request,
-            chat_id: str
+            chat_id: str,
+            refresh: bool = False
     ) -> ResponseModel:
+        chats = request.app.criabot.redis_api.chats
+
         return self.ResponseModel(
             code=SUCCESS_CODE,
             status=200,
             messsage=f"Checked if the chat '{chat_id}' is active!",
-            exists=await request.app.criabot.redis_api.chats.exists(chat_id=chat_id)
+            # Refreshing also extends the chat's expiry, e.g. while the user still has it open
+            exists=await (chats.touch(chat_id=chat_id) if refresh else chats.exists(chat_id=chat_id))
         )
 
 
@@ -1,4 +1,4 @@
-from typing import Optional, Any
+from typing import Optional, Any, Dict, List
 
 from CriadexSDK.ragflow_schemas import CompletionUsage
 from fastapi import APIRouter
@@ -65,12 +65,16 @@ class QueryChatRoute(CriaRoute):
         )
 
         # Check the bots exist
-        if chat_config.extra_bots and not await request.app.criabot.exists(*chat_config.extra_bots):
-            return self.ResponseModel(
-                code=NOT_FOUND_CODE,
-                status=404,
-                message="One or more bots could not be found in the query."
-            )
+        if chat_config.extra_bots:
+            found_bots: Dict[str, int] = await request.app.criabot.resolve_bots(chat_config.extra_bots)
+            missing_bots: List[str] = [name for name in chat_config.extra_bots if name not in found_bots]
+
+            if missing_bots:
+                return self.ResponseModel(
+                    code=NOT_FOUND_CODE,
+                    status=404,
+                    message=f"One or more bots could not be found in the query: {', '.join(missing_bots)}"
+                )
 
         reply: ChatReply = await chat.send(
             prompt=chat_config.prompt,
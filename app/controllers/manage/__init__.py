@@ -4,7 +4,7 @@ import app.core.config as config
 from app.core.objects import AppMode
 from app.core.security.handlers.bots import GetApiKeyBots
 from app.core.security.handlers.master import GetApiKeyMaster
-from . import create, delete, about, update
+from . import create, delete, about, update, stats
 from ...core.route import CriaRouter
 
 MASTER_DEPS: list = [Security(GetApiKeyMaster())] if config.APP_MODE == AppMode.PRODUCTION else []
@@ -19,8 +19,10 @@ update.view.dependencies.extend(NON_MASTER_DEPS)
 
 create.view.dependencies.extend(MASTER_DEPS)
 delete.view.dependencies.extend(MASTER_DEPS)
+stats.view.dependencies.extend(MASTER_DEPS)
 
 router.include_views(
+    stats.view,
     create.view,
     update.view,
     delete.view,
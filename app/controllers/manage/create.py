@@ -14,6 +14,7 @@ view = APIRouter()
 
 class BotCreateResponse(APIResponse):
     bot_api_key: Optional[str] = None
+    bot_token: Optional[str] = None  # Signed token, only issued if enabled
 
 
 @cbv(view)
@@ -54,7 +55,8 @@ class ManageCreateRoute(CriaRoute):
             code=SUCCESS_CODE,
             status=200,
             message="Successfully created the bot & their indexes.",
-            bot_api_key=auth_response['api_key']
+            bot_api_key=auth_response['api_key'],
+            bot_token=request.app.criabot.create_bot_token(name=bot_name)
         )
 
 
@@ -0,0 +1,44 @@
+from typing import Optional
+
+from fastapi import APIRouter
+from fastapi_restful.cbv import cbv
+from starlette.requests import Request
+
+from app.controllers.schemas import SUCCESS_CODE, catch_exceptions, APIResponse
+from app.core.route import CriaRoute
+
+view = APIRouter()
+
+
+class CacheStatsResponse(APIResponse):
+    stats: Optional[dict] = None
+
+
+@cbv(view)
+class ManageStatsRoute(CriaRoute):
+    ResponseModel = CacheStatsResponse
+
+    @view.get(
+        path="/bots/manage/stats",
+        name="Cache Statistics",
+        summary="Cache Statistics",
+        description="Get the hit rate & staleness of this worker's caches, and how long its event loop was blocked for.",
+    )
+    @catch_exceptions(
+        ResponseModel
+    )
+    async def execute(
+            self,
+            request: Request
+    ) -> ResponseModel:
+
+        # Success!
+        return self.ResponseModel(
+            code=SUCCESS_CODE,
+            status=200,
+            message="Successfully retrieved the cache statistics.",
+            stats=request.app.criabot.stats
+        )
+
+
+__all__ = ["view"]
@@ -12,6 +12,9 @@ from fastapi import Form
 from pydantic import BaseModel, Field
 from starlette import status
 from starlette.exceptions import HTTPException
+from starlette.requests import Request
+
+from app.core.middleware import STATE_STATUS_KEY
 
 from criabot.bot.chat.schemas import RelatedPrompt
 
@@ -71,6 +74,16 @@ def catch_exceptions(
 
         @wraps(func)
         async def wrapper(*args, **kwargs) -> APIResponseModel:
+            response: APIResponseModel = await handle_exceptions(*args, **kwargs)
+
+            # Report the status out-of-band so the StatusMiddleware needn't read the body
+            request: Optional[Request] = kwargs.get("request")
+            if isinstance(request, Request) and isinstance(response, APIResponse):
+                setattr(request.state, STATE_STATUS_KEY, response.status)
+
+            return response
+
+        async def handle_exceptions(*args, **kwargs) -> APIResponseModel:
             try:
                 return await func(*args, **kwargs)
             except httpx.HTTPStatusError as ex:
@@ -7,7 +7,6 @@ import warnings
 from contextlib import asynccontextmanager
 from typing import Any, List, AsyncContextManager
 
-from redis import asyncio as aioredis
 from fastapi import FastAPI
 from starlette.datastructures import State
 from starlette.middleware.cors import CORSMiddleware
@@ -116,12 +115,11 @@ class CriabotAPI(FastAPI):
     async def postflight_checks(self) -> bool:
 
         # Redis doesn't ping until you execute a command, so let's check it's on
-        async with aioredis.Redis(connection_pool=self.criabot.redis_api.pool) as redis:
-            try:
-                await redis.ping()
-            except ConnectionRefusedError:
-                logging.error("Failed to ping Redis: " + traceback.format_exc())
-                return False
+        try:
+            await self.criabot.redis_api.client.ping()
+        except ConnectionRefusedError:
+            logging.error("Failed to ping Redis: " + traceback.format_exc())
+            return False
 
         return True
 
@@ -145,7 +143,8 @@ class CriabotAPI(FastAPI):
             criadex_credentials=config.CRIADEX_CREDENTIALS,
             mysql_credentials=config.MYSQL_CREDENTIALS,
             redis_credentials=config.REDIS_CREDENTIALS,
-            criadex_stacktrace=config.CRIADEX_STACKTRACE
+            criadex_stacktrace=config.CRIADEX_STACKTRACE,
+            bot_token_secret=config.BOT_TOKEN_SECRET
         )
         await criabot_instance.initialize()
         criabot_api.criabot = criabot_instance # Assign to app instance
@@ -158,7 +157,7 @@ class CriabotAPI(FastAPI):
         yield
 
         criabot_api.logger.info("Shutting down Criabot...")
-        # Optionally, add shutdown logic for criabot_instance here
+        await criabot_instance.shutdown()
 
 
 # Instance of the app, started by Uvicorn.
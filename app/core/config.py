@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Optional
 
 from dotenv import load_dotenv
 
@@ -45,12 +46,20 @@ CRIADEX_CREDENTIALS: CriadexCredentials = CriadexCredentials(
     master_api_key=os.environ.get("CRIADEX_MASTER_API_KEY")
 )
 
+# Signed Bot Token Config
+# Only issue & accept signed bot tokens if a secret is configured
+BOT_TOKEN_SECRET: Optional[str] = os.environ.get("BOT_TOKEN_SECRET") or None
+
 # Redis Config
 REDIS_CREDENTIALS: RedisCredentials = RedisCredentials(
     host=os.environ.get("REDIS_HOST"),
     port=os.environ.get("REDIS_PORT"),
     username=os.environ.get("REDIS_USERNAME"),
     password=os.environ.get("REDIS_PASSWORD"),
+    max_connections=os.environ.get("REDIS_MAX_CONNECTIONS") or None,
+    health_check_interval=os.environ.get("REDIS_HEALTH_CHECK_INTERVAL") or 0,
+    socket_timeout=os.environ.get("REDIS_SOCKET_TIMEOUT") or None,
+    socket_connect_timeout=os.environ.get("REDIS_SOCKET_CONNECT_TIMEOUT") or None
 )
 
 # By default, only enable in test mode, as stacktraces can leak sensitive info
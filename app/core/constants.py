@@ -36,3 +36,36 @@ def parse_time_to_seconds(time_str: str) -> int:
 
 # Chat Configuration
 CHAT_EXPIRE_TIME: int = parse_time_to_seconds(os.environ.get("CHAT_EXPIRE_TIME", "1h"))
+
+# Auth Cache Configuration
+# How long (in seconds) an API key authorization decision is trusted before re-checking with Criadex
+AUTH_CACHE_TTL: int = int(os.environ.get("AUTH_CACHE_TTL", 30))
+AUTH_CACHE_MAX_SIZE: int = int(os.environ.get("AUTH_CACHE_MAX_SIZE", 4096))
+
+# Bot Token Configuration
+# How long signed bot tokens stay valid for. Same format as CHAT_EXPIRE_TIME.
+BOT_TOKEN_EXPIRE_TIME: int = parse_time_to_seconds(os.environ.get("BOT_TOKEN_EXPIRE_TIME", "1y"))
+
+# Bot Config Cache Configuration
+# Max age (in seconds) of a worker's cached bot config. Changes are pushed to workers, this is a safety net.
+BOT_CONFIG_CACHE_TTL: int = int(os.environ.get("BOT_CONFIG_CACHE_TTL", 300))
+BOT_CONFIG_CACHE_MAX_SIZE: int = int(os.environ.get("BOT_CONFIG_CACHE_MAX_SIZE", 1024))
+
+# Retrieval Cache Configuration
+# How long (in seconds) a retrieval result is reused for the same question. Content changes invalidate it. 0 disables.
+RETRIEVAL_CACHE_TTL: int = int(os.environ.get("RETRIEVAL_CACHE_TTL", 86400))
+
+# Rerank Cache Configuration
+# How long (in seconds) the ranking of the same candidates for the same question is reused. 0 disables.
+RERANK_CACHE_TTL: int = int(os.environ.get("RERANK_CACHE_TTL", 86400))
+
+# CPU Offload Configuration
+# Threads for CPU-heavy work that releases the GIL (tokenizing). 0 runs it on the event loop.
+OFFLOAD_THREADS: int = int(os.environ.get("OFFLOAD_THREADS", 4))
+# Processes for pure-Python work (embedding assets in replies). 0 uses the threads instead.
+OFFLOAD_PROCESSES: int = int(os.environ.get("OFFLOAD_PROCESSES", 1))
+# Payloads (in characters) smaller than these run on the event loop, where it's cheaper than handing them off
+OFFLOAD_MIN_THREAD_SIZE: int = int(os.environ.get("OFFLOAD_MIN_THREAD_SIZE", 32_000))
+OFFLOAD_MIN_PROCESS_SIZE: int = int(os.environ.get("OFFLOAD_MIN_PROCESS_SIZE", 256_000))
+# How often (in seconds) to sample how long the event loop is blocked for. 0 disables.
+LOOP_LAG_INTERVAL: float = float(os.environ.get("LOOP_LAG_INTERVAL", 0.5))
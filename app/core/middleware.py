@@ -1,38 +1,81 @@
 import json
+from typing import Optional, List
 
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.requests import Request
-from starlette.responses import JSONResponse, Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
 
+# Where routes report the status of their API response, see catch_exceptions
+STATE_STATUS_KEY: str = "api_status"
 
-class StatusMiddleware(BaseHTTPMiddleware):
 
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
+class StatusMiddleware:
+    """
+    Set the HTTP status of JSON responses to the 'status' of the API response.
 
-        response: Response = await call_next(request)
+    Routes report the status out-of-band on request.state, in which case the body is streamed through untouched.
+    Any other JSON response (e.g. from an exception handler) falls back to reading the status from the body.
 
-        if response.headers.get('content-type') == 'application/json':
-            return await self.handle_json_status(request, response)
+    """
 
-        return response
+    def __init__(self, app: ASGIApp):
+        self.app: ASGIApp = app
 
-    async def handle_json_status(self, request: Request, response: Response):
-        binary = b''
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
 
-        # noinspection PyUnresolvedReferences
-        async for data in response.body_iterator:
-            binary += data
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
 
-        body: dict = json.loads(binary.decode())
+        held_start: Optional[Message] = None
+        held_body: List[bytes] = []
 
-        if "error" in body and not self.stack_trace_enabled(request):
-            del body["error"]
+        async def send_wrapper(message: Message) -> None:
+            nonlocal held_start
 
-        return JSONResponse(
-            content=body,
-            status_code=body.get('status', response.status_code)
-        )
+            if message["type"] == "http.response.start":
+                status: Optional[int] = scope.get("state", {}).get(STATE_STATUS_KEY)
+
+                if status is not None:
+                    message["status"] = status
+                    return await send(message)
+
+                if Headers(raw=message.get("headers", [])).get("content-type") != "application/json":
+                    return await send(message)
+
+                # No out-of-band status, so hold the start until we've seen the body
+                held_start = message
+                return
+
+            if message["type"] == "http.response.body" and held_start is not None:
+                held_body.append(message.get("body", b""))
+
+                if message.get("more_body", False):
+                    return
+
+                return await self.send_json_status(scope, held_start, b"".join(held_body), send)
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def send_json_status(self, scope: Scope, start: Message, body: bytes, send: Send) -> None:
+        """Fallback for JSON responses that did not report their status out-of-band"""
+
+        try:
+            content = json.loads(body)
+        except ValueError:
+            content = None
+
+        if isinstance(content, dict):
+            start["status"] = content.get("status", start["status"])
+
+            if "error" in content and not self.stack_trace_enabled(scope):
+                del content["error"]
+                body = json.dumps(content).encode("utf-8")
+                MutableHeaders(scope=start)["content-length"] = str(len(body))
+
+        await send(start)
+        await send({"type": "http.response.body", "body": body, "more_body": False})
 
     @classmethod
-    def stack_trace_enabled(cls, request: Request) -> bool:
-        return request.headers.get("x-api-stacktrace", "") == "true"
+    def stack_trace_enabled(cls, scope: Scope) -> bool:
+        return Headers(scope=scope).get("x-api-stacktrace", "") == "true"
@@ -1,6 +1,7 @@
+import copy
 import logging
 from abc import abstractmethod
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
 from CriadexSDK.ragflow_sdk import RAGFlowSDK
 from CriadexSDK.ragflow_schemas import AuthCheckResponse, GroupAuthCheckResponse
@@ -11,6 +12,11 @@ from starlette.responses import JSONResponse
 
 from app.controllers.schemas import UnauthorizedResponse
 from criabot.criabot import Criabot
+from criabot.tokens import BotTokenSigner, BotTokenPayload, BotTokenError
+
+if TYPE_CHECKING:
+    # The cache objects import app.core, so they can't be imported at module level
+    from criabot.cache.objects.auth import AuthCache, AuthDecision
 
 api_key_header: APIKeyQuery = APIKeyQuery(name="x-api-key", auto_error=False)
 api_key_query: APIKeyHeader = APIKeyHeader(name="x-api-key", auto_error=False)
@@ -64,23 +70,75 @@ class GetApiKey:
 
         return api_key
 
+    async def get_token(self) -> Optional[BotTokenPayload]:
+        """Verify a signed bot token locally. Returns None if the key is an opaque Criadex key."""
+
+        if not BotTokenSigner.is_token(self.api_key) or self.criabot.bot_tokens is None:
+            return None
+
+        try:
+            payload: BotTokenPayload = self.criabot.bot_tokens.verify(self.api_key)
+        except BotTokenError as ex:
+            raise BadAPIKeyException(
+                status_code=401,
+                detail=str(ex)
+            )
+
+        if await self.criabot.redis_api.revocations.is_revoked(payload):
+            raise BadAPIKeyException(
+                status_code=401,
+                detail="This bot token has been revoked."
+            )
+
+        return payload
+
+    @property
+    def auth_cache(self) -> "AuthCache":
+        return self.criabot.redis_api.auth
+
     async def get_auth(self) -> AuthCheckResponse:
+        api_key: str = self.api_key
+
+        # Serve recent decisions without the Criadex round trip
+        decision: Optional["AuthDecision"] = await self.auth_cache.get(api_key=api_key)
+
+        if decision is not None:
+            return decision.model_dump()
 
         response: AuthCheckResponse = await self.criadex.auth.check(
-            api_key=self.api_key
+            api_key=api_key
         )
 
+        await self._cache_decision(api_key=api_key, response=response)
+
         return response
 
     async def get_group_auth(self, group_name: str) -> GroupAuthCheckResponse:
+        api_key: str = self.api_key
+
+        decision: Optional["AuthDecision"] = await self.auth_cache.get(api_key=api_key, group_name=group_name)
+
+        if decision is not None:
+            return decision.model_dump()
 
         response: GroupAuthCheckResponse = await self.criadex.group_auth.check(
             group_name=group_name,
-            api_key=self.api_key
+            api_key=api_key
         )
 
+        await self._cache_decision(api_key=api_key, response=response, group_name=group_name)
+
         return response
 
+    async def _cache_decision(self, api_key: str, response, group_name: Optional[str] = None) -> None:
+        """Cache a Criadex auth check of a key, unless it's an error or a malformed response"""
+
+        from criabot.cache.objects.auth import AuthDecision
+        decision: Optional["AuthDecision"] = AuthDecision.from_response(response)
+
+        if decision is not None:
+            await self.auth_cache.set(api_key=api_key, decision=decision, group_name=group_name)
+
     async def __call__(
             self,
             request: Request,
@@ -89,24 +147,27 @@ class GetApiKey:
     ) -> str:
         """Check the API key"""
 
+        # One instance serves every request of its routes, so each request is checked on its own copy
+        check: GetApiKey = copy.copy(self)
+
         # Retrieve the API key
-        self.api_key = (
+        check.api_key = (
                 self._resolve_api_key(query_api_key) or self._resolve_api_key(header_api_key)
         )
 
-        self.criabot: Criabot = request.app.criabot
-        self.criadex: RAGFlowSDK = request.app.criabot.criadex
-        self.request: Request = request
+        check.criabot = request.app.criabot
+        check.criadex = request.app.criabot.criadex
+        check.request = request
 
         # Make sure an API key was passed
-        if self.api_key is None:
+        if check.api_key is None:
             raise BadAPIKeyException(
                 status_code=401,
                 detail="No API key was sent for this action."
             )
 
         # Handle errors
-        return await self.execute()
+        return await check.execute()
 
 
 class BadAPIKeyException(HTTPException):
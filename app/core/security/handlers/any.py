@@ -8,6 +8,16 @@ class GetApiKeyAny(GetApiKey):
 
     async def execute(self) -> str:
 
+        # Signed bot tokens are verified locally & are never master
+        if await self.get_token() is not None:
+            if self.criadex._error_stacktrace:
+                raise BadAPIKeyException(
+                    status_code=401,
+                    detail="Only master keys can access stacktraces!"
+                )
+
+            return self.api_key
+
         response: AuthCheckResponse = await self.get_auth()
 
         if not response['authorized']:
@@ -6,6 +6,7 @@ from starlette.requests import Request
 
 from app.controllers.schemas import APIResponse
 from app.core.security.get_api_key import GetApiKey, BadAPIKeyException
+from criabot.tokens import BotTokenPayload, BotTokenSigner
 
 BotNameFuncType: Type = Awaitable[str]
 
@@ -28,15 +29,68 @@ class GetApiKeyBots(GetApiKey):
             return bot_name
 
         # Grab from the JSON payload
-        try:
-            json_body: dict = await self.request.json()
-            bot_name = (json_body or dict()).get("bot_name")
-        except JSONDecodeError:
-            pass
+        json_body: Optional[dict] = await self.read_json_body()
+
+        if isinstance(json_body, dict):
+            bot_name = json_body.get("bot_name")
 
         return bot_name
 
+    async def read_json_body(self) -> Optional[dict]:
+        """
+        Get the decoded JSON body, shared on request.state so it is decoded at most once per request.
+        FastAPI decodes the body for model binding (via the cached request.json()) before it solves
+        dependencies, so this re-uses that result instead of decoding the payload a second time.
+
+        :return: The decoded body, or None if it isn't JSON
+
+        """
+
+        if not hasattr(self.request.state, "json_body"):
+            try:
+                self.request.state.json_body = await self.request.json()
+            except (JSONDecodeError, UnicodeDecodeError):
+                self.request.state.json_body = None
+
+        return self.request.state.json_body
+
+    async def execute_token(self, token: BotTokenPayload) -> str:
+        """Authorize a verified signed bot token without calling Criadex"""
+
+        if self.criadex._error_stacktrace:
+            raise BadAPIKeyException(
+                status_code=401,
+                detail="Only master keys can access stacktraces!"
+            )
+
+        if token.scope != BotTokenSigner.BOT_SCOPE:
+            raise BadAPIKeyException(
+                status_code=401,
+                detail="Your token does not have the scope for this action."
+            )
+
+        bot_name: Optional[str] = await self.read_bot_name()
+
+        if not bot_name:
+            raise BadAPIKeyException(
+                status_code=400,
+                detail="Bot name not included in params!"
+            )
+
+        if bot_name != token.bot:
+            raise BadAPIKeyException(
+                status_code=401,
+                detail="Your key is not authorized for accessing this bot."
+            )
+
+        return self.api_key
+
     async def execute(self) -> str:
+        token: Optional[BotTokenPayload] = await self.get_token()
+
+        if token is not None:
+            return await self.execute_token(token)
+
         auth_response: AuthCheckResponse = await self.get_auth()
 
         # Master keys go brr
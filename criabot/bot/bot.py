@@ -18,7 +18,7 @@ class Bot:
     INDEX_SUFFIX: Dict[str, str] = {
         "QUESTION": "-question-index",
         "DOCUMENT": "-document-index",
-        # "CACHE": "-cache-index"
+        "CACHE": "-cache-index"
     }
 
     def __init__(
@@ -249,8 +249,22 @@ class Bot:
             file.model_dump(),
             is_update=is_update
         )
+
+        # Cached retrievals no longer reflect the content
+        await self._cache_api.retrievals.bump(bot_name=self._name)
         return response
 
+    async def add_cache_file(self, file: dict):
+        """
+        Upload an entry to the answer cache. Unlike add_group_content(), this is not a content change.
+
+        :param file: The file, in the question upload format
+        :return: The response from Criadex SDK
+
+        """
+
+        return await self._upload_group_file("CACHE", file, is_update=False)
+
     async def delete_group_file(self, index_type, document_name):
         """
         Delete an item from an index
@@ -265,6 +279,9 @@ class Bot:
             group_name=group_name,
             document_name=document_name
         )
+
+        # Cached retrievals no longer reflect the content
+        await self._cache_api.retrievals.bump(bot_name=self._name)
         return response
 
     async def list_group_files(self, index_type):
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import uuid
+from typing import Optional, List, Set, Awaitable, NamedTuple
+
+from CriadexSDK.ragflow_schemas import TextNodeWithScore, GroupSearchResponse, RelatedPrompt
+
+from criabot.bot.bot import Bot
+from criabot.cache.objects.retrievals import RetrievalCache
+
+INDEX_TYPE: str = "CACHE"
+
+
+class AnswerCacheLookup(NamedTuple):
+    node: Optional[TextNodeWithScore]
+    search_units: int
+
+    # Content generation the lookup was made at. A reply to the prompt is stored under it.
+    generation: int
+
+
+class AnswerCache:
+    """
+    Semantic cache of first-turn replies, stored as questions in the bot's CACHE group.
+
+    Each entry's file name carries the bot's content generation when it was written,
+    so entries from before a content change or a parameter update are never served (& are deleted when found).
+
+    """
+
+    # Entries searched per lookup, so stale entries above a fresh one don't hide it
+    LOOKUP_CANDIDATES: int = 5
+
+    FILE_NAME_PREFIX: str = "answer-cache"
+    ANSWER_METADATA_KEY: str = "answer"
+    FILE_NAME_METADATA_KEY: str = "file_name"
+    RELATED_PROMPTS_METADATA_KEY: str = "related_prompts"
+
+    # Writes & cleanups run after the reply is sent. Referenced here until done so they aren't garbage collected.
+    _background: Set[asyncio.Task] = set()
+
+    def __init__(self, bot: Bot, generations: RetrievalCache, min_score: float):
+        """
+        Instantiate the cache
+
+        :param bot: The bot
+        :param generations: Source of the bot's content generation
+        :param min_score: Min similarity for an earlier prompt's reply to be reused
+
+        """
+
+        self._bot: Bot = bot
+        self._generations: RetrievalCache = generations
+        self._min_score: float = min_score
+
+    @classmethod
+    def file_name(cls, generation: int) -> str:
+        return f"{cls.FILE_NAME_PREFIX}-{generation}-{uuid.uuid4()}"
+
+    @classmethod
+    def file_generation(cls, file_name: Optional[str]) -> Optional[int]:
+        """The content generation an entry was written at"""
+
+        if not file_name or not file_name.startswith(cls.FILE_NAME_PREFIX + "-"):
+            return None
+
+        generation: str = file_name[len(cls.FILE_NAME_PREFIX) + 1:].split("-", 1)[0]
+        return int(generation) if generation.isdigit() else None
+
+    async def lookup(self, prompt: str) -> AnswerCacheLookup:
+        """
+        Find the reply to an earlier prompt similar enough to this one
+
+        :param prompt: The prompt
+        :return: The entry if one is fresh & similar enough
+
+        """
+
+        search, generations = await asyncio.gather(
+            self._bot.search_group(
+                index_type=INDEX_TYPE,
+                search_config={
+                    "query": prompt,
+                    "top_k": self.LOOKUP_CANDIDATES,
+                    "min_k": self._min_score,
+                    "top_n": self.LOOKUP_CANDIDATES,
+                    "min_n": self._min_score,
+                    "search_filter": None,
+                    "extra_groups": []
+                }
+            ),
+            self._generations.generations([self._bot.name])
+        )
+
+        response: GroupSearchResponse = search["response"]
+        miss: AnswerCacheLookup = AnswerCacheLookup(node=None, search_units=response.search_units, generation=generations[0])
+
+        fresh: Optional[TextNodeWithScore] = None
+        stale: Set[str] = set()
+
+        for node in sorted(response.nodes, key=lambda n: n.score or 0, reverse=True):
+            if (node.score or 0) < self._min_score:
+                break
+
+            file_name: Optional[str] = node.node.metadata.get(self.FILE_NAME_METADATA_KEY)
+
+            if self.file_generation(file_name) != generations[0]:
+                if file_name:
+                    stale.add(file_name)
+            elif fresh is None:
+                fresh = node
+
+        for file_name in stale:
+            self._run_in_background(self._delete(file_name=file_name))
+
+        return miss._replace(node=fresh)
+
+    @classmethod
+    def answer(cls, node: TextNodeWithScore) -> str:
+        return node.node.metadata.get(cls.ANSWER_METADATA_KEY) or ""
+
+    @classmethod
+    def related_prompts(cls, node: TextNodeWithScore) -> List[RelatedPrompt]:
+        return node.node.metadata.get(cls.RELATED_PROMPTS_METADATA_KEY) or []
+
+    def store_later(self, prompt: str, answer: str, related_prompts: List[RelatedPrompt], generation: int) -> None:
+        """
+        Write a reply to the cache once the current reply is sent
+
+        :param generation: The generation from the lookup made BEFORE retrieving the reply's context
+
+        """
+
+        self._run_in_background(
+            self._store(prompt=prompt, answer=answer, related_prompts=related_prompts, generation=generation)
+        )
+
+    async def _store(self, prompt: str, answer: str, related_prompts: List[RelatedPrompt], generation: int) -> None:
+        await self._bot.add_cache_file(
+            file={
+                "file_name": self.file_name(generation),
+                "file_contents": {
+                    "questions": [prompt],
+                    "answer": answer,
+                    "llm_reply": False,
+                    "related_prompts": [
+                        p.model_dump() if hasattr(p, "model_dump") else p for p in related_prompts
+                    ]
+                },
+                "file_metadata": {}
+            }
+        )
+
+    async def _delete(self, file_name: Optional[str]) -> None:
+        if file_name:
+            await self._bot.criadex.content.delete(group_name=self._bot.group_name(INDEX_TYPE), document_name=file_name)
+
+    @classmethod
+    def _run_in_background(cls, coroutine: Awaitable[None]) -> None:
+        task: asyncio.Task = asyncio.ensure_future(coroutine)
+        cls._background.add(task)
+        task.add_done_callback(cls._on_done)
+
+    @classmethod
+    def _on_done(cls, task: asyncio.Task) -> None:
+        cls._background.discard(task)
+
+        if not task.cancelled() and task.exception() is not None:
+            logging.error("Answer cache write failed", exc_info=task.exception())
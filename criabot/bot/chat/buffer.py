@@ -1,11 +1,12 @@
 from pprint import pprint
-from typing import List, Optional, Type
+from collections import deque
+from typing import List, Optional, Type, Iterator, Deque, Dict, Any
 
-import tiktoken
-from CriadexSDK.ragflow_schemas import ChatMessage, TextBlock
+from criabot.bot.chat.message import Message
+from criabot.bot.chat.tokenizer import Tokenizer, get_tokenizer, DEFAULT_ENCODING, TruncateKeep
 
 
-def string_tokens(string: str, encoding_name: str = "cl100k_base") -> int:
+def string_tokens(string: str, encoding_name: str = DEFAULT_ENCODING) -> int:
     """
     Returns the number of tokens in a text string.
 
@@ -14,16 +15,24 @@ def string_tokens(string: str, encoding_name: str = "cl100k_base") -> int:
 
     """
 
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string))
+    return get_tokenizer(encoding_name).count(string)
 
-    return num_tokens
 
-
-History: Type = List[ChatMessage]
+History: Type = List[Message]
 
 
 class ChatBuffer:
+    """
+    Token-bounded chat history.
+
+    The system message, the messages in the window & their token total are kept as state,
+    so adding a message only counts that message & trimming only touches the messages it drops.
+
+    A rolling summary of the messages before the window can be pinned after the system message.
+    Its tokens are reserved like the system message's.
+
+    """
+
     EXTRA_TOKEN_MARGIN: int = 5
     TOKEN_COUNT_META_NAME: str = "token_count"
     EPHEMERAL_META_NAME: str = "is_ephemeral"
@@ -31,13 +40,44 @@ class ChatBuffer:
     def __init__(
             self,
             max_tokens: int,
-            history: List[ChatMessage]
+            history: List[Message],
+            tokenizer: Optional[Tokenizer] = None,
+            truncate_keep: TruncateKeep = "head",
+            summary: Optional[Message] = None
     ):
-        self._history: List[ChatMessage] = history
         self._max_tokens: int = max_tokens
+        self._added: List[Message] = []
+        self._tokenizer: Tokenizer = tokenizer or get_tokenizer()
+        self._truncate_keep: TruncateKeep = truncate_keep
+
+        history = history.copy()
+        system_message: Optional[Message] = self.pop_system(history=history)
+
+        self.create_history_token_metadata(history=history, tokenizer=self._tokenizer)
+        self._window: Deque[Message] = deque(history)
+        self._window_tokens: int = self.history_tokens(history)
+        self._dropped: int = 0
+
+        self._summary: Optional[Message] = summary
+        self._summary_tokens: int = 0
+
+        if summary is not None:
+            summary.metadata[self.EPHEMERAL_META_NAME] = False
+
+            if self.TOKEN_COUNT_META_NAME not in summary.metadata:
+                self.create_chat_token_metadata(message=summary, tokenizer=self._tokenizer)
+
+            self._summary_tokens = self.get_token_metadata(summary)
+
+        self._system_message: Optional[Message] = None
+        self._system_tokens: int = 0
+
+        if system_message is not None:
+            self._set_system(message=system_message, update_buffer=False)
+            self._added.clear()
 
     @classmethod
-    def history_tokens(cls, history_with_metadata: List[ChatMessage]) -> int:
+    def history_tokens(cls, history_with_metadata: List[Message]) -> int:
         """
         Count the number of tokens in a chat history
 
@@ -49,40 +89,124 @@ class ChatBuffer:
         return sum([m.metadata.get(ChatBuffer.TOKEN_COUNT_META_NAME, 0) for m in history_with_metadata])
 
     @classmethod
-    def create_history_token_metadata(cls, history: History) -> None:
-        """Calculate tokens in a message and add it to the metadata"""
-        for message in history:
-            if cls.TOKEN_COUNT_META_NAME not in message.metadata:
-                cls.create_chat_token_metadata(message=message)
+    def message_texts(cls, message: Message) -> List[str]:
+        return message.texts
 
     @classmethod
-    def create_chat_token_metadata(cls, message: ChatMessage) -> int:
-        token_count: int = sum([
-            string_tokens(block.text)
-            for block in message.blocks if isinstance(block, TextBlock)
-        ])
+    def create_history_token_metadata(cls, history: History, tokenizer: Optional[Tokenizer] = None) -> None:
+        """Calculate tokens in the messages missing them & add it to the metadata, in one batch"""
+
+        uncounted: History = [m for m in history if cls.TOKEN_COUNT_META_NAME not in m.metadata]
+
+        if not uncounted:
+            return
+
+        texts: List[List[str]] = [cls.message_texts(m) for m in uncounted]
+        counts: Iterator[int] = iter((tokenizer or get_tokenizer()).count_batch([text for t in texts for text in t]))
+
+        for message, message_texts in zip(uncounted, texts):
+            message.metadata[cls.TOKEN_COUNT_META_NAME] = sum(next(counts) for _ in message_texts)
+
+    @classmethod
+    def create_chat_token_metadata(cls, message: Message, tokenizer: Optional[Tokenizer] = None) -> int:
+        token_count: int = sum((tokenizer or get_tokenizer()).count_batch(cls.message_texts(message)))
         message.metadata[cls.TOKEN_COUNT_META_NAME] = token_count
         return token_count
 
     @classmethod
-    def get_token_metadata(cls, message: ChatMessage) -> int:
+    def get_token_metadata(cls, message: Message) -> int:
         """Retrieve the metadata for a token, return 0 if missing"""
         value = message.metadata.get(ChatBuffer.TOKEN_COUNT_META_NAME)
         return value if value is not None else 0
 
     @property
-    def history(self) -> List[ChatMessage]:
-        """Get a copy of the history"""
-        return self._history
+    def history(self) -> List[Message]:
+        """Get a copy of the history, system message first"""
+        return ([self._system_message] if self._system_message is not None else []) + list(self._window)
+
+    @property
+    def system_message(self) -> Optional[Message]:
+        return self._system_message
+
+    @property
+    def summary(self) -> Optional[Message]:
+        return self._summary
+
+    @property
+    def tokens(self) -> int:
+        """Tokens in the history, system message included"""
+        return self._system_tokens + self._window_tokens
+
+    @property
+    def dropped(self) -> int:
+        """How many of the messages the buffer was created with or given have been trimmed from the window"""
+        return self._dropped
+
+    @property
+    def added(self) -> List[Message]:
+        """Messages added since the buffer was created, including any since trimmed from the history"""
+        return self._added
 
-    def add_message(self, message: ChatMessage, update_buffer: bool = True) -> History:
+    def add_message(self, message: Message, update_buffer: bool = True) -> History:
         """Add a message to the history"""
-        self._history.append(message)
-        return self.buffer() if update_buffer else self._history
+
+        if message.role == "system":
+            return self._set_system(message=message, update_buffer=update_buffer)
+
+        if self.TOKEN_COUNT_META_NAME not in message.metadata:
+            self.create_chat_token_metadata(message=message, tokenizer=self._tokenizer)
+
+        self._window.append(message)
+        self._window_tokens += self.get_token_metadata(message)
+        self._added.append(message)
+
+        return self.buffer() if update_buffer else self.history
+
+    def _set_system(self, message: Message, update_buffer: bool = True) -> History:
+        """Set the system message, if the history doesn't have one yet"""
+
+        if self._system_message is not None:
+            raise ValueError("There should only be one system message! Got: " + str([self._system_message, message]))
+
+        message.metadata[self.EPHEMERAL_META_NAME] = False
+
+        if self.TOKEN_COUNT_META_NAME not in message.metadata:
+            self.create_chat_token_metadata(message=message, tokenizer=self._tokenizer)
+
+        self._system_message = message
+        self._system_tokens = self.get_token_metadata(message)
+        self._added.append(message)
+
+        return self.buffer() if update_buffer else self.history
+
+    @classmethod
+    def window_start(cls, history: History, available_tokens: int) -> int:
+        """
+        Find where the longest tail of the history that fits in the available tokens starts, in one backward pass.
+        The newest message is always kept, even if it doesn't fit on its own.
+
+        :param history: The history assuming it has the token count metadata
+        :param available_tokens: The token budget
+        :return: The index of the first message to keep
+
+        """
+
+        total: int = 0
+        start: int = len(history)
+
+        for message in reversed(history):
+            total += message.metadata.get(cls.TOKEN_COUNT_META_NAME) or 0
+
+            if total > available_tokens:
+                break
+
+            start -= 1
+
+        return min(start, max(len(history) - 1, 0))
 
     @classmethod
-    def get_system(cls, history: History) -> Optional[ChatMessage]:
-        system_messages: List[ChatMessage] = [m for m in history if m.role == "system"]
+    def get_system(cls, history: History) -> Optional[Message]:
+        system_messages: List[Message] = [m for m in history if m.role == "system"]
 
         if len(system_messages) > 1:
             raise ValueError("There should only be one system message! Got: " + str(system_messages))
@@ -90,71 +214,68 @@ class ChatBuffer:
         return system_messages[0] if bool(system_messages) else None
 
     @classmethod
-    def pop_system(cls, history: History) -> Optional[ChatMessage]:
+    def pop_system(cls, history: History) -> Optional[Message]:
         """In-place list mod to pop a system message from a list"""
 
-        system_message: Optional[ChatMessage] = cls.get_system(history=history)
+        system_message: Optional[Message] = cls.get_system(history=history)
         history[:] = [m for m in history if m.role != "system"]
         return system_message
 
-    def buffer(
-            self,
-            system_ephemeral: Optional[ChatMessage] = None,
-            print_debug: bool = False
-    ) -> List[ChatMessage]:
-        """Update the buffer. Ephemerals are NOT included in history but are returned by the func."""
-
-        # Shallow-copy history & pop the system message
-        history: History = self._history.copy()
-        system_message: Optional[ChatMessage] = self.pop_system(history=history)
+    def available_tokens(self, system_ephemeral: Optional[Message] = None) -> int:
+        """Tokens left for the history once the system messages & margin are reserved"""
 
-        # Calculate the tokens for the whole history
-        self.create_history_token_metadata(history=history)
-
-        # Set tokens & set ephemeral
-        if isinstance(system_ephemeral, ChatMessage):
-            system_ephemeral.metadata[self.EPHEMERAL_META_NAME] = True
-            self.create_chat_token_metadata(message=system_ephemeral)
-
-        # Set tokens & set not ephemeral
-        if isinstance(system_message, ChatMessage):
-            system_message.metadata[self.EPHEMERAL_META_NAME] = False
-            self.create_chat_token_metadata(message=system_message)
-
-        # Calculate the available tokens
-        available_tokens: int = max(
+        return max(
             0,
             self._max_tokens
-            - (self.get_token_metadata(system_message) if system_message else 0)
+            - self._system_tokens
+            - self._summary_tokens
             - (self.get_token_metadata(system_ephemeral) if system_ephemeral else 0)
             - self.EXTRA_TOKEN_MARGIN
         )
 
-        if print_debug:
-            print("Available Tokens Before Reserved:", self._max_tokens)
-            print("Available Tokens After Reserved:", available_tokens)
-            print("Tokens Reserved:", (self._max_tokens - available_tokens))
+    def _trim(self, available_tokens: int, print_debug: bool = False) -> None:
+        """Drop the oldest messages until the window fits, keeping at least the newest one"""
 
-        message_count: int = len(history)
-        while self.history_tokens(history[-message_count:]) > available_tokens and message_count > 1:
-            message_count -= 1
-
-        history: History = history[-message_count:]
+        while self._window_tokens > available_tokens and len(self._window) > 1:
+            self._window_tokens -= self.get_token_metadata(self._window.popleft())
+            self._dropped += 1
 
         # Handle single-prompt length issue
-        if len(history) == 1:
+        if len(self._window) == 1 and self._window_tokens > available_tokens:
             self.buffer_message(
-                message=history[0],
+                message=self._window[0],
                 max_tokens=available_tokens,
-                print_debug=print_debug
+                print_debug=print_debug,
+                tokenizer=self._tokenizer,
+                keep=self._truncate_keep
             )
+            self._window_tokens = self.get_token_metadata(self._window[0])
 
-        # Re-add the system message
-        if system_message is not None:
-            history.insert(0, system_message)
+    def buffer(
+            self,
+            system_ephemeral: Optional[Message] = None,
+            print_debug: bool = False
+    ) -> List[Message]:
+        """Update the buffer. Ephemerals are NOT included in history but are returned by the func."""
+
+        # Set tokens & set ephemeral. Compiled prompts come with their count
+        if isinstance(system_ephemeral, Message):
+            system_ephemeral.metadata[self.EPHEMERAL_META_NAME] = True
 
-        # Update stored history EXCLUDING the ephemeral
-        self._history = history.copy()
+            if self.TOKEN_COUNT_META_NAME not in system_ephemeral.metadata:
+                self.create_chat_token_metadata(message=system_ephemeral, tokenizer=self._tokenizer)
+
+        # Calculate the available tokens
+        available_tokens: int = self.available_tokens(system_ephemeral=system_ephemeral)
+
+        if print_debug:
+            print("Available Tokens Before Reserved:", self._max_tokens)
+            print("Available Tokens After Reserved:", available_tokens)
+            print("Tokens Reserved:", (self._max_tokens - available_tokens))
+
+        # The trim is permanent, the ephemeral's reservation included
+        self._trim(available_tokens=available_tokens, print_debug=print_debug)
+        history: History = self.history
 
         # The ephemeral is always the SECOND-LAST message (just before user prompt)
         if system_ephemeral is not None:
@@ -163,36 +284,57 @@ class ChatBuffer:
                 system_ephemeral
             )
 
+        # The summary is pinned right after the system message
+        if self._summary is not None:
+            history.insert(1 if self._system_message is not None else 0, self._summary)
+
         return history
 
     @classmethod
     def buffer_message(
             cls,
-            message: ChatMessage,
+            message: Message,
             max_tokens: int,
-            print_debug: bool = False
-    ) -> ChatMessage:
+            print_debug: bool = False,
+            tokenizer: Optional[Tokenizer] = None,
+            keep: TruncateKeep = "head"
+    ) -> Message:
+        """
+        Truncate a message to fit in max_tokens. Each text block is encoded once & cut at the exact token.
 
-        while cls.create_chat_token_metadata(message) > max_tokens:
-            excess_tokens: int = abs(max_tokens - cls.get_token_metadata(message))
+        :param message: The message, modified in-place
+        :param max_tokens: The token budget for all of its text
+        :param print_debug: Print the truncation
+        :param tokenizer: The tokenizer to count with
+        :param keep: Keep the start ("head") or the end ("tail") of the message
+        :return: The message
 
-            # 1 token is approx. 4 chars, so we'll do some math to remove an approximate amount
-            # We use a val of 3 to multiply because we don't want to accidentally overshoot
-            remove_n_chars: int = excess_tokens * 3
+        """
+
+        tokenizer = tokenizer or get_tokenizer()
+
+        # Already counted & fits. Otherwise, truncating gives the count anyway
+        if cls.TOKEN_COUNT_META_NAME in message.metadata and cls.get_token_metadata(message) <= max_tokens:
+            return message
+
+        blocks: List[Dict[str, Any]] = message.text_blocks
+        remaining_tokens: int = max_tokens
+
+        # Spend the budget from the end being kept, so the blocks at the other end are cut first
+        for block in (blocks if keep == "head" else reversed(blocks)):
+            original_length: int = len(block["text"])
+            block["text"], token_count = tokenizer.truncate(block["text"], max_tokens=remaining_tokens, keep=keep)
+            remaining_tokens -= token_count
 
             if print_debug:
                 print(
-                    "Prompt Characters:", len(message.blocks[0].text),
-                    "| Prompt Tokens:", cls.get_token_metadata(message),
-                    "| Remove N Characters:", remove_n_chars,
-                    "| Exceeding N Tokens:", excess_tokens,
-                    "| Current Prompt: ", f"{message.blocks[0].text}"
+                    "Prompt Characters:", original_length,
+                    "| Kept Characters:", len(block["text"]),
+                    "| Kept Tokens:", token_count,
+                    "| Max Tokens:", max_tokens
                 )
 
-            message.blocks[0].text = message.blocks[0].text[:-remove_n_chars]
-
-        # Update at the end
-        message.metadata[cls.TOKEN_COUNT_META_NAME] = cls.get_token_metadata(message)
+        message.metadata[cls.TOKEN_COUNT_META_NAME] = max_tokens - remaining_tokens
         return message
 
 
@@ -200,33 +342,33 @@ if __name__ == '__main__':
     chat_buffer: ChatBuffer = ChatBuffer(
         50,
         history=[
-            ChatMessage(
+            Message(
                 role="system",
-                blocks=[TextBlock(text="This has to be included no matter what lol")]
+                text="This has to be included no matter what lol"
             ),
-            ChatMessage(
+            Message(
                 role="user",
-                blocks=[TextBlock(text="What's the weather like in New York today?")]
+                text="What's the weather like in New York today?"
             ),
-            ChatMessage(
+            Message(
                 role="assistant",
-                blocks=[TextBlock(text="I'm sorry, I cannot provide real-time updates. Would you like me to bot_auth for the weather forecast for New York?")]
+                text="I'm sorry, I cannot provide real-time updates. Would you like me to bot_auth for the weather forecast for New York?"
             ),
-            ChatMessage(
+            Message(
                 role="user",
-                blocks=[TextBlock(text="Yes, please do that")]
+                text="Yes, please do that"
             ),
-            ChatMessage(
+            Message(
                 role="assistant",
-                blocks=[TextBlock(text="No can do buckaroo")]
+                text="No can do buckaroo"
             ),
-            ChatMessage(
+            Message(
                 role="user",
-                blocks=[TextBlock(text="How can I improve my French language skills quickly?")]
+                text="How can I improve my French language skills quickly?"
             ),
-            ChatMessage(
+            Message(
                 role="assistant",
-                blocks=[TextBlock(text="To improve your French quickly, you could immerse yourself in the language, practice regularly with native speakers, use language learning apps, and take formal classes. Consistent daily practice and immersion are key to rapid progress.")]
+                text="To improve your French quickly, you could immerse yourself in the language, practice regularly with native speakers, use language learning apps, and take formal classes. Consistent daily practice and immersion are key to rapid progress."
             )
         ]
     )
@@ -234,8 +376,8 @@ if __name__ == '__main__':
     pprint(
         chat_buffer.buffer(
             print_debug=False,
-            system_ephemeral=ChatMessage(
-                blocks=[TextBlock(text="Hey there this is a long message")],
+            system_ephemeral=Message(
+                text="Hey there this is a long message",
                 role="system"
             )
         )
@@ -0,0 +1,147 @@
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from CriadexSDK.ragflow_schemas import TextNodeWithScore
+from pydantic import BaseModel
+
+
+class PrunedCandidates(BaseModel):
+    nodes: List[TextNodeWithScore]
+    candidates: int
+    duplicates: int = 0
+    below_min_k: int = 0
+    over_quota: int = 0
+
+
+class CandidatePruner:
+    """
+    Cuts the search results down to the candidates worth sending to the reranker.
+
+    Repeats of a node (by ID, or by content when it has none) are merged, keeping the best score.
+    Nodes below min_k are dropped unless fewer than top_n would be left. The rest are taken best score
+    first from each group in turn, so every group gets an equal share of max_candidates, and a group's
+    unused share goes to the others.
+
+    A search response holds the nodes of every group searched with it (e.g. the extra bots' groups),
+    so the group of a node is the one in its metadata, not the response it came in.
+
+    """
+
+    GROUP_NAME_METADATA_KEY: str = "group_name"
+
+    def __init__(self, min_k: float, top_n: int, max_candidates: int):
+        """
+        Instantiate the pruner
+
+        :param min_k: Min search score of a candidate
+        :param top_n: Candidates always kept (if there are that many), whatever their score
+        :param max_candidates: Max candidates sent to the reranker, 0 for no limit
+
+        """
+
+        self.min_k: float = min_k
+        self.top_n: int = top_n
+        self.max_candidates: int = max_candidates
+
+    @classmethod
+    def node_key(cls, node: TextNodeWithScore) -> str:
+        return node.node.id_ or hashlib.sha256(node.node.text.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def source_group(cls, node: TextNodeWithScore, response_name: str) -> str:
+        """The group a node was found in, or the response it came in if it doesn't say"""
+        return node.node.metadata.get(cls.GROUP_NAME_METADATA_KEY) or response_name
+
+    def prune(self, group_nodes: Dict[str, List[TextNodeWithScore]]) -> PrunedCandidates:
+        """
+        Select the rerank candidates
+
+        :param group_nodes: The nodes of each search response
+        :return: The candidates, best score first within each group's turn
+
+        """
+
+        candidates: int = sum(len(nodes) for nodes in group_nodes.values())
+
+        # Merge repeats, remembering the group of each node's best copy
+        best: Dict[str, Tuple[str, TextNodeWithScore]] = {}
+
+        for response_name, nodes in group_nodes.items():
+            for node in nodes:
+                group_name: str = self.source_group(node, response_name)
+                key: str = self.node_key(node)
+                kept: Optional[Tuple[str, TextNodeWithScore]] = best.get(key)
+
+                if kept is None or (node.score or 0) > (kept[1].score or 0):
+                    best[key] = (group_name, node)
+
+        duplicates: int = candidates - len(best)
+        unique: List[Tuple[str, TextNodeWithScore]] = sorted(best.values(), key=lambda g: g[1].score or 0, reverse=True)
+
+        # Low scores go, but never below top_n
+        keep: int = max(self.top_n, sum(1 for _, node in unique if (node.score or 0) >= self.min_k))
+        below_min_k: int = max(0, len(unique) - keep)
+        unique = unique[:keep]
+
+        # Take the best of each group in turn until the cap
+        queues: Dict[str, List[TextNodeWithScore]] = {}
+
+        for group_name, node in unique:
+            queues.setdefault(group_name, []).append(node)
+
+        limit: int = min(len(unique), self.max_candidates) if self.max_candidates > 0 else len(unique)
+        selected: List[TextNodeWithScore] = []
+        turn: int = 0
+
+        while len(selected) < limit:
+            for queue in queues.values():
+                if turn < len(queue) and len(selected) < limit:
+                    selected.append(queue[turn])
+            turn += 1
+
+        return PrunedCandidates(
+            nodes=selected,
+            candidates=candidates,
+            duplicates=duplicates,
+            below_min_k=below_min_k,
+            over_quota=len(unique) - len(selected)
+        )
+
+
+class PruningStats:
+    """How much smaller pruning made the rerank requests of this process"""
+
+    def __init__(self):
+        self.reranks: int = 0
+        self.candidates: int = 0
+        self.sent: int = 0
+        self.duplicates: int = 0
+        self.below_min_k: int = 0
+        self.over_quota: int = 0
+
+    def record(self, pruned: PrunedCandidates) -> None:
+        self.reranks += 1
+        self.candidates += pruned.candidates
+        self.sent += len(pruned.nodes)
+        self.duplicates += pruned.duplicates
+        self.below_min_k += pruned.below_min_k
+        self.over_quota += pruned.over_quota
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        return {
+            "reranks": self.reranks,
+            "candidates": self.candidates,
+            "sent": self.sent,
+            "duplicates": self.duplicates,
+            "below_min_k": self.below_min_k,
+            "over_quota": self.over_quota,
+            "reduction": round(1 - self.sent / self.candidates, 4) if self.candidates else 0.0
+        }
+
+
+@lru_cache(maxsize=None)
+def get_pruning_stats() -> PruningStats:
+    """Get this process's pruning stats"""
+    return PruningStats()
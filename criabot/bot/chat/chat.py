@@ -1,26 +1,40 @@
+import asyncio
 import logging
 import traceback
 from typing import List, Optional, Dict, Tuple
 
 from CriadexSDK.ragflow_sdk import RAGFlowSDK
-from CriadexSDK.ragflow_schemas import ChatMessage, ChatResponse, CompletionUsage, Filter, TextNodeWithScore, GroupSearchResponse
+from CriadexSDK.ragflow_schemas import Asset, ChatResponse, CompletionUsage, Filter, TextNodeWithScore, GroupSearchResponse
+from pydantic import BaseModel
 
 from criabot.bot.bot import Bot
 from criabot.bot.chat.buffer import ChatBuffer, History
+from criabot.bot.chat.message import Message
+from criabot.bot.chat.tokenizer import Tokenizer, get_tokenizer
+from criabot.bot.chat.packing import ContextPacker
+from criabot.bot.chat.prompts import PromptArtifacts
+from criabot.bot.chat.candidates import CandidatePruner
+from criabot.bot.chat.answer_cache import AnswerCache, AnswerCacheLookup
+from criabot.bot.chat.compaction import (
+    build_transcript,
+    build_summary_prompt,
+    build_summary_message,
+    read_summary,
+    get_compactor
+)
 from criabot.bot.chat.context import (
     build_context_prompt,
     ContextRetriever,
     QuestionContext,
     TextContext,
-    build_no_context_guess_prompt,
-    build_no_context_llm_prompt,
     ContextRetrieverResponse
 )
 from criabot.bot.chat.schemas import ChatReply, ChatReplyContent
-from criabot.bot.chat.utils import extract_used_assets, strip_asset_data_from_group_responses
+from criabot.bot.chat.utils import extract_used_assets, strip_asset_data_from_group_responses, embed_assets_in_message
 from criabot.cache.api import BotCacheAPI
 from criabot.cache.objects.chats import ChatModel
 from criabot.database.bots.tables.bot_params import BotParametersModel
+from criabot.offload import get_offloader
 
 
 class Chat:
@@ -35,8 +49,17 @@ class Chat:
         rerank_model_id: int,
         chat_model: ChatModel,
         bot_parameters: BotParametersModel,
-        chat_id: str
+        chat_id: str,
+        history: Optional[List[Message]] = None,
+        prompts: Optional[PromptArtifacts] = None
     ):
+        """
+        Instantiate a chat
+
+        :param history: The chat's messages if already read as Message, otherwise they're converted from the chat model
+        :param prompts: The bot's compiled prompts, otherwise they're compiled from the parameters
+
+        """
 
         if not isinstance(chat_model, ChatModel):
             raise ValueError("Must have a valid chat model broski!")
@@ -50,35 +73,76 @@ class Chat:
         self._llm_model_id = llm_model_id
         self._rerank_model_id = rerank_model_id
         self.chat_reply_metadata = {}
+        self._tokenizer: Tokenizer = get_tokenizer(bot_parameters.tokenizer_encoding)
+        self._prompts: PromptArtifacts = prompts or PromptArtifacts.compile(bot_parameters)
+        self._answer_cache: AnswerCache = AnswerCache(
+            bot=bot,
+            generations=self._cache_api.retrievals,
+            min_score=bot_parameters.answer_cache_min_score
+        )
 
-        # Build the context retriever
+        # Build the context retriever, with the documents capped so they can't crowd the history out
         self._retriever = ContextRetriever(
             criadex=self._criadex,
             rerank_model_id=self._rerank_model_id,
             llm_model_id=llm_model_id,
             bot=bot,
-            bot_params=bot_parameters
+            bot_params=bot_parameters,
+            packer=ContextPacker(
+                tokenizer=self._tokenizer,
+                max_tokens=bot_parameters.max_context_tokens or bot_parameters.max_input_tokens // 2
+            ),
+            pruner=CandidatePruner(
+                min_k=bot_parameters.min_k,
+                top_n=bot_parameters.top_n,
+                max_candidates=bot_parameters.max_rerank_candidates
+            ),
+            cache=self._cache_api.retrievals,
+            rerank_cache=self._cache_api.reranks
         )
 
-        # Now generate the chat buffer
+        if history is None:
+            history = [Message.from_chat_message(m) for m in chat_model.history]
+
+        # Messages already in the summary aren't buffered again
+        history = [m for m in history if m.role != "system"]
+        summarized: int = max(0, min(chat_model.summarized - chat_model.history_start, len(history)))
+        self._history_start: int = chat_model.history_start + summarized
+
+        # Now generate the chat buffer, with the bot's current system message in place of the stored one
         self._buffer = ChatBuffer(
             max_tokens=self._bot_parameters.max_input_tokens,
-            history=chat_model.update_system_message(
-                system_message=ChatMessage(
-                    role="system",
-                    blocks=[{"type": "text", "text": bot_parameters.system_message}],
-                    additional_kwargs={},
-                    metadata=self.chat_reply_metadata
-                )
-            ).history
+            tokenizer=self._tokenizer,
+            history=[
+                self._static_message(text=self._prompts.system_message, tokens=self._prompts.system_message_tokens),
+                *history[summarized:]
+            ],
+            summary=Message.from_chat_message(chat_model.summary) if chat_model.summary else None
         )
 
+    def _static_message(self, text: str, tokens: int) -> Message:
+        """A system message from the compiled prompts, with its known token count"""
+
+        message: Message = Message(role="system", text=text, metadata=self.chat_reply_metadata)
+        message.metadata[ChatBuffer.TOKEN_COUNT_META_NAME] = tokens
+        return message
+
+    async def _count_tokens(self, *messages: Message) -> None:
+        """Count the tokens of messages about to be buffered, so big ones are tokenized off the event loop"""
+        await self._tokenizer.count_batch_async([text for message in messages for text in message.texts])
+
     @property
     def bot(self) -> Bot:
         """Get the bot associated with a chat"""
         return self._bot
 
-    def history(self) -> List[ChatMessage]:
+    @property
+    def chat_model(self) -> ChatModel:
+        """The chat with its current history"""
+        self._chat_model.history = [m.to_chat_message() for m in self._buffer.history]
+        return self._chat_model
+
+    def history(self) -> List[Message]:
         """Retrieve the chat history"""
         return self._buffer.history
 
@@ -91,21 +155,40 @@ class Chat:
         """Send a message to the bot and receive a reply"""
 
         # Context, Dict(SearchResponse)
-        response: ContextRetrieverResponse = await self._retriever.retrieve(
-            prompt=prompt,
-            metadata_filter=metadata_filter,
-            extra_bots=extra_bots
+        retrieval: asyncio.Task = asyncio.ensure_future(
+            self._retriever.retrieve(
+                prompt=prompt,
+                metadata_filter=metadata_filter,
+                extra_bots=extra_bots
+            )
         )
 
+        # First prompts similar enough to an earlier one are answered with its reply.
+        # Searched alongside the retrieval, so a miss costs no extra round trip.
+        cache_lookup: Optional[AnswerCacheLookup] = None
+
+        if self._answer_cache_applies(metadata_filter=metadata_filter, extra_bots=extra_bots):
+            try:
+                cache_lookup = await self._lookup_answer_cache(prompt=prompt)
+            except asyncio.CancelledError:
+                retrieval.cancel()
+                raise
+
+            if cache_lookup is not None and cache_lookup.node is not None:
+                retrieval.cancel()
+                await asyncio.gather(retrieval, return_exceptions=True)
+                return await self._answer_cache_reply(prompt=prompt, lookup=cache_lookup)
+
+        response: ContextRetrieverResponse = await retrieval
+
         # Add the user's prompt to the buffer
-        self._buffer.add_message(
-            message=ChatMessage(
-                role="user",
-                blocks=[{"type": "text", "text": prompt}],
-                additional_kwargs={},
-                metadata=self.chat_reply_metadata
-            )
+        prompt_message: Message = Message(
+            role="user",
+            text=prompt,
+            metadata=self.chat_reply_metadata
         )
+        await self._count_tokens(prompt_message)
+        self._buffer.add_message(message=prompt_message)
 
         # Generate the response history
         if isinstance(response.context, TextContext):
@@ -120,16 +203,17 @@ class Chat:
         # Add the token usage
         token_usage: List[CompletionUsage] = ([reply_tokens] if reply_tokens else []) + response.token_usage
 
-        # Update the chat model with our new *actual* history (excludes ephemeral)
-        self._chat_model.history = self._buffer.history
-
-        # Update cache with our updated chat model
-        await self._cache_api.chats.set(
+        # Only the new messages need to be written
+        await self._cache_api.chats.append(
             chat_id=self._chat_id,
-            chat_model=self._chat_model
+            messages=self._buffer.added,
+            system_message=self._buffer.system_message
         )
 
-        response_message: ChatMessage = reply_history[-1]
+        if self._bot_parameters.compaction_enabled:
+            self._schedule_compaction()
+
+        response_message: Message = reply_history[-1]
 
         related_prompts = response.context.related_prompts if response.context else []
         if self._bot_parameters.llm_generate_related_prompts and not related_prompts:
@@ -138,7 +222,7 @@ class Chat:
                     model_id=self._llm_model_id,
                     agent_config={
                         "llm_prompt": prompt,
-                        "llm_reply": response_message.blocks[0].text,
+                        "llm_reply": response_message.text,
                         "max_reply_tokens": 500,
                         "temperature": 0.1
                     }
@@ -154,19 +238,38 @@ class Chat:
                 # Don't want this to actually cause issues if the agent fails because the LLM sucks
                 logging.error("Failed to generate related prompts! " + traceback.format_exc())
 
+        # Embedding big assets is slow, pure-Python work
+        used_assets: List[Asset] = list(extract_used_assets(assets=response.assets, text=response_message.text))
+        content: str = await get_offloader().run_in_process(
+            sum(len(asset.data) for asset in used_assets),
+            embed_assets_in_message,
+            response_message.text,
+            used_assets
+        )
+
+        # Only replies grounded in the bot's content are reused, and only if they're complete without the assets
+        if cache_lookup is not None and isinstance(response.context, TextContext) and not used_assets:
+            self._answer_cache.store_later(
+                prompt=prompt,
+                answer=response_message.text,
+                related_prompts=related_prompts,
+                generation=cache_lookup.generation
+            )
+
         # Return reply
         return ChatReply(
             prompt=prompt,
             content=ChatReplyContent.from_message(
                 message=response_message,
-                assets=extract_used_assets(assets=response.assets, text=response_message.blocks[0].text)
+                assets=used_assets,
+                content=content
             ),
-            history=[m.model_dump() for m in reply_history],
+            history=[m.to_dict() for m in reply_history],
             group_responses=strip_asset_data_from_group_responses(response.group_responses),
             context=response.context,
             related_prompts=related_prompts,
             token_usage=token_usage,
-            search_units=response.search_units,
+            search_units=response.search_units + (cache_lookup.search_units if cache_lookup else 0),
             verified_response=response.context.context_type == "QUESTION" if response.context else False,
             total_usage={
                 "completion_tokens": sum(usage.completion_tokens for usage in token_usage),
@@ -176,14 +279,169 @@ class Chat:
             },
         )
 
-    async def _query_llm(self, history):
-        """Send a chat to the LLM and receive a reply."""
+    @classmethod
+    def filter_is_empty(cls, metadata_filter: Optional[Filter]) -> bool:
+        """Whether a metadata filter lets everything through, e.g. the default one with no clauses"""
+
+        if metadata_filter is None:
+            return True
+
+        clauses: dict = (
+            metadata_filter.model_dump(mode="json", exclude_none=True)
+            if isinstance(metadata_filter, BaseModel) else metadata_filter
+        )
+
+        return not any(clauses.values())
+
+    def _answer_cache_applies(self, metadata_filter: Optional[Filter], extra_bots: List[str]) -> bool:
+        """Whether to search the answer cache. Only first prompts are, & filtered or multi-bot searches aren't cached."""
+
+        return (
+                self._bot_parameters.answer_cache_enabled
+                and self.filter_is_empty(metadata_filter)
+                and not extra_bots
+                and len(self._buffer.history) <= 1
+                and self._buffer.summary is None
+        )
+
+    async def _lookup_answer_cache(self, prompt: str) -> Optional[AnswerCacheLookup]:
+        """Search the answer cache, treating any failure as a miss"""
+
+        try:
+            return await self._answer_cache.lookup(prompt=prompt)
+        except Exception:
+            # The cache is an optimization, never fail the chat over it
+            logging.error("Failed to search the answer cache! " + traceback.format_exc())
+            return None
+
+    async def _answer_cache_reply(self, prompt: str, lookup: AnswerCacheLookup) -> ChatReply:
+        """Reply with the cached reply to an earlier, similar first prompt"""
+
+        prompt_message: Message = Message(role="user", text=prompt, metadata=self.chat_reply_metadata)
+        await self._count_tokens(prompt_message)
+        self._buffer.add_message(message=prompt_message, update_buffer=False)
+
+        response_message: Message = Message(
+            role="assistant",
+            text=AnswerCache.answer(lookup.node),
+            metadata={
+                "answer_cache": {"score": lookup.node.score},
+                **self.chat_reply_metadata
+            }
+        )
+        await self._count_tokens(response_message)
+        self._buffer.add_message(message=response_message)
+
+        await self._cache_api.chats.append(
+            chat_id=self._chat_id,
+            messages=self._buffer.added,
+            system_message=self._buffer.system_message
+        )
+
+        return ChatReply(
+            prompt=prompt,
+            content=ChatReplyContent.from_message(message=response_message, assets=[]),
+            history=[m.to_dict() for m in self._buffer.history],
+            group_responses={},
+            context=None,
+            related_prompts=AnswerCache.related_prompts(lookup.node),
+            token_usage=[],
+            search_units=lookup.search_units,
+            verified_response=False,
+            total_usage={
+                "completion_tokens": 0,
+                "prompt_tokens": 0,
+                "total_tokens": 0,
+                "usage_label": "All"
+            },
+        )
+
+    def _schedule_compaction(self) -> bool:
+        """Summarize the stored messages that were trimmed from the buffer in the background, if not already"""
+
+        summarized: int = self._chat_model.summarized
+        window_start: int = self._history_start + self._buffer.dropped
+
+        if window_start <= summarized:
+            return False
+
+        return get_compactor().schedule(
+            chat_id=self._chat_id,
+            compact=lambda: self._compact(summarized=summarized, window_start=window_start)
+        )
+
+    async def _compact(self, summarized: int, window_start: int) -> bool:
+        """
+        Fold the stored messages from the end of the summary up to the buffer window into the summary
+
+        :param summarized: How many stored messages the current summary covers
+        :param window_start: Index of the first stored message still in the buffer window
+        :return: Whether a new summary was saved
+
+        """
+
+        chats = self._cache_api.chats
+        dropped_tokens: int = await chats.tokens_between(chat_id=self._chat_id, start=summarized, end=window_start)
+
+        if dropped_tokens < self._bot_parameters.compaction_threshold_tokens:
+            return False
+
+        # The newest dropped turns matter most if they don't all fit in one prompt
+        transcript, _ = self._tokenizer.truncate(
+            build_transcript(await chats.read_range(chat_id=self._chat_id, start=summarized, end=window_start)),
+            max_tokens=self._bot_parameters.max_input_tokens,
+            keep="tail"
+        )
+
+        chat_response = await self._query_llm(
+            history=[
+                Message(
+                    role="user",
+                    text=build_summary_prompt(
+                        previous_summary=read_summary(self._buffer.summary) if self._buffer.summary else None,
+                        transcript=transcript
+                    )
+                )
+            ],
+            max_reply_tokens=self._bot_parameters.compaction_summary_tokens,
+            temperature=0.1
+        )
+
+        reply: Message = self._reply_message(chat_response)
+        summary_text, _ = self._tokenizer.truncate(
+            reply.text.strip(),
+            max_tokens=self._bot_parameters.compaction_summary_tokens
+        )
+
+        summary: Message = build_summary_message(summary_text)
+        ChatBuffer.create_chat_token_metadata(message=summary, tokenizer=self._tokenizer)
+
+        return await chats.set_summary(
+            chat_id=self._chat_id,
+            summary=summary,
+            summarized=window_start,
+            read_summarized=summarized
+        )
+
+    @classmethod
+    def _reply_message(cls, chat_response) -> Message:
+        """The message in a chat response from _query_llm()"""
+
+        if isinstance(chat_response, dict):
+            msg = chat_response["message"]
+            return Message.from_dict(msg) if isinstance(msg, dict) else Message.from_chat_message(msg)
+
+        return Message.from_chat_message(chat_response.message)
+
+    async def _query_llm(self, history, **overrides):
+        """Send a chat to the LLM and receive a reply. Overrides replace bot parameters in the agent config."""
 
         # Synthesize a reply based on our new info
         agent_config = {
-            "history": [msg.model_dump() for msg in history],
+            "history": [msg.to_dict() for msg in history],
             "chat_id": self._chat_id,
-            **self._bot_parameters.model_dump()
+            **self._bot_parameters.model_dump(),
+            **overrides
         }
         response = await self._criadex.agents.azure.chat(
             model_id=self._llm_model_id,
@@ -224,51 +482,37 @@ class Chat:
 
     async def _text_context_reply(self, context):
         # Add the ephemeral context
-        buffered_history = self._buffer.buffer(
-            system_ephemeral=ChatMessage(
-                role="system",
-                blocks=[{"type": "text", "text": build_context_prompt(context, best_guess=self._bot_parameters.no_context_llm_guess)}],
-                additional_kwargs={},
-                metadata=self.chat_reply_metadata
-            )
+        # Only the documents need counting. Tokens can merge across the join, so the sum never undercounts
+        context_tokens: int = (await self._tokenizer.count_batch_async([context.text]))[0]
+        ephemeral: Message = self._static_message(
+            text=build_context_prompt(context, prompts=self._prompts),
+            tokens=self._prompts.context_prefix_tokens + context_tokens
         )
+        buffered_history = self._buffer.buffer(system_ephemeral=ephemeral)
         # Synthesize a reply based on our new info
         chat_response = await self._query_llm(history=buffered_history)
         if isinstance(chat_response, dict):
             msg = chat_response["message"]
-            if isinstance(msg, dict):
-                msg = ChatMessage(
-                    role=msg.get("role", "assistant"),
-                    blocks=msg.get("blocks", [{"type": "text", "text": msg.get("content", "")}]),
-                    additional_kwargs=msg.get("additional_kwargs", {}),
-                    metadata=msg.get("metadata", {})
-                )
+            msg = Message.from_dict(msg) if isinstance(msg, dict) else Message.from_chat_message(msg)
             self._buffer.add_message(message=msg)
             buffered_history.append(msg)
             usage_dict = chat_response.get("usage", None)
             reply_tokens = CompletionUsage(**usage_dict) if usage_dict else None
             return buffered_history, reply_tokens, chat_response.get("message", {}).get("content", "")
         else:
-            self._buffer.add_message(message=chat_response.message)
-            buffered_history.append(chat_response.message)
+            msg = Message.from_chat_message(chat_response.message)
+            self._buffer.add_message(message=msg)
+            buffered_history.append(msg)
             return buffered_history, chat_response.raw.usage, chat_response.message.content
 
     # ↓↓↓ DE-INDENTED FUNCTIONS ↓↓↓
     async def _no_context_llm_guess(self):
         # Add the ephemeral best guess prompt
-        buffered_history = self._buffer.buffer(
-            system_ephemeral=ChatMessage(
-                role="system",
-                blocks=[{"type": "text", "text": build_no_context_guess_prompt(
-                    no_context_message=(
-                        self._bot_parameters.no_context_message
-                        if self._bot_parameters.no_context_use_message else None
-                    )
-                )}],
-                additional_kwargs={},
-                metadata=self.chat_reply_metadata
-            )
+        ephemeral: Message = self._static_message(
+            text=self._prompts.no_context_guess,
+            tokens=self._prompts.no_context_guess_tokens
         )
+        buffered_history = self._buffer.buffer(system_ephemeral=ephemeral)
         # Synthesize a reply based on our new info
         chat_response = await self._query_llm(history=buffered_history)
         if self._bot_parameters.no_context_use_message:
@@ -288,59 +532,61 @@ class Chat:
         if isinstance(chat_response, dict):
             msg = chat_response["message"]
             if isinstance(msg, dict):
-                msg = ChatMessage(
+                msg = Message(
                     role=msg.get("role", "assistant"),
-                    blocks=[{"type": "text", "text": msg.get("content", "")}],
+                    text=msg.get("content", ""),
                     additional_kwargs=msg.get("additional_kwargs", {}),
                     metadata=msg.get("metadata", {})
                 )
+            else:
+                msg = Message.from_chat_message(msg)
             self._buffer.add_message(message=msg)
             buffered_history.append(msg)
             usage_dict = chat_response.get("usage", None)
             reply_tokens = CompletionUsage(**usage_dict) if usage_dict else None
             return buffered_history, reply_tokens
         else:
-            self._buffer.add_message(message=chat_response.message)
-            buffered_history.append(chat_response.message)
+            msg = Message.from_chat_message(chat_response.message)
+            self._buffer.add_message(message=msg)
+            buffered_history.append(msg)
             return buffered_history, chat_response.raw.usage
 
     async def _no_context_llm_message(self):
         # Add the ephemeral best guess prompt
-        buffered_history = self._buffer.buffer(
-            system_ephemeral=ChatMessage(
-                role="system",
-                blocks=[{"type": "text", "text": build_no_context_llm_prompt()}],
-                additional_kwargs={},
-                metadata=self.chat_reply_metadata
-            )
+        ephemeral: Message = self._static_message(
+            text=self._prompts.no_context_llm,
+            tokens=self._prompts.no_context_llm_tokens
         )
+        buffered_history = self._buffer.buffer(system_ephemeral=ephemeral)
         # Synthesize a reply based on our new info
         chat_response = await self._query_llm(history=buffered_history)
         if isinstance(chat_response, dict):
             msg = chat_response["message"]
             if isinstance(msg, dict):
-                msg = ChatMessage(
+                msg = Message(
                     role=msg.get("role", "assistant"),
-                    blocks=[{"type": "text", "text": msg.get("content", "")}],
+                    text=msg.get("content", ""),
                     additional_kwargs=msg.get("additional_kwargs", {}),
                     metadata=msg.get("metadata", {})
                 )
+            else:
+                msg = Message.from_chat_message(msg)
             self._buffer.add_message(message=msg)
             buffered_history.append(msg)
             usage_dict = chat_response.get("usage", None)
             reply_tokens = CompletionUsage(**usage_dict) if usage_dict else None
             return buffered_history, reply_tokens
         else:
-            self._buffer.add_message(message=chat_response.message)
-            buffered_history.append(chat_response.message)
+            msg = Message.from_chat_message(chat_response.message)
+            self._buffer.add_message(message=msg)
+            buffered_history.append(msg)
             return buffered_history, chat_response.raw.usage
 
     def _no_context_saved_message(self):
         self._buffer.add_message(
-            message=ChatMessage(
+            message=Message(
                 role="assistant",
-                blocks=[{"type": "text", "text": self._bot_parameters.no_context_message}],
-                additional_kwargs={},
+                text=self._bot_parameters.no_context_message,
                 metadata=self.chat_reply_metadata
             )
         )
@@ -366,10 +612,9 @@ class Chat:
 
         # Generate the fake "AI" response
         self._buffer.add_message(
-            message=ChatMessage(
+            message=Message(
                 role="assistant",
-                blocks=[{"type": "text", "text": context.node.node.metadata.get(ContextRetriever.ANSWER_METADATA_KEY)}],
-                additional_kwargs={},
+                text=context.node.node.metadata.get(ContextRetriever.ANSWER_METADATA_KEY),
                 metadata={
                     "no_llm_reply": {
                         "file_name": context.node.node.metadata.get(ContextRetriever.FILE_NAME_METADATA_KEY),
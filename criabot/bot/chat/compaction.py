@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import textwrap
+from functools import lru_cache
+from typing import Dict, List, Optional, Callable, Awaitable
+
+from criabot.bot.chat.message import Message
+
+SUMMARY_META_NAME: str = "is_summary"
+SUMMARY_HEADER: str = "[CONVERSATION SUMMARY]"
+
+
+def build_transcript(messages: List[Message]) -> str:
+    """Plain-text transcript of messages for the summarizer"""
+    return "\n\n".join(f"{message.role.upper()}: {message.text}" for message in messages)
+
+
+def build_summary_prompt(previous_summary: Optional[str], transcript: str) -> str:
+    """
+    Build the prompt that folds the turns dropped from the buffer into the running summary
+
+    :param previous_summary: The summary so far, if any
+    :param transcript: The dropped turns
+    :return: The prompt
+
+    """
+
+    previous: str = (
+        f"[SUMMARY SO FAR]\n{previous_summary}\n\n"
+        if previous_summary else ""
+    )
+
+    return textwrap.dedent(
+        """
+        [INSTRUCTIONS]
+        Update the summary of this conversation with the turns below, which no longer fit in the chat history.
+        Keep the facts, questions & answers the user may refer back to, and anything they told you about themselves.
+        Be concise. Reply with the summary only.
+
+        """
+    ) + previous + f"[TURNS]\n{transcript}"
+
+
+def build_summary_message(summary: str) -> Message:
+    """The message pinned after the system message"""
+
+    return Message(
+        role="system",
+        text=f"{SUMMARY_HEADER}\n{summary}",
+        metadata={SUMMARY_META_NAME: True}
+    )
+
+
+def read_summary(message: Message) -> str:
+    """The summary in a message built by build_summary_message()"""
+    return message.text.removeprefix(SUMMARY_HEADER).strip()
+
+
+class ChatCompactor:
+    """
+    Runs chat summarizations in the background, so they never delay a reply.
+    At most one runs per chat in this worker. Across workers, the summary is only saved if no other got there first.
+
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        self.completed: int = 0
+        self.failed: int = 0
+
+    def schedule(self, chat_id: str, compact: Callable[[], Awaitable[bool]]) -> bool:
+        """
+        Start summarizing a chat, unless it already is
+
+        :param chat_id: The ID of the chat
+        :param compact: Does the summarizing, returning whether the summary was saved
+        :return: Whether it was started
+
+        """
+
+        if chat_id in self._tasks:
+            return False
+
+        task: asyncio.Task = asyncio.create_task(compact())
+        self._tasks[chat_id] = task
+        task.add_done_callback(lambda t: self._on_done(chat_id, t))
+        return True
+
+    def _on_done(self, chat_id: str, task: asyncio.Task) -> None:
+        self._tasks.pop(chat_id, None)
+
+        if task.cancelled():
+            return
+
+        if task.exception() is not None:
+            self.failed += 1
+            logging.error("Failed to summarize chat %s", chat_id, exc_info=task.exception())
+        elif task.result():
+            self.completed += 1
+
+    async def stop(self) -> None:
+        """Cancel the running summarizations"""
+
+        tasks: List[asyncio.Task] = list(self._tasks.values())
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+@lru_cache(maxsize=None)
+def get_compactor() -> ChatCompactor:
+    """Get this process's chat compactor"""
+    return ChatCompactor()
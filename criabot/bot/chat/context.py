@@ -1,7 +1,5 @@
 import asyncio
 import itertools
-import re
-import textwrap
 from typing import List, Optional, Dict, Awaitable, Union, Type
 
 from CriadexSDK.ragflow_sdk import RAGFlowSDK
@@ -10,7 +8,19 @@ from pydantic import BaseModel
 
 from criabot.bot.bot import Bot
 from criabot.bot.chat.buffer import History
+from criabot.bot.chat.candidates import CandidatePruner, PrunedCandidates, get_pruning_stats
+from criabot.bot.chat.packing import ContextPacker, PackedContext, DOCUMENT_SEPARATOR, document_header
+from criabot.bot.chat.prompts import (
+    PromptArtifacts,
+    clean_text,
+    collapse_spaces,
+    context_prompt_prefix,
+    no_context_guess_prompt,
+    no_context_llm_prompt
+)
 from criabot.bot.chat.schemas import RelatedPrompt, Context, QuestionContext, TextContext
+from criabot.cache.objects.reranks import RerankCache, RankedCandidate
+from criabot.cache.objects.retrievals import RetrievalCache, CachedRetrieval
 from criabot.database.bots.tables.bot_params import BotParametersModel
 
 GroupSearchResponses: Type = Dict[str, GroupSearchResponse]
@@ -58,13 +68,31 @@ class ContextRetriever:
             rerank_model_id,
             llm_model_id,
             bot,
-            bot_params
+            bot_params,
+            packer: Optional[ContextPacker] = None,
+            pruner: Optional[CandidatePruner] = None,
+            cache: Optional[RetrievalCache] = None,
+            rerank_cache: Optional[RerankCache] = None
     ):
+        """
+        Instantiate the retriever
+
+        :param packer: Fits the text context into a token budget. Without it, every reranked node is included.
+        :param pruner: Cuts the search results down before the rerank. Without it, every node is reranked.
+        :param cache: Reuses the results of identical retrievals, if given
+        :param rerank_cache: Reuses the ranking of the same candidates for the same prompt, if given
+
+        """
+
         self._criadex = criadex
         self._rerank_model_id = rerank_model_id
         self._llm_model_id = llm_model_id
         self._bot = bot
         self._bot_params = bot_params
+        self._packer = packer
+        self._pruner = pruner
+        self._cache = cache
+        self._rerank_cache = rerank_cache
 
     async def search_groups(
             self,
@@ -91,26 +119,87 @@ class ContextRetriever:
             self,
             prompt,
             nodes,
+    ):
+        if self._rerank_cache is None or not self._rerank_cache.enabled:
+            return await self._hybrid_rerank(prompt=prompt, nodes=nodes)
+
+        cache_key: str = RerankCache.entry_key(
+            prompt=prompt,
+            candidates=nodes,
+            top_n=self._bot_params.top_n,
+            min_n=self._bot_params.min_n,
+            model_id=self._rerank_model_id
+        )
+
+        ranking: Optional[List[RankedCandidate]] = await self._rerank_cache.get(cache_key)
+
+        if ranking is not None:
+            return {
+                "ranked_nodes": RerankCache.rebuild(candidates=nodes, ranking=ranking),
+                "search_units": 0
+            }
+
+        rerank_response = await self._hybrid_rerank(prompt=prompt, nodes=nodes)
+        ranking = RerankCache.rank(candidates=nodes, ranked_nodes=rerank_response["ranked_nodes"])
+
+        # Rankings that can't be matched back to the candidates aren't stored
+        if ranking is not None:
+            await self._rerank_cache.set(cache_key, ranking)
+
+        return rerank_response
+
+    async def _hybrid_rerank(
+            self,
+            prompt,
+            nodes,
     ):
         response = await self._criadex.agents.cohere.rerank(
             model_id=self._rerank_model_id,
             agent_config={
                 "prompt": prompt,
-                "nodes": [node.model_dump(mode='json') for node in nodes],
+                "nodes": self.rerank_payload(nodes),
                 "top_n": self._bot_params.top_n,
                 "min_n": self._bot_params.min_n
             }
         )
 
-        reranked_docs = response.get("reranked_documents", [])
-        if reranked_docs and isinstance(reranked_docs[0], dict):
-            reranked_docs = [TextNodeWithScore(**doc) for doc in reranked_docs]
-
         return {
-            "ranked_nodes": reranked_docs,
+            "ranked_nodes": self.rehydrate_ranked_nodes(nodes, response.get("reranked_documents", [])),
             "search_units": 0
         }
 
+    @classmethod
+    def rerank_payload(cls, nodes: List[TextNodeWithScore]) -> List[dict]:
+        """
+        The nodes as the reranker needs them. It only reads the text, so the metadata stays here,
+        and the ID is the node's position for mapping the results back.
+
+        """
+
+        return [
+            {"node": {"id_": str(idx), "text": node.node.text, "metadata": {}}, "score": node.score}
+            for idx, node in enumerate(nodes)
+        ]
+
+    @classmethod
+    def rehydrate_ranked_nodes(cls, nodes: List[TextNodeWithScore], reranked_docs: list) -> List[TextNodeWithScore]:
+        """The original nodes, in the reranked order & with the rerank scores"""
+
+        ranked_nodes: List[TextNodeWithScore] = []
+
+        for doc in reranked_docs:
+            if isinstance(doc, dict):
+                node_id, score = (doc.get("node") or {}).get("id_"), doc.get("score")
+            else:
+                node_id, score = doc.node.id_, doc.score
+
+            if not isinstance(node_id, str) or not node_id.isdigit() or int(node_id) >= len(nodes):
+                continue
+
+            ranked_nodes.append(TextNodeWithScore(node=nodes[int(node_id)].node, score=score))
+
+        return ranked_nodes
+
     def build_search_group_config(
             self,
             prompt,
@@ -157,11 +246,55 @@ class ContextRetriever:
     def is_first_prompt(cls, history):
         return len(history) <= 2
 
+    def cache_query(self, prompt, metadata_filter, extra_bots) -> Dict[str, object]:
+        """Everything besides the bots' content that the result of a retrieval depends on"""
+
+        return {
+            "prompt": RetrievalCache.normalize_prompt(prompt),
+            "filter": (
+                metadata_filter.model_dump(mode="json")
+                if isinstance(metadata_filter, BaseModel) else metadata_filter
+            ),
+            "extra_bots": list(extra_bots),
+            "top_k": self._bot_params.top_k,
+            "min_k": self._bot_params.min_k,
+            "top_n": self._bot_params.top_n,
+            "min_n": self._bot_params.min_n,
+            "rerank_model_id": self._rerank_model_id,
+            "context_tokens": self._packer.max_tokens if self._packer is not None else None,
+            "rerank_candidates": self._pruner.max_candidates if self._pruner is not None else None
+        }
+
     async def retrieve(
             self,
             prompt,
             metadata_filter,
             extra_bots
+    ):
+        if self._cache is None or not self._cache.enabled:
+            return await self._retrieve(prompt=prompt, metadata_filter=metadata_filter, extra_bots=extra_bots)
+
+        cache_key, cached = await self._cache.lookup(
+            bot_names=[self._bot.name, *extra_bots],
+            query=self.cache_query(prompt=prompt, metadata_filter=metadata_filter, extra_bots=extra_bots)
+        )
+
+        # Nothing was searched or reranked, so no search units were used
+        if cached is not None:
+            return ContextRetrieverResponse(context=cached.context, group_responses=cached.group_responses)
+
+        retriever_response = await self._retrieve(prompt=prompt, metadata_filter=metadata_filter, extra_bots=extra_bots)
+        await self._cache.set(
+            cache_key,
+            CachedRetrieval(context=retriever_response.context, group_responses=retriever_response.group_responses)
+        )
+        return retriever_response
+
+    async def _retrieve(
+            self,
+            prompt,
+            metadata_filter,
+            extra_bots
     ):
         retriever_response = ContextRetrieverResponse(
             group_responses={}
@@ -174,7 +307,7 @@ class ContextRetriever:
         )
         retriever_response.search_units = ContextRetrieverResponse.get_search_units(group_responses)
         retriever_response.group_responses = group_responses
-        nodes = retriever_response.nodes
+        nodes = self.prune_candidates(group_responses)
         # If there are no nodes
         if len(nodes) < 1:
             return retriever_response
@@ -188,12 +321,27 @@ class ContextRetriever:
         if len(rerank_response["ranked_nodes"]) > 0:
             retriever_response.context = self.build_context(
                 ranked_nodes=rerank_response["ranked_nodes"],
+                packer=self._packer
             )
         # Give 'er
         return retriever_response
 
+    def prune_candidates(self, group_responses) -> List[TextNodeWithScore]:
+        """The nodes of the group responses to rerank"""
+
+        if self._pruner is None:
+            return list(itertools.chain.from_iterable(r.nodes for r in group_responses.values()))
+
+        pruned: PrunedCandidates = self._pruner.prune({name: r.nodes for name, r in group_responses.items()})
+        get_pruning_stats().record(pruned)
+        return pruned.nodes
+
     @classmethod
-    def build_context(cls, ranked_nodes: List[TextNodeWithScore]) -> Union[QuestionContext, TextContext]:
+    def build_context(
+            cls,
+            ranked_nodes: List[TextNodeWithScore],
+            packer: Optional[ContextPacker] = None
+    ) -> Union[QuestionContext, TextContext]:
 
         top_node_score: float = ranked_nodes[0].score
         top_node: TextNodeWithScore = ranked_nodes[0]
@@ -225,19 +373,29 @@ class ContextRetriever:
             # from multiple nodes, it will only return the Q answer. Or if there is an issue with re-ranking, it will only return the incorrect Q answer.
             # It's a cost-benefit of whether the potential for hallucination is worth the potential for better overall answers.
             top_node.node.metadata.get(cls.ANSWER_METADATA_KEY)
+
+            if packer is None:
+                return TextContext(
+                    text=build_text_context(nodes=[top_node]),
+                    nodes=ranked_nodes,
+                    related_prompts=related_prompts,
+                )
+
+            packed: PackedContext = packer.pack([top_node])
+            return TextContext(text=packed.text, nodes=packed.nodes, related_prompts=related_prompts)
+
+        # Case 2) Top node is not a question or direct response is not requested
+        # This is the main case, text context gets built here
+        if packer is None:
             return TextContext(
-                text=build_text_context(nodes=[top_node]),
+                text=build_text_context(nodes=ranked_nodes),
                 nodes=ranked_nodes,
-                related_prompts=related_prompts,
+                related_prompts=related_prompts
             )
 
-        # Case 2) Top node is not a question or direct response is not requested
-        # This is the main case, text context gets built here
-        return TextContext(
-            text=build_text_context(nodes=ranked_nodes),
-            nodes=ranked_nodes,
-            related_prompts=related_prompts
-        )
+        # Only the nodes that made it into the text, so whatever cites them agrees with the prompt
+        packed: PackedContext = packer.pack(ranked_nodes)
+        return TextContext(text=packed.text, nodes=packed.nodes, related_prompts=related_prompts)
 
     @classmethod
     def is_question_node(cls, node: TextNodeWithScore) -> bool:
@@ -256,96 +414,45 @@ class ContextRetriever:
         return node.node.metadata.get(cls.LLM_REPLY_METADATA_KEY)
 
 
-def build_text_context(nodes: List[TextNodeWithScore]) -> str:
+def build_text_context(nodes: List[TextNodeWithScore], packer: Optional[ContextPacker] = None) -> str:
     """
     Build context given a set of relevant nodes
 
     :param nodes: The relevant nodes
+    :param packer: Fits the nodes into a token budget, if given
     :return: The context string
 
     """
 
+    if packer is not None:
+        return packer.pack(nodes).text
+
     context: List[str] = []
 
     for idx, node in enumerate(nodes):
-        context.append(f"[DOCUMENT #{idx + 1}]\n" + node.node.text)
-
-    return "\n\n".join(context)
-
+        context.append(document_header(idx) + node.node.text)
 
-_RE_COMBINE_MULTISPACE = re.compile(r" +")
+    return DOCUMENT_SEPARATOR.join(context)
 
 
-def clean_text(text: str) -> str:
-    return _RE_COMBINE_MULTISPACE.sub(" ", textwrap.dedent(text)).strip()
-
-
-def build_context_prompt(context: TextContext, best_guess: bool = False) -> str:
+def build_context_prompt(context: TextContext, best_guess: bool = False, prompts: Optional[PromptArtifacts] = None) -> str:
     """
     Build a context-enabled prompt given the components
 
     :param context: The associated context
     :param best_guess: Whether to use best guess if irrelevant content is ranked
+    :param prompts: The bot's compiled prompts, which take precedence over best_guess
     :return: The context prompt
 
     """
 
-    extra_text: str = (
-        "If nothing from this information is relevant, use your knowledge to guess."
-        if best_guess else
-        "If nothing from this information is relevant, say your database don't have that information, even if you do have a guess."
-    )
-
-    return clean_text(
-        f"""
-        [INSTRUCTIONS]
-        The documents below are the top results returned from a search engine.
-        They may be relevant or completely irrelevant to the question.
-       
-        IMPORTANT: If you use ANY information from an IMAGE DESCRIPTION, ALWAYS EMBED THE IMAGE as part of your answer using the format ![Asset](<image_id>),
-        where <image_id> is a placeholder for the uuid found in the image description start/end tags. ONLY include the raw UUID, NEVER a URL.
-        The ID of an image is found in the tags at the start and end of its description in the context below.
-        A description tag looks like this: [IMAGE <image_id> DESCRIPTION START].
-                
-        {extra_text}
-
-        [INFORMATION]
-        {context.text}
-        """
-    )
+    prefix: str = prompts.context_prefix if prompts is not None else context_prompt_prefix(best_guess=best_guess)
+    return prefix + collapse_spaces(context.text)
 
 
 def build_no_context_guess_prompt(no_context_message: Optional[str]) -> str:
-    if no_context_message is not None:
-        no_context_message = no_context_message.replace('\n', '')
-
-        return textwrap.dedent(
-            f"""
-            [EXTRA INSTRUCTIONS]
-            
-            No information was found regarding the following question.
-            The user was already sent the message "{no_context_message}" to let them know this.
-
-            Use your knowledge to suggest what you think. Make sure you say it's a guess.
-            Start your reply with a conjunction, like "However", or "But", and attempt to make a guess.
-            """
-        )
-
-    return textwrap.dedent(
-        """
-        [EXTRA INSTRUCTIONS]
-        
-        No information was found regarding the following question.
-        Use your knowledge to suggest what you think. Make sure you say it's a guess.
-        """
-    )
+    return no_context_guess_prompt(no_context_message=no_context_message)
 
 
 def build_no_context_llm_prompt() -> str:
-    return textwrap.dedent(
-        """
-        [EXTRA INSTRUCTIONS]\n
-        No information was found regarding the following question.\n
-        Respond that you do not know the answer, taking the question into account.
-        """
-    )
+    return no_context_llm_prompt()
@@ -0,0 +1,93 @@
+import json
+from typing import List, Optional, Dict, Any
+
+from CriadexSDK.ragflow_schemas import ChatMessage
+
+
+class Message:
+    """
+    Lightweight chat message used by the buffer & the chat while a reply is generated.
+
+    Blocks are kept in their serialized (dict) form, so a message is only converted to/from a
+    ChatMessage at the edges: reading & writing Redis, and returning the reply.
+
+    """
+
+    __slots__ = ("role", "blocks", "metadata", "additional_kwargs")
+
+    def __init__(
+            self,
+            role: str,
+            text: Optional[str] = None,
+            blocks: Optional[List[Dict[str, Any]]] = None,
+            metadata: Optional[Dict[str, Any]] = None,
+            additional_kwargs: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Instantiate a message
+
+        :param role: system, user or assistant
+        :param text: Shorthand for a single text block
+        :param blocks: The content blocks, as dicts
+        :param metadata: Copied, so messages never share the dict they were built from
+        :param additional_kwargs: Copied, as with the metadata
+
+        """
+
+        self.role: str = role
+        self.blocks: List[Dict[str, Any]] = blocks if blocks is not None else [{"type": "text", "text": text or ""}]
+        self.metadata: Dict[str, Any] = dict(metadata) if metadata else {}
+        self.additional_kwargs: Dict[str, Any] = dict(additional_kwargs) if additional_kwargs else {}
+
+    @classmethod
+    def from_chat_message(cls, message: ChatMessage) -> "Message":
+        return cls(
+            role=getattr(message.role, "value", message.role),
+            blocks=[block.model_dump() for block in message.blocks],
+            metadata=message.metadata,
+            additional_kwargs=getattr(message, "additional_kwargs", None)
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Message":
+        """From a serialized ChatMessage, or an LLM reply that only has its text as 'content'"""
+
+        return cls(
+            role=data.get("role", "assistant"),
+            blocks=data["blocks"] if "blocks" in data else [{"type": "text", "text": data.get("content", "")}],
+            metadata=data.get("metadata"),
+            additional_kwargs=data.get("additional_kwargs")
+        )
+
+    @property
+    def text_blocks(self) -> List[Dict[str, Any]]:
+        return [block for block in self.blocks if "text" in block]
+
+    @property
+    def texts(self) -> List[str]:
+        return [block["text"] for block in self.text_blocks]
+
+    @property
+    def text(self) -> str:
+        """Text of the first text block"""
+        texts: List[str] = self.texts
+        return texts[0] if texts else ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize in the same shape as ChatMessage.model_dump()"""
+
+        return {
+            "role": self.role,
+            "additional_kwargs": self.additional_kwargs,
+            "blocks": self.blocks,
+            "metadata": self.metadata
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def to_chat_message(self) -> ChatMessage:
+        return ChatMessage(**self.to_dict())
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, blocks={self.blocks!r}, metadata={self.metadata!r})"
@@ -0,0 +1,137 @@
+import re
+from typing import List, Set, Tuple, FrozenSet
+
+from CriadexSDK.ragflow_schemas import TextNodeWithScore
+from pydantic import BaseModel
+
+from criabot.bot.chat.prompts import collapse_spaces
+from criabot.bot.chat.tokenizer import Tokenizer
+
+_RE_WORD = re.compile(r"\w+")
+
+DOCUMENT_SEPARATOR: str = "\n\n"
+
+
+def document_header(idx: int) -> str:
+    return f"[DOCUMENT #{idx + 1}]\n"
+
+
+class PackedContext(BaseModel):
+    text: str
+    nodes: List[TextNodeWithScore]
+    tokens: int
+    duplicates: int = 0
+    truncated: bool = False
+
+
+class ContextPacker:
+    """
+    Fits the reranked nodes into a token budget for the context prompt.
+
+    Nodes are taken best score first. Ones that repeat or overlap a node already taken are skipped,
+    and the last node that fits only partly is cut at the exact token.
+
+    """
+
+    # Word n-grams compared to detect near-duplicates & chunks overlapping each other
+    SHINGLE_SIZE: int = 5
+
+    # Share of the smaller node's shingles found in a node already taken, for it to be skipped
+    OVERLAP_THRESHOLD: float = 0.8
+
+    # A node cut shorter than this isn't worth including
+    MIN_TRUNCATED_TOKENS: int = 32
+
+    def __init__(self, tokenizer: Tokenizer, max_tokens: int):
+        """
+        Instantiate the packer
+
+        :param tokenizer: The tokenizer of the bot's LLM
+        :param max_tokens: The token budget for the documents
+
+        """
+
+        self._tokenizer: Tokenizer = tokenizer
+        self.max_tokens: int = max_tokens
+
+    @classmethod
+    def shingles(cls, text: str) -> FrozenSet[Tuple[str, ...]]:
+        words: List[str] = _RE_WORD.findall(text.lower())
+
+        if len(words) < cls.SHINGLE_SIZE:
+            return frozenset([tuple(words)]) if words else frozenset()
+
+        return frozenset(tuple(words[i:i + cls.SHINGLE_SIZE]) for i in range(len(words) - cls.SHINGLE_SIZE + 1))
+
+    @classmethod
+    def overlaps(cls, shingles: FrozenSet[Tuple[str, ...]], taken: FrozenSet[Tuple[str, ...]]) -> bool:
+        """Whether most of the smaller of two nodes is found in the other"""
+
+        smallest: int = min(len(shingles), len(taken))
+
+        if smallest == 0:
+            return len(shingles) == len(taken)
+
+        return len(shingles & taken) / smallest >= cls.OVERLAP_THRESHOLD
+
+    def pack(self, nodes: List[TextNodeWithScore]) -> PackedContext:
+        """
+        Build the documents of the context prompt
+
+        :param nodes: The reranked nodes
+        :return: The documents, the nodes they came from & their token count
+
+        """
+
+        ranked: List[TextNodeWithScore] = sorted(nodes, key=lambda n: n.score or 0, reverse=True)
+        separator_tokens: int = self._tokenizer.count(DOCUMENT_SEPARATOR)
+
+        documents: List[str] = []
+        packed: List[TextNodeWithScore] = []
+        taken: List[FrozenSet[Tuple[str, ...]]] = []
+        seen_texts: Set[str] = set()
+        remaining: int = self.max_tokens
+        duplicates: int = 0
+        truncated: bool = False
+
+        for node in ranked:
+            # Collapsed as in the final prompt, so the token counts are of what the model gets
+            text: str = collapse_spaces(node.node.text)
+
+            if text in seen_texts:
+                duplicates += 1
+                continue
+
+            shingles: FrozenSet[Tuple[str, ...]] = self.shingles(text)
+
+            if any(self.overlaps(shingles, other) for other in taken):
+                duplicates += 1
+                continue
+
+            header: str = document_header(len(documents))
+            overhead: int = self._tokenizer.count(header) + (separator_tokens if documents else 0)
+            text_tokens: int = self._tokenizer.count(text)
+
+            if overhead + text_tokens > remaining:
+                if remaining - overhead < self.MIN_TRUNCATED_TOKENS:
+                    break
+
+                text, text_tokens = self._tokenizer.truncate(text, max_tokens=remaining - overhead)
+                truncated = True
+
+            documents.append(header + text)
+            packed.append(node)
+            taken.append(shingles)
+            seen_texts.add(text)
+            remaining -= overhead + text_tokens
+
+            if truncated:
+                break
+
+        return PackedContext(
+            text=DOCUMENT_SEPARATOR.join(documents),
+            nodes=packed,
+            tokens=self.max_tokens - remaining,
+            duplicates=duplicates,
+            truncated=truncated
+        )
@@ -0,0 +1,136 @@
+import re
+import textwrap
+from functools import lru_cache
+from typing import Optional
+
+from pydantic import BaseModel
+
+from criabot.bot.chat.tokenizer import get_tokenizer
+from criabot.database.bots.tables.bot_params import BotParametersModel
+
+_RE_COMBINE_MULTISPACE = re.compile(r" +")
+
+CONTEXT_PROMPT_TEMPLATE: str = """
+    [INSTRUCTIONS]
+    The documents below are the top results returned from a search engine.
+    They may be relevant or completely irrelevant to the question.
+
+    IMPORTANT: If you use ANY information from an IMAGE DESCRIPTION, ALWAYS EMBED THE IMAGE as part of your answer using the format ![Asset](<image_id>),
+    where <image_id> is a placeholder for the uuid found in the image description start/end tags. ONLY include the raw UUID, NEVER a URL.
+    The ID of an image is found in the tags at the start and end of its description in the context below.
+    A description tag looks like this: [IMAGE <image_id> DESCRIPTION START].
+
+    {extra_text}
+
+    [INFORMATION]
+"""
+
+BEST_GUESS_TEXT: str = "If nothing from this information is relevant, use your knowledge to guess."
+NO_GUESS_TEXT: str = (
+    "If nothing from this information is relevant, say your database don't have that information, even if you do have a guess."
+)
+
+
+def collapse_spaces(text: str) -> str:
+    """Runs of spaces become one, as the whole context prompt always had"""
+    return _RE_COMBINE_MULTISPACE.sub(" ", text).strip()
+
+
+def clean_text(text: str) -> str:
+    return collapse_spaces(textwrap.dedent(text))
+
+
+@lru_cache(maxsize=None)
+def context_prompt_prefix(best_guess: bool) -> str:
+    """The instructions of the context prompt, which the documents are appended to"""
+    return clean_text(CONTEXT_PROMPT_TEMPLATE.format(extra_text=BEST_GUESS_TEXT if best_guess else NO_GUESS_TEXT)) + "\n"
+
+
+@lru_cache(maxsize=256)
+def no_context_guess_prompt(no_context_message: Optional[str]) -> str:
+    if no_context_message is not None:
+        no_context_message = no_context_message.replace('\n', '')
+
+        return textwrap.dedent(
+            f"""
+            [EXTRA INSTRUCTIONS]
+
+            No information was found regarding the following question.
+            The user was already sent the message "{no_context_message}" to let them know this.
+
+            Use your knowledge to suggest what you think. Make sure you say it's a guess.
+            Start your reply with a conjunction, like "However", or "But", and attempt to make a guess.
+            """
+        )
+
+    return textwrap.dedent(
+        """
+        [EXTRA INSTRUCTIONS]
+
+        No information was found regarding the following question.
+        Use your knowledge to suggest what you think. Make sure you say it's a guess.
+        """
+    )
+
+
+@lru_cache(maxsize=None)
+def no_context_llm_prompt() -> str:
+    return textwrap.dedent(
+        """
+        [EXTRA INSTRUCTIONS]\n
+        No information was found regarding the following question.\n
+        Respond that you do not know the answer, taking the question into account.
+        """
+    )
+
+
+class PromptArtifacts(BaseModel):
+    """
+    A bot's static prompts & their token counts, compiled once per config
+    so building a turn's prompts is string joins with known token costs.
+
+    """
+
+    system_message: str
+    system_message_tokens: int
+
+    context_prefix: str
+    context_prefix_tokens: int
+
+    no_context_guess: str
+    no_context_guess_tokens: int
+
+    no_context_llm: str
+    no_context_llm_tokens: int
+
+    @classmethod
+    def compile(cls, params: BotParametersModel) -> "PromptArtifacts":
+        """
+        Compile the prompts of a bot
+
+        :param params: The bot's parameters
+        :return: The prompts
+
+        """
+
+        system_message: str = params.system_message or ""
+        context_prefix: str = context_prompt_prefix(best_guess=params.no_context_llm_guess)
+        no_context_guess: str = no_context_guess_prompt(
+            no_context_message=params.no_context_message if params.no_context_use_message else None
+        )
+        no_context_llm: str = no_context_llm_prompt()
+
+        counts = get_tokenizer(params.tokenizer_encoding).count_batch(
+            [system_message, context_prefix, no_context_guess, no_context_llm]
+        )
+
+        return cls(
+            system_message=system_message,
+            system_message_tokens=counts[0],
+            context_prefix=context_prefix,
+            context_prefix_tokens=counts[1],
+            no_context_guess=no_context_guess,
+            no_context_guess_tokens=counts[2],
+            no_context_llm=no_context_llm,
+            no_context_llm_tokens=counts[3]
+        )
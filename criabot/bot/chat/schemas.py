@@ -1,9 +1,8 @@
 import enum
 from abc import ABC
-from typing import List, Optional, Dict, Union, Literal
+from typing import List, Optional, Dict, Union, Literal, Any
 
 from CriadexSDK.ragflow_schemas import (
-    ChatMessage,
     RelatedPrompt,
     CompletionUsage,
     GroupSearchResponse,
@@ -12,6 +11,7 @@ from CriadexSDK.ragflow_schemas import (
 )
 from pydantic import BaseModel, Field
 
+from criabot.bot.chat.message import Message
 from criabot.bot.chat.utils import embed_assets_in_message
 
 
@@ -53,11 +53,14 @@ class ChatReplyContent(BaseModel):
     @classmethod
     def from_message(
         cls,
-        message: ChatMessage,
-        assets: list[Asset]
+        message: Message,
+        assets: list[Asset],
+        content: Optional[str] = None
     ) -> "ChatReplyContent":
-        # Combine blocks into a single string, embed assets into it
-        content: str = embed_assets_in_message(message.blocks[0].text, assets)
+        # Combine blocks into a single string, embed assets into it (unless the caller already has)
+        if content is None:
+            content = embed_assets_in_message(message.text, assets)
+
         return cls(
             role=message.role,
             content=content,
@@ -73,7 +76,7 @@ class ChatReply(BaseModel):
     total_usage: CompletionUsage
     search_units: int
     content: ChatReplyContent
-    history: List[ChatMessage]
+    history: List[Dict[str, Any]]  # Messages serialized like ChatMessage.model_dump(), no need to validate them again
     related_prompts: List[RelatedPrompt] = Field(default_factory=list)
     context: Optional[Context]
     group_responses: Dict[str, GroupSearchResponse]
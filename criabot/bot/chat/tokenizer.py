@@ -0,0 +1,169 @@
+import hashlib
+import os
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple, Literal
+
+import tiktoken
+
+from criabot.cache.local import LocalCache
+from criabot.offload import get_offloader
+
+DEFAULT_ENCODING: str = "cl100k_base"
+
+# Which end of a string to keep when truncating it
+TruncateKeep = Literal["head", "tail"]
+
+
+class Tokenizer:
+    """
+    Counts tokens with a single encoding instance, remembering the counts of strings it has already seen
+    (system messages, context prompts, chat history) so they are never encoded twice.
+
+    """
+
+    MEMO_MAX_SIZE: int = 4096
+
+    # Encoding in threads only pays off for big batches, thread pool startup costs more than small encodes
+    BATCH_MIN_TEXTS: int = 2
+    BATCH_MIN_CHARS: int = 64_000
+
+    def __init__(self, encoding_name: str = DEFAULT_ENCODING, memo_max_size: int = MEMO_MAX_SIZE):
+        """
+        Instantiate the tokenizer. Use get_tokenizer() to share one per encoding.
+
+        :param encoding_name: The tiktoken encoding, e.g. cl100k_base
+        :param memo_max_size: How many counts to remember
+
+        """
+
+        self._encoding: tiktoken.Encoding = tiktoken.get_encoding(encoding_name)
+        self._memo: LocalCache[int] = LocalCache(max_size=memo_max_size, ttl=float("inf"))
+        self._threads: int = os.cpu_count() or 1
+
+    @property
+    def encoding_name(self) -> str:
+        return self._encoding.name
+
+    @classmethod
+    def content_hash(cls, text: str) -> bytes:
+        """Memo key, so long strings aren't kept alive by the memo"""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def encode(self, text: str) -> List[int]:
+        """Encode a string. Special tokens in it are encoded as plain text."""
+        return self._encoding.encode_ordinary(text)
+
+    def decode(self, tokens: List[int]) -> str:
+        return self._encoding.decode(tokens)
+
+    def truncate(self, text: str, max_tokens: int, keep: TruncateKeep = "head") -> Tuple[str, int]:
+        """
+        Cut a string down to at most max_tokens, encoding & decoding it once
+
+        :param text: The string
+        :param max_tokens: The token budget
+        :param keep: Keep the start ("head") or the end ("tail") of the string
+        :return: The string & its token count
+
+        """
+
+        tokens: List[int] = self.encode(text)
+
+        if len(tokens) <= max_tokens:
+            return text, len(tokens)
+
+        max_tokens = max(max_tokens, 0)
+        kept: List[int] = tokens[:max_tokens] if keep == "head" else tokens[len(tokens) - max_tokens:]
+
+        # The cut can land inside a multibyte character, drop the partial bytes rather than decode them as U+FFFD
+        return self._encoding.decode_bytes(kept).decode("utf-8", errors="ignore"), len(kept)
+
+    def count(self, text: str) -> int:
+        """Count the tokens in a string"""
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """
+        Count the tokens in each string, encoding only the ones not seen before
+
+        :param texts: The strings
+        :return: Their token counts, in order
+
+        """
+
+        keys, counts, misses = self._lookup(texts)
+
+        if not misses:
+            return counts
+
+        return self._remember(keys, counts, misses, self._count_misses(list(misses.values())))
+
+    async def count_batch_async(self, texts: List[str]) -> List[int]:
+        """
+        count_batch(), but big batches of unseen strings are encoded in the offload threads.
+        The memo is only touched from the event loop.
+
+        :param texts: The strings
+        :return: Their token counts, in order
+
+        """
+
+        keys, counts, misses = self._lookup(texts)
+
+        if not misses:
+            return counts
+
+        miss_texts: List[str] = list(misses.values())
+        miss_counts: List[int] = await get_offloader().run_in_thread(
+            sum(map(len, miss_texts)), self._count_misses, miss_texts
+        )
+
+        return self._remember(keys, counts, misses, miss_counts)
+
+    def _lookup(self, texts: List[str]) -> Tuple[List[bytes], List[Optional[int]], Dict[bytes, str]]:
+        """Memo keys & counts of the strings, and the unseen strings by key"""
+
+        keys: List[bytes] = [self.content_hash(text) for text in texts]
+        counts: List[Optional[int]] = [self._memo.get(key) for key in keys]
+        misses: Dict[bytes, str] = {key: text for key, text, count in zip(keys, texts, counts) if count is None}
+        return keys, counts, misses
+
+    def _remember(
+            self,
+            keys: List[bytes],
+            counts: List[Optional[int]],
+            misses: Dict[bytes, str],
+            miss_counts: List[int]
+    ) -> List[int]:
+        """Memoize the counts of the unseen strings & fill them in"""
+
+        counted: Dict[bytes, int] = dict(zip(misses.keys(), miss_counts))
+
+        for key, count in counted.items():
+            self._memo.set(key, count)
+
+        return [count if count is not None else counted[key] for key, count in zip(keys, counts)]
+
+    def _count_misses(self, texts: List[str]) -> List[int]:
+        """Thread-safe, only uses the encoding"""
+        return [len(tokens) for tokens in self._encode_batch(texts)]
+
+    def _encode_batch(self, texts: List[str]) -> List[List[int]]:
+        if (
+                self._threads > 1
+                and len(texts) >= self.BATCH_MIN_TEXTS
+                and sum(map(len, texts)) >= self.BATCH_MIN_CHARS
+        ):
+            return self._encoding.encode_ordinary_batch(texts, num_threads=self._threads)
+
+        return [self._encoding.encode_ordinary(text) for text in texts]
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return self._memo.stats
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(encoding_name: str = DEFAULT_ENCODING) -> Tokenizer:
+    """Get the tokenizer for an encoding, creating it once per process"""
+    return Tokenizer(encoding_name=encoding_name)
@@ -1,7 +1,12 @@
 from redis.asyncio import ConnectionPool
 
 from criabot.cache.core import BaseCacheAPI
+from criabot.cache.objects.auth import AuthCache
+from criabot.cache.objects.bot_config import BotConfigCache
 from criabot.cache.objects.chats import Chats
+from criabot.cache.objects.reranks import RerankCache
+from criabot.cache.objects.retrievals import RetrievalCache
+from criabot.cache.objects.revocations import TokenRevocations
 
 
 class BotCacheAPI(BaseCacheAPI):
@@ -13,10 +18,26 @@ class BotCacheAPI(BaseCacheAPI):
     def __init__(self, pool: ConnectionPool):
         """
         Instantiate the index database API
-        :param pool: SQL Pool
+        :param pool: Redis Pool
 
         """
 
         super().__init__(pool)
 
-        self.chats: Chats = Chats(pool)
+        self.chats: Chats = Chats(pool, client=self._client)
+        self.auth: AuthCache = AuthCache(pool, client=self._client)
+        self.revocations: TokenRevocations = TokenRevocations(pool, client=self._client)
+        self.bot_configs: BotConfigCache = BotConfigCache(pool, client=self._client)
+        self.retrievals: RetrievalCache = RetrievalCache(pool, client=self._client)
+        self.reranks: RerankCache = RerankCache(pool, client=self._client)
+
+    @property
+    def stats(self) -> dict:
+        """Hit/miss counters of the caches"""
+
+        return {
+            "auth": self.auth.stats,
+            "bot_configs": self.bot_configs.stats,
+            "retrievals": self.retrievals.stats,
+            "reranks": self.reranks.stats
+        }
@@ -1,9 +1,11 @@
+import asyncio
+import logging
 from abc import abstractmethod
 from contextlib import asynccontextmanager
-from typing import TypeVar
+from typing import TypeVar, Optional, AsyncIterator, Callable
 
-from redis import asyncio as aioredis
 from redis.asyncio import ConnectionPool, Redis
+from redis.asyncio.client import Pipeline, PubSub
 from pydantic import BaseModel
 
 T = TypeVar('T', bound=BaseModel)
@@ -12,29 +14,84 @@ T = TypeVar('T', bound=BaseModel)
 class CacheObject:
     """Generic Redis object model supporting operations"""
 
-    def __init__(self, pool: ConnectionPool):
+    def __init__(self, pool: ConnectionPool, client: Optional[Redis] = None):
         """
         Instantiate the table
 
-        :param pool: SQL Pool
+        :param pool: Redis Pool
+        :param client: Client shared with the other cache objects, one is made if not given
 
         """
 
         self._pool: ConnectionPool = pool
+        self._client: Redis = client if client is not None else Redis(connection_pool=pool)
+
+    @asynccontextmanager
+    async def redis(self) -> AsyncIterator[Redis]:
+        """
+        Context manager for retrieving the long-lived client.
+        Each command borrows a connection from the pool, so the client is not closed afterwards.
+
+        :return: Client instance
+
+        """
+
+        yield self._client
 
     @asynccontextmanager
-    async def redis(self) -> Redis:
+    async def pipeline(self, transaction: bool = True) -> AsyncIterator[Pipeline]:
         """
-        Context manager for retrieving the cursor from the pool
-        :return: Cursor instance
+        Context manager for queueing several commands & sending them in one round trip with execute()
+
+        :param transaction: Whether to wrap the commands in MULTI/EXEC
+        :return: Pipeline instance
 
         """
 
-        async with aioredis.Redis(connection_pool=self._pool) as redis:
+        async with self.redis() as redis:
+            async with redis.pipeline(transaction=transaction) as pipe:
+                yield pipe
+
+    async def subscribe(
+            self,
+            channel: str,
+            on_message: Callable[[str], None],
+            on_reset: Callable[[], None],
+            reconnect_delay: float = 1.0
+    ) -> None:
+        """
+        Handle every message published on a channel, reconnecting if the subscription drops. Runs until cancelled.
+
+        :param channel: The channel
+        :param on_message: Called with each message's data
+        :param on_reset: Called whenever messages may have been missed
+        :param reconnect_delay: Seconds to wait before reconnecting
+
+        """
+
+        while True:
             try:
-                yield redis
-            finally:
-                await redis.close()
+                async with self.redis() as redis:
+                    pubsub: PubSub = redis.pubsub()
+
+                    try:
+                        await pubsub.subscribe(channel)
+
+                        # We can't know what we missed while not subscribed
+                        on_reset()
+
+                        async for message in pubsub.listen():
+                            if message["type"] == "message":
+                                on_message(message["data"].decode("utf-8"))
+                    finally:
+                        await pubsub.aclose()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.warning(f"Listener of '{channel}' disconnected, retrying.", exc_info=True)
+                on_reset()
+                await asyncio.sleep(reconnect_delay)
 
     @abstractmethod
     async def set(self, key: str, val: T, **kwargs) -> None:
@@ -67,11 +124,47 @@ class BaseCacheAPI:
         """
         Instantiate the database API
 
-        :param pool: SQL Pool
+        :param pool: Redis Pool
 
         """
 
         self._pool: ConnectionPool = pool
+        self._client: Redis = Redis(connection_pool=pool)
+
+    @property
+    def client(self) -> Redis:
+        """
+        Retrieve the client shared by every cache object
+
+        :return: Client instance
+
+        """
+
+        return self._client
+
+    @asynccontextmanager
+    async def pipeline(self, transaction: bool = True) -> AsyncIterator[Pipeline]:
+        """
+        Context manager for batching commands across cache objects into one round trip
+
+        :param transaction: Whether to wrap the commands in MULTI/EXEC
+        :return: Pipeline instance
+
+        """
+
+        async with self._client.pipeline(transaction=transaction) as pipe:
+            yield pipe
+
+    async def close(self) -> None:
+        """
+        Close the shared client & every connection in the pool
+
+        :return: None
+
+        """
+
+        await self._client.aclose()
+        await self._pool.disconnect()
 
     @property
     def pool(self) -> ConnectionPool:
@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+from typing import Generic, TypeVar, Optional, Hashable, Callable, Tuple, Dict
+
+V = TypeVar('V')
+
+
+class LocalCache(Generic[V]):
+    """Bounded in-process LRU cache where every entry expires after a TTL"""
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Instantiate the cache
+
+        :param max_size: Max number of entries kept before the least-recently used is evicted
+        :param ttl: Seconds an entry stays valid for
+
+        """
+
+        self._max_size: int = max_size
+        self._ttl: float = ttl
+        self._entries: OrderedDict[Hashable, Tuple[float, V]] = OrderedDict()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """Retrieve an entry, or None if it is missing or expired"""
+
+        entry: Optional[Tuple[float, V]] = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable) -> Optional[V]:
+        """Retrieve an entry without counting a hit/miss or refreshing its recency"""
+
+        entry: Optional[Tuple[float, V]] = self._entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        """Insert an entry, evicting the least-recently used one if full"""
+
+        if self._max_size < 1:
+            return
+
+        self._entries[key] = (time.monotonic() + (self._ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """Remove an entry if present"""
+        self._entries.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Remove every entry whose key matches the predicate"""
+
+        stale_keys = [key for key in self._entries if predicate(key)]
+
+        for key in stale_keys:
+            del self._entries[key]
+
+        return len(stale_keys)
+
+    def clear(self) -> None:
+        """Remove all entries"""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters & current size"""
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries)
+        }
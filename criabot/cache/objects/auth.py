@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+from typing import Optional, Dict, Any
+
+from pydantic import BaseModel
+from redis.asyncio import ConnectionPool, Redis
+
+from app.core.constants import AUTH_CACHE_TTL, AUTH_CACHE_MAX_SIZE
+from criabot.cache.core import CacheObject
+from criabot.cache.local import LocalCache
+
+# Stands in for the group name on key-level (non-group) checks
+ANY_GROUP: str = "*"
+
+
+class AuthDecision(BaseModel):
+    authorized: bool
+    master: bool = False
+
+    @classmethod
+    def from_response(cls, response: Any) -> Optional["AuthDecision"]:
+        """
+        Build a decision from a Criadex auth check response (dict or model)
+
+        :return: The decision, or None if the response is an error or malformed
+
+        """
+
+        data: Any = response.model_dump() if isinstance(response, BaseModel) else response
+
+        if not isinstance(data, dict):
+            return None
+
+        status: Any = data.get("status")
+
+        if status is not None and not (isinstance(status, int) and 200 <= status < 300):
+            return None
+
+        if not isinstance(data.get("authorized"), bool):
+            return None
+
+        return cls(
+            authorized=data["authorized"],
+            master=bool(data.get("master"))
+        )
+
+
+class StoredAuthDecision(BaseModel):
+    decision: AuthDecision
+
+    # Key-level decisions can't be tied to a group, so deleting any group invalidates all of them
+    generation: int = 0
+
+
+class AuthCache(CacheObject):
+    """
+    Two-tier cache of API key authorization decisions.
+    Tier 1 is a bounded in-process LRU, tier 2 is shared across workers in Redis.
+
+    Only well-formed, positive decisions are cached, so a Criadex outage or a key authorized
+    a moment later is never stuck behind a cached denial. Deleting a group's decisions is
+    published to every worker, which drop their copies.
+
+    """
+
+    KEY_PREFIX: str = "auth"
+    CHANNEL: str = "auth:invalidate"
+    RECONNECT_DELAY: float = 1.0
+
+    def __init__(
+            self,
+            pool: ConnectionPool,
+            ttl: int = AUTH_CACHE_TTL,
+            max_size: int = AUTH_CACHE_MAX_SIZE,
+            client: Optional[Redis] = None
+    ):
+        super().__init__(pool, client=client)
+
+        self._ttl: int = ttl
+        self._local: LocalCache[AuthDecision] = LocalCache(max_size=max_size, ttl=ttl)
+        self._listener: Optional[asyncio.Task] = None
+
+        self.redis_hits: int = 0
+        self.invalidations: int = 0
+
+    @classmethod
+    def hash_key(cls, api_key: str) -> str:
+        """Never store raw API keys"""
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def decision_key(cls, key_hash: str, group_name: str) -> str:
+        return f"{cls.KEY_PREFIX}:{key_hash}:{group_name}"
+
+    @classmethod
+    def group_index_key(cls, group_name: str) -> str:
+        """Set of the decision keys stored for a group, used to invalidate them"""
+        return f"{cls.KEY_PREFIX}:group:{group_name}"
+
+    @classmethod
+    def generation_key(cls) -> str:
+        return f"{cls.KEY_PREFIX}:generation"
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl > 0
+
+    async def set(self, api_key: str, decision: AuthDecision, group_name: Optional[str] = None, **kwargs) -> None:
+        if not self.enabled or not decision.authorized:
+            return
+
+        group_name = group_name or ANY_GROUP
+        key_hash: str = self.hash_key(api_key)
+        decision_key: str = self.decision_key(key_hash, group_name)
+
+        async with self.redis() as redis:
+            generation: Optional[bytes] = (
+                await redis.get(self.generation_key()) if group_name == ANY_GROUP else None
+            )
+
+        stored: StoredAuthDecision = StoredAuthDecision(
+            decision=decision,
+            generation=int(generation) if generation is not None else 0
+        )
+
+        self._local.set((key_hash, group_name), decision)
+
+        async with self.pipeline(transaction=False) as pipe:
+            pipe.set(decision_key, stored.model_dump_json(), ex=self._ttl)
+
+            if group_name != ANY_GROUP:
+                pipe.sadd(self.group_index_key(group_name), decision_key)
+                pipe.expire(self.group_index_key(group_name), self._ttl)
+
+            await pipe.execute()
+
+    async def get(self, api_key: str, group_name: Optional[str] = None, **kwargs) -> Optional[AuthDecision]:
+        if not self.enabled:
+            return None
+
+        group_name = group_name or ANY_GROUP
+        key_hash: str = self.hash_key(api_key)
+
+        # Tier 1
+        decision: Optional[AuthDecision] = self._local.get((key_hash, group_name))
+
+        if decision is not None:
+            return decision
+
+        # Tier 2
+        decision_key: str = self.decision_key(key_hash, group_name)
+
+        async with self.pipeline(transaction=False) as pipe:
+            pipe.get(decision_key)
+            pipe.pttl(decision_key)
+            pipe.get(self.generation_key())
+            result, remaining_ms, generation = await pipe.execute()
+
+        if result is None or remaining_ms == -2:
+            return None
+
+        stored: StoredAuthDecision = StoredAuthDecision.model_validate_json(result)
+
+        if group_name == ANY_GROUP and stored.generation != (int(generation) if generation is not None else 0):
+            return None
+
+        self.redis_hits += 1
+
+        # Expire locally when it does in Redis, so no entry outlives the TTL
+        self._local.set(
+            (key_hash, group_name),
+            stored.decision,
+            ttl=remaining_ms / 1000 if remaining_ms > 0 else self._ttl
+        )
+        return stored.decision
+
+    async def delete(self, group_name: str, **kwargs) -> None:
+        """Invalidate every decision stored for a group (& every key-level decision) on every worker"""
+
+        self._on_invalidate(group_name=group_name)
+
+        async with self.redis() as redis:
+            decision_keys: set = await redis.smembers(self.group_index_key(group_name))
+            await redis.delete(self.group_index_key(group_name), *decision_keys)
+
+            # Bump & publish atomically, so no worker can re-cache a key-level decision from before it
+            await redis.eval(
+                "redis.call('INCR', KEYS[1]) "
+                "return redis.call('PUBLISH', ARGV[1], ARGV[2])",
+                1, self.generation_key(), self.CHANNEL, group_name
+            )
+
+    async def exists(self, api_key: str, group_name: Optional[str] = None, **kwargs) -> bool:
+        return await self.get(api_key=api_key, group_name=group_name) is not None
+
+    def _on_invalidate(self, group_name: str) -> None:
+        self.invalidations += self._local.delete_where(lambda key: key[1] in (group_name, ANY_GROUP))
+
+    def start(self) -> None:
+        """Start listening for invalidations from other workers"""
+
+        if self.enabled and self._listener is None:
+            self._listener = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        """Stop listening for invalidations"""
+
+        if self._listener is None:
+            return
+
+        self._listener.cancel()
+        await asyncio.gather(self._listener, return_exceptions=True)
+        self._listener = None
+
+    async def listen(self) -> None:
+        """Apply invalidations published by any worker, reconnecting if the subscription drops"""
+
+        await self.subscribe(
+            channel=self.CHANNEL,
+            on_message=lambda group_name: self._on_invalidate(group_name=group_name),
+            on_reset=self._local.clear,
+            reconnect_delay=self.RECONNECT_DELAY
+        )
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters across both tiers"""
+
+        return {
+            "local_hits": self._local.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self._local.misses - self.redis_hits,
+            "local_size": len(self._local),
+            "invalidations": self.invalidations,
+            "listening": self._listener is not None and not self._listener.done()
+        }
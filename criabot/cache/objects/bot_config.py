@@ -0,0 +1,155 @@
+import asyncio
+import time
+from typing import Optional, Dict, Tuple
+
+from redis.asyncio import ConnectionPool, Redis
+
+from app.core.constants import BOT_CONFIG_CACHE_TTL, BOT_CONFIG_CACHE_MAX_SIZE
+from criabot.cache.core import CacheObject
+from criabot.cache.local import LocalCache
+from criabot.schemas import ResolvedBotConfig
+
+# (version, loaded at, config)
+BotConfigEntry = Tuple[int, float, ResolvedBotConfig]
+
+
+class BotConfigCache(CacheObject):
+    """
+    Process-local cache of each bot's resolved configuration.
+
+    Every bot has a version counter in Redis. Changing a bot bumps it & publishes the new version,
+    so every worker drops its copy. Entries also expire after a TTL as a safety net.
+
+    """
+
+    KEY_PREFIX: str = "bot:config"
+    CHANNEL: str = "bot:config:invalidate"
+    RECONNECT_DELAY: float = 1.0
+
+    def __init__(
+            self,
+            pool: ConnectionPool,
+            ttl: int = BOT_CONFIG_CACHE_TTL,
+            max_size: int = BOT_CONFIG_CACHE_MAX_SIZE,
+            client: Optional[Redis] = None
+    ):
+        super().__init__(pool, client=client)
+
+        self._ttl: int = ttl
+        self._local: LocalCache[BotConfigEntry] = LocalCache(max_size=max_size, ttl=ttl)
+        self._latest_versions: Dict[str, int] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+        self.invalidations: int = 0
+        self.max_served_age: float = 0
+
+    @classmethod
+    def version_key(cls, bot_name: str) -> str:
+        return f"{cls.KEY_PREFIX}:version:{bot_name}"
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl > 0
+
+    async def version(self, bot_name: str) -> int:
+        """Get the current config version of a bot. Read it BEFORE loading the config to cache."""
+
+        async with self.redis() as redis:
+            result: Optional[bytes] = await redis.get(self.version_key(bot_name))
+
+        return int(result) if result is not None else 0
+
+    async def set(self, bot_name: str, config: ResolvedBotConfig, version: int = 0, **kwargs) -> None:
+        if not self.enabled:
+            return
+
+        # The config changed while it was being loaded, so what we have may already be stale
+        if self._latest_versions.get(bot_name, 0) > version:
+            return
+
+        self._local.set(bot_name, (version, time.monotonic(), config))
+
+    async def get(self, bot_name: str, **kwargs) -> Optional[ResolvedBotConfig]:
+        """Retrieve a config from the local cache. Never touches Redis."""
+        return self.get_cached(bot_name=bot_name)
+
+    def get_cached(self, bot_name: str) -> Optional[ResolvedBotConfig]:
+        """Synchronous version of get()"""
+
+        entry: Optional[BotConfigEntry] = self._local.get(bot_name)
+
+        if entry is None:
+            return None
+
+        _, loaded_at, config = entry
+        self.max_served_age = max(self.max_served_age, time.monotonic() - loaded_at)
+        return config
+
+    async def delete(self, bot_name: str, **kwargs) -> None:
+        """Invalidate a bot's config on every worker"""
+
+        self._local.delete(bot_name)
+
+        # Bump & publish atomically, so the published version is always the one we bumped to
+        async with self.redis() as redis:
+            version: int = await redis.eval(
+                "local version = redis.call('INCR', KEYS[1]) "
+                "redis.call('PUBLISH', ARGV[1], version .. ':' .. ARGV[2]) "
+                "return version",
+                1, self.version_key(bot_name), self.CHANNEL, bot_name
+            )
+
+        self._on_invalidate(bot_name=bot_name, version=version)
+
+    async def exists(self, bot_name: str, **kwargs) -> bool:
+        return await self.get(bot_name=bot_name) is not None
+
+    def _on_invalidate(self, bot_name: str, version: int) -> None:
+        self._latest_versions[bot_name] = max(version, self._latest_versions.get(bot_name, 0))
+
+        entry: Optional[BotConfigEntry] = self._local.peek(bot_name)
+
+        if entry is not None and entry[0] < version:
+            self._local.delete(bot_name)
+            self.invalidations += 1
+
+    def start(self) -> None:
+        """Start listening for invalidations from other workers"""
+
+        if self.enabled and self._listener is None:
+            self._listener = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        """Stop listening for invalidations"""
+
+        if self._listener is None:
+            return
+
+        self._listener.cancel()
+        await asyncio.gather(self._listener, return_exceptions=True)
+        self._listener = None
+
+    async def listen(self) -> None:
+        """Apply invalidations published by any worker, reconnecting if the subscription drops"""
+
+        await self.subscribe(
+            channel=self.CHANNEL,
+            on_message=self._on_message,
+            on_reset=self._local.clear,
+            reconnect_delay=self.RECONNECT_DELAY
+        )
+
+    def _on_message(self, data: str) -> None:
+        version, bot_name = data.split(":", 1)
+        self._on_invalidate(bot_name=bot_name, version=int(version))
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """Hit rate & staleness of the cache"""
+
+        return {
+            **self._local.stats,
+            "invalidations": self.invalidations,
+            "max_served_age": round(self.max_served_age, 3),
+            "listening": self._listener is not None and not self._listener.done()
+        }
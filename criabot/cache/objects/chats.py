@@ -1,11 +1,13 @@
 import json
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Dict, Union, Tuple
 
-from redis import asyncio as aioredis
+from redis.asyncio.client import Pipeline
+from redis.commands.core import AsyncScript
 from CriadexSDK.ragflow_schemas import ChatMessage, TextBlock
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
 from criabot.bot.chat.buffer import ChatBuffer
+from criabot.bot.chat.message import Message
 from criabot.cache.core import CacheObject
 from app.core.constants import CHAT_EXPIRE_TIME
 
@@ -14,6 +16,13 @@ class ChatModel(BaseModel):
     started_at: int
     history: List[ChatMessage] = []
 
+    # Rolling summary of the first `summarized` stored messages, which no longer fit in the buffer
+    summary: Optional[ChatMessage] = None
+    summarized: int = 0
+
+    # Index of the first message of the history among the stored messages, when only the tail was read
+    history_start: int = 0
+
     def __init__(self, **data: Any):
         super().__init__(**data)
 
@@ -41,27 +50,437 @@ class ChatModel(BaseModel):
         return self
 
 
+# Reads the header & the newest messages whose tokens fit the budget (-1 for all) in one round trip,
+# optionally refreshing the expiry (0 to leave it).
+# The token list holds the running total of tokens up to & including each message, so binary search it.
+# KEYS[4] is the chat's legacy JSON blob: if the chat isn't in the current layout, returns whether the blob exists.
+READ_TAIL_SCRIPT: str = """
+local header = redis.call('HGETALL', KEYS[1])
+if #header == 0 then
+    return redis.call('EXISTS', KEYS[4])
+end
+
+if tonumber(ARGV[2]) > 0 then
+    for i = 1, 3 do
+        redis.call('EXPIRE', KEYS[i], ARGV[2])
+    end
+end
+
+local count = redis.call('LLEN', KEYS[3])
+local budget = tonumber(ARGV[1])
+local start = 0
+
+if budget >= 0 and count > 0 then
+    local need = tonumber(redis.call('LINDEX', KEYS[3], -1)) - budget
+
+    if need > 0 then
+        local low, high = 0, count - 1
+        while low < high do
+            local mid = math.floor((low + high) / 2)
+            if tonumber(redis.call('LINDEX', KEYS[3], mid)) >= need then
+                high = mid
+            else
+                low = mid + 1
+            end
+        end
+
+        -- Always return at least the newest message
+        start = math.min(low + 1, count - 1)
+    end
+end
+
+return {header, redis.call('LRANGE', KEYS[2], start, -1), start}
+"""
+
+# Appends messages & their running token totals, then refreshes the expiry of the chat.
+# ARGV: expiry, system message ('' to keep), then (message, token count) pairs
+APPEND_SCRIPT: str = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+
+if ARGV[2] ~= '' then
+    redis.call('HSET', KEYS[1], 'system', ARGV[2])
+end
+
+local total = tonumber(redis.call('LINDEX', KEYS[3], -1) or '0')
+
+for i = 3, #ARGV, 2 do
+    total = total + tonumber(ARGV[i + 1])
+    redis.call('RPUSH', KEYS[2], ARGV[i])
+    redis.call('RPUSH', KEYS[3], total)
+end
+
+for _, key in ipairs(KEYS) do
+    redis.call('EXPIRE', key, ARGV[1])
+end
+
+return 1
+"""
+
+# Saves a chat's summary, unless another worker saved one since it was read.
+# ARGV: the summarized count it was read with, the new summarized count, the summary
+SET_SUMMARY_SCRIPT: str = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+
+if tonumber(redis.call('HGET', KEYS[1], 'summarized') or '0') ~= tonumber(ARGV[1]) then
+    return 0
+end
+
+redis.call('HSET', KEYS[1], 'summarized', ARGV[2], 'summary', ARGV[3])
+return 1
+"""
+
+
+# Validates a whole history in one pydantic-core call
+CHAT_MESSAGES_ADAPTER: TypeAdapter = TypeAdapter(List[ChatMessage])
+
+
 class Chats(CacheObject):
+    """
+    Chats are stored as a small header hash plus an append-only list of messages,
+    with the running token total stored alongside each message so the tail can be read on its own.
+
+    Chats from before this layout were a single JSON blob at the raw chat ID & are migrated on read.
+
+    """
+
+    KEY_PREFIX: str = "chat"
+    SCHEMA_VERSION: int = 2
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._read_tail_script: Optional[AsyncScript] = None
+        self._append_script: Optional[AsyncScript] = None
+        self._set_summary_script: Optional[AsyncScript] = None
+
+    # The chat ID is a hash tag, so a chat's keys share a cluster slot & can be scripted together
+    @classmethod
+    def header_key(cls, chat_id: str) -> str:
+        return f"{cls.KEY_PREFIX}:{{{chat_id}}}"
+
+    @classmethod
+    def messages_key(cls, chat_id: str) -> str:
+        return f"{cls.KEY_PREFIX}:{{{chat_id}}}:messages"
+
+    @classmethod
+    def tokens_key(cls, chat_id: str) -> str:
+        return f"{cls.KEY_PREFIX}:{{{chat_id}}}:tokens"
+
+    @classmethod
+    def keys(cls, chat_id: str) -> List[str]:
+        return [cls.header_key(chat_id), cls.messages_key(chat_id), cls.tokens_key(chat_id)]
+
+    @classmethod
+    def message_tokens(cls, message: Union[ChatMessage, Message]) -> int:
+        """Token count of a message, counting it if the buffer hasn't already"""
+
+        if ChatBuffer.TOKEN_COUNT_META_NAME not in message.metadata:
+            message.metadata[ChatBuffer.TOKEN_COUNT_META_NAME] = ChatBuffer.create_chat_token_metadata(
+                message if isinstance(message, Message) else Message.from_chat_message(message)
+            )
+
+        return ChatBuffer.get_token_metadata(message)
+
     async def set(self, chat_id: str, chat_model: ChatModel, **kwargs) -> None:
+        """Write a whole chat, replacing it if it already exists"""
+
+        async with self.pipeline(transaction=True) as pipe:
+            self._queue_set(pipe, chat_id=chat_id, chat_model=chat_model, expire=kwargs.get('ex', CHAT_EXPIRE_TIME))
+            await pipe.execute()
+
+    def _queue_set(self, pipe: Pipeline, chat_id: str, chat_model: ChatModel, expire: int) -> None:
+        """Queue the commands that write a whole chat"""
+
+        history: List[ChatMessage] = chat_model.history.copy()
+        system_message: Optional[ChatMessage] = ChatBuffer.pop_system(history)
+
+        header: Dict[str, Any] = {
+            "started_at": chat_model.started_at,
+            "schema_version": self.SCHEMA_VERSION,
+            "system": system_message.model_dump_json() if system_message else "",
+            "summary": chat_model.summary.model_dump_json() if chat_model.summary else "",
+            "summarized": chat_model.summarized
+        }
+
+        running_total: int = 0
+        token_totals: List[int] = []
+
+        for message in history:
+            running_total += self.message_tokens(message)
+            token_totals.append(running_total)
+
+        pipe.delete(*self.keys(chat_id))
+        pipe.hset(self.header_key(chat_id), mapping=header)
+
+        if history:
+            pipe.rpush(self.messages_key(chat_id), *[m.model_dump_json() for m in history])
+            pipe.rpush(self.tokens_key(chat_id), *token_totals)
+
+        for key in self.keys(chat_id):
+            pipe.expire(key, expire)
+
+    async def append(
+            self,
+            chat_id: str,
+            messages: List[Message],
+            system_message: Optional[Message] = None,
+            **kwargs
+    ) -> bool:
+        """
+        Append new messages to a chat without rewriting the rest of it
+
+        :param chat_id: The ID of the chat
+        :param messages: The messages added since the chat was read
+        :param system_message: Replaces the stored system message, if given
+        :return: False if the chat has expired in the meantime
+
+        """
+
+        args: List[Any] = [
+            kwargs.get('ex', CHAT_EXPIRE_TIME),
+            system_message.to_json() if system_message else ""
+        ]
+
+        for message in messages:
+            args.extend((message.to_json(), self.message_tokens(message)))
+
+        async with self.redis() as redis:
+            if self._append_script is None:
+                self._append_script = redis.register_script(APPEND_SCRIPT)
+
+            return bool(await self._append_script(keys=self.keys(chat_id), args=args, client=redis))
+
+    async def get(
+            self,
+            chat_id: str,
+            max_tokens: Optional[int] = None,
+            refresh: bool = False,
+            **kwargs
+    ) -> Optional[ChatModel]:
+        """
+        Retrieve a chat
+
+        :param chat_id: The ID of the chat
+        :param max_tokens: Only read the newest messages that fit in this many tokens (at least one)
+        :param refresh: Also extend the expiry of the chat, in the same round trip
+        :return: The chat, or None if it does not exist
+
+        """
+
+        result, legacy = await self._read(chat_id=chat_id, max_tokens=max_tokens, refresh=refresh, **kwargs)
+
+        if result is None:
+            return await self._migrate(chat_id=chat_id) if legacy else None
+
+        header, raw_messages, start = result
+        history: List[ChatMessage] = self.decode_messages(
+            raw_messages=raw_messages,
+            schema_version=int(header.get("schema_version", 0))
+        )
+
+        if header.get("system"):
+            history.insert(0, ChatMessage.model_validate_json(header["system"]))
+
+        return self._header_model(header=header, start=start, history=history)
+
+    @classmethod
+    def decode_messages(cls, raw_messages: List[bytes], schema_version: int) -> List[ChatMessage]:
+        """
+        Decode stored messages straight from the bytes, without a json.loads() pass
+
+        :param raw_messages: The messages, as stored
+        :param schema_version: The version of the chat they were read from
+        :return: The messages
+
+        """
+
+        # We wrote these in this exact shape, so they're parsed in one go. Older chats are parsed one by one.
+        if schema_version == cls.SCHEMA_VERSION and raw_messages:
+            return CHAT_MESSAGES_ADAPTER.validate_json(b"[" + b",".join(raw_messages) + b"]")
+
+        return [ChatMessage.model_validate_json(raw) for raw in raw_messages]
+
+    async def get_messages(
+            self,
+            chat_id: str,
+            max_tokens: Optional[int] = None,
+            refresh: bool = False,
+            **kwargs
+    ) -> Optional[Tuple[ChatModel, List[Message]]]:
+        """
+        Retrieve a chat for replying to it, reading the messages straight into Message instead of ChatMessage
+
+        :param chat_id: The ID of the chat
+        :param max_tokens: Only read the newest messages that fit in this many tokens (at least one)
+        :param refresh: Also extend the expiry of the chat, in the same round trip
+        :return: The chat without its history & the history, or None if it does not exist
+
+        """
+
+        result, legacy = await self._read(chat_id=chat_id, max_tokens=max_tokens, refresh=refresh, **kwargs)
+
+        if result is None:
+            chat_model: Optional[ChatModel] = await self._migrate(chat_id=chat_id) if legacy else None
+
+            if chat_model is None:
+                return None
+
+            return (
+                ChatModel(started_at=chat_model.started_at),
+                [Message.from_chat_message(m) for m in chat_model.history]
+            )
+
+        header, raw_messages, start = result
+        history: List[Message] = [Message.from_dict(json.loads(raw)) for raw in raw_messages]
+
+        if header.get("system"):
+            history.insert(0, Message.from_dict(json.loads(header["system"])))
+
+        return self._header_model(header=header, start=start), history
+
+    @classmethod
+    def _header_model(cls, header: Dict[str, bytes], start: int, history: Optional[List[ChatMessage]] = None) -> ChatModel:
+        return ChatModel(
+            started_at=int(header["started_at"]),
+            history=history or [],
+            summary=ChatMessage.model_validate_json(header["summary"]) if header.get("summary") else None,
+            summarized=int(header.get("summarized", 0)),
+            history_start=start
+        )
+
+    async def _read(
+            self,
+            chat_id: str,
+            max_tokens: Optional[int],
+            refresh: bool,
+            **kwargs
+    ) -> Tuple[Optional[Tuple[Dict[str, bytes], List[bytes], int]], bool]:
+        """
+        Read the header & the raw messages of a chat in the current layout, and the index of the first message
+
+        :return: The chat (None if it isn't in the current layout) & whether a legacy blob of it exists
+
+        """
+
         async with self.redis() as redis:
-            await redis.set(
-                chat_id, chat_model.model_dump_json(), ex=kwargs.get('ex', CHAT_EXPIRE_TIME)
+            if self._read_tail_script is None:
+                self._read_tail_script = redis.register_script(READ_TAIL_SCRIPT)
+
+            result: Optional[list] = await self._read_tail_script(
+                keys=[*self.keys(chat_id), chat_id],
+                args=[
+                    max_tokens if max_tokens is not None else -1,
+                    kwargs.get('ex', CHAT_EXPIRE_TIME) if refresh else 0
+                ],
+                client=redis
             )
 
-    async def get(self, chat_id: str, **kwargs) -> Optional[ChatModel]:
+        if not isinstance(result, list):
+            return None, bool(result)
+
+        raw_header, raw_messages, start = result
+        header: Dict[str, bytes] = {
+            raw_header[i].decode("utf-8"): raw_header[i + 1] for i in range(0, len(raw_header), 2)
+        }
+
+        return (header, raw_messages, int(start)), False
+
+    async def read_range(self, chat_id: str, start: int, end: int) -> List[Message]:
+        """Read the stored messages from start up to (excluding) end"""
+
+        if end <= start:
+            return []
+
+        async with self.redis() as redis:
+            raw_messages: List[bytes] = await redis.lrange(self.messages_key(chat_id), start, end - 1)
+
+        return [Message.from_dict(json.loads(raw)) for raw in raw_messages]
+
+    async def tokens_between(self, chat_id: str, start: int, end: int) -> int:
+        """Tokens in the stored messages from start up to (excluding) end, from the running totals"""
+
+        if end <= start:
+            return 0
+
+        # Each entry of the tokens list is the running total up to & including its message
+        async with self.pipeline(transaction=False) as pipe:
+            pipe.lindex(self.tokens_key(chat_id), end - 1)
+            pipe.lindex(self.tokens_key(chat_id), start - 1)
+            end_total, start_total = await pipe.execute()
+
+        return int(end_total or 0) - (int(start_total or 0) if start > 0 else 0)
+
+    async def set_summary(self, chat_id: str, summary: Message, summarized: int, read_summarized: int) -> bool:
+        """
+        Save a chat's rolling summary
+
+        :param chat_id: The ID of the chat
+        :param summary: The summary message
+        :param summarized: How many stored messages it covers
+        :param read_summarized: How many the summary it replaces covered, when the chat was read
+        :return: False if the chat expired or the summary changed in the meantime
+
+        """
+
         async with self.redis() as redis:
-            redis: aioredis.Redis
-            result: Optional[bytes] = await redis.get(chat_id)
+            if self._set_summary_script is None:
+                self._set_summary_script = redis.register_script(SET_SUMMARY_SCRIPT)
 
-            if result is not None:
-                data: dict = json.loads(result.decode("utf-8"))
-                return ChatModel(**data)
+            return bool(await self._set_summary_script(
+                keys=[self.header_key(chat_id)],
+                args=[read_summarized, summarized, summary.to_json()],
+                client=redis
+            ))
 
+    async def _migrate(self, chat_id: str) -> Optional[ChatModel]:
+        """Move a chat stored as a single JSON blob into the current layout, keeping its expiry"""
+
+        async with self.pipeline(transaction=False) as pipe:
+            pipe.get(chat_id)
+            pipe.ttl(chat_id)
+            result, ttl = await pipe.execute()
+
+        if result is None:
             return None
 
+        chat_model: ChatModel = ChatModel.model_validate_json(result)
+
+        # Write the new layout & drop the blob together
+        async with self.pipeline(transaction=True) as pipe:
+            self._queue_set(pipe, chat_id=chat_id, chat_model=chat_model, expire=ttl if ttl > 0 else CHAT_EXPIRE_TIME)
+            pipe.delete(chat_id)
+            await pipe.execute()
+
+        return chat_model
+
     async def delete(self, chat_id: str, **kwargs) -> None:
         async with self.redis() as redis:
-            await redis.delete(chat_id)
+            await redis.delete(*self.keys(chat_id), chat_id)
 
     async def exists(self, chat_id: str, **kwargs) -> bool:
-        return bool(await self.get(chat_id=chat_id))
+        """Check if a chat exists without reading it"""
+
+        async with self.redis() as redis:
+            return await redis.exists(self.header_key(chat_id), chat_id) > 0
+
+    async def touch(self, chat_id: str, **kwargs) -> bool:
+        """
+        Extend the expiry of a chat without rewriting it
+
+        :param chat_id: The ID of the chat
+        :return: Whether the chat exists
+
+        """
+
+        expire: int = kwargs.get('ex', CHAT_EXPIRE_TIME)
+
+        async with self.pipeline(transaction=False) as pipe:
+            for key in (*self.keys(chat_id), chat_id):
+                pipe.expire(key, expire)
+
+            header_touched, _, _, legacy_touched = await pipe.execute()
+
+        return bool(header_touched or legacy_touched)
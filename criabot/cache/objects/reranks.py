@@ -0,0 +1,143 @@
+import hashlib
+import json
+from typing import Optional, Dict, List, Tuple
+
+from CriadexSDK.ragflow_schemas import TextNodeWithScore
+from redis.asyncio import ConnectionPool, Redis
+
+from app.core.constants import RERANK_CACHE_TTL
+from criabot.cache.core import CacheObject
+from criabot.cache.objects.retrievals import RetrievalCache
+
+# (Position of the node in the candidates, rerank score)
+RankedCandidate = Tuple[int, Optional[float]]
+
+
+class RerankCache(CacheObject):
+    """
+    Shared cache of rerank results, keyed by the prompt & the exact candidates reranked.
+
+    Only the ranking is stored. The ranked nodes are rebuilt from the candidates on a hit,
+    so a candidate's content is part of its key & no invalidation is needed.
+
+    """
+
+    KEY_PREFIX: str = "rerank"
+
+    # Bump when the key parts or the stored shape change
+    VERSION: int = 1
+
+    def __init__(self, pool: ConnectionPool, ttl: int = RERANK_CACHE_TTL, client: Optional[Redis] = None):
+        super().__init__(pool, client=client)
+
+        self._ttl: int = ttl
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @classmethod
+    def candidate_fingerprint(cls, node: TextNodeWithScore) -> List[Optional[str]]:
+        return [node.node.id_, hashlib.sha256(node.node.text.encode("utf-8")).hexdigest()]
+
+    @classmethod
+    def entry_key(
+            cls,
+            prompt: str,
+            candidates: List[TextNodeWithScore],
+            top_n: int,
+            min_n: float,
+            model_id: int
+    ) -> str:
+        """Key of a rerank. The candidates are in the order they're sent to the reranker."""
+
+        digest: str = hashlib.sha256(
+            json.dumps(
+                [
+                    cls.VERSION,
+                    RetrievalCache.normalize_prompt(prompt),
+                    [cls.candidate_fingerprint(node) for node in candidates],
+                    top_n,
+                    min_n,
+                    model_id
+                ],
+                separators=(",", ":"),
+                default=str
+            ).encode("utf-8")
+        ).hexdigest()
+
+        return f"{cls.KEY_PREFIX}:{digest}"
+
+    @classmethod
+    def rank(
+            cls,
+            candidates: List[TextNodeWithScore],
+            ranked_nodes: List[TextNodeWithScore]
+    ) -> Optional[List[RankedCandidate]]:
+        """
+        Find the candidates the reranker returned
+
+        :return: The ranking, or None if a ranked node isn't one of the candidates
+
+        """
+
+        positions: Dict[Tuple[Optional[str], str], int] = {}
+
+        for idx, node in enumerate(candidates):
+            positions.setdefault((node.node.id_, node.node.text), idx)
+
+        ranking: List[RankedCandidate] = []
+
+        for node in ranked_nodes:
+            idx: Optional[int] = positions.get((node.node.id_, node.node.text))
+
+            if idx is None:
+                return None
+
+            ranking.append((idx, node.score))
+
+        return ranking
+
+    @classmethod
+    def rebuild(cls, candidates: List[TextNodeWithScore], ranking: List[RankedCandidate]) -> List[TextNodeWithScore]:
+        """The ranked nodes, from the candidates & a ranking"""
+        return [TextNodeWithScore(node=candidates[idx].node, score=score) for idx, score in ranking]
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl > 0
+
+    async def set(self, key: str, ranking: List[RankedCandidate], **kwargs) -> None:
+        if not self.enabled:
+            return
+
+        async with self.redis() as redis:
+            await redis.set(key, json.dumps(ranking, separators=(",", ":")), ex=self._ttl)
+
+    async def get(self, key: str, **kwargs) -> Optional[List[RankedCandidate]]:
+        if not self.enabled:
+            return None
+
+        async with self.redis() as redis:
+            result: Optional[bytes] = await redis.get(key)
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return [(idx, score) for idx, score in json.loads(result)]
+
+    async def delete(self, key: str, **kwargs) -> None:
+        async with self.redis() as redis:
+            await redis.delete(key)
+
+    async def exists(self, key: str, **kwargs) -> bool:
+        async with self.redis() as redis:
+            return bool(await redis.exists(key))
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses
+        }
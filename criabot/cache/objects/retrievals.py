@@ -0,0 +1,145 @@
+import hashlib
+import json
+from typing import Optional, Dict, List, Any, Union, Tuple
+
+from CriadexSDK.ragflow_schemas import GroupSearchResponse
+from pydantic import BaseModel
+from redis.asyncio import ConnectionPool, Redis
+
+from app.core.constants import RETRIEVAL_CACHE_TTL
+from criabot.bot.chat.schemas import TextContext, QuestionContext
+from criabot.cache.core import CacheObject
+
+
+class CachedRetrieval(BaseModel):
+    """The final result of a retrieval, as stored"""
+
+    context: Optional[Union[TextContext, QuestionContext]] = None
+    group_responses: Dict[str, GroupSearchResponse] = {}
+
+
+class RetrievalCache(CacheObject):
+    """
+    Shared cache of retrieval results (the reranked context & the group responses it came from),
+    so repeated questions skip both the search & the rerank.
+
+    Each bot has a content generation counter, bumped whenever its content changes. The generations of
+    every bot searched are part of the key, so results from before a change are never served again.
+
+    """
+
+    KEY_PREFIX: str = "retrieval"
+
+    # Bump when the key parts or the stored shape change
+    VERSION: int = 1
+
+    def __init__(self, pool: ConnectionPool, ttl: int = RETRIEVAL_CACHE_TTL, client: Optional[Redis] = None):
+        super().__init__(pool, client=client)
+
+        self._ttl: int = ttl
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.bumps: int = 0
+
+    @classmethod
+    def generation_key(cls, bot_name: str) -> str:
+        return f"{cls.KEY_PREFIX}:generation:{bot_name}"
+
+    @classmethod
+    def entry_key(cls, bot_names: List[str], generations: List[int], query: Dict[str, Any]) -> str:
+        """Key of a retrieval. The query must be JSON serializable."""
+
+        digest: str = hashlib.sha256(
+            json.dumps(
+                [cls.VERSION, bot_names, generations, query],
+                sort_keys=True,
+                separators=(",", ":"),
+                default=str
+            ).encode("utf-8")
+        ).hexdigest()
+
+        return f"{cls.KEY_PREFIX}:{digest}"
+
+    @classmethod
+    def normalize_prompt(cls, prompt: str) -> str:
+        """Questions differing only in case, spacing or end punctuation get the same results"""
+        return " ".join(prompt.lower().split()).rstrip(" ?!.")
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl > 0
+
+    async def generations(self, bot_names: List[str]) -> List[int]:
+        """Get the content generations of bots, in one round trip"""
+
+        async with self.redis() as redis:
+            results: List[Optional[bytes]] = await redis.mget([self.generation_key(name) for name in bot_names])
+
+        return [int(result) if result is not None else 0 for result in results]
+
+    async def bump(self, bot_name: str) -> int:
+        """
+        Mark a bot's content (or its parameters) as changed. Call it AFTER the change is done, so no retrieval started
+        before it can be stored under the new generation.
+
+        :param bot_name: The name of the bot
+        :return: The new generation
+
+        """
+
+        async with self.redis() as redis:
+            generation: int = await redis.incr(self.generation_key(bot_name))
+
+        self.bumps += 1
+        return generation
+
+    async def lookup(self, bot_names: List[str], query: Dict[str, Any]) -> Tuple[str, Optional[CachedRetrieval]]:
+        """
+        Find the cached result of a retrieval
+
+        :param bot_names: The bots searched, the bot chatted with first
+        :param query: Everything else the result depends on (prompt, filter, retrieval params)
+        :return: The key to store the result under on a miss, and the result on a hit
+
+        """
+
+        key: str = self.entry_key(bot_names=bot_names, generations=await self.generations(bot_names), query=query)
+        return key, await self.get(key)
+
+    async def set(self, key: str, retrieval: CachedRetrieval, **kwargs) -> None:
+        if not self.enabled:
+            return
+
+        async with self.redis() as redis:
+            await redis.set(key, retrieval.model_dump_json(), ex=self._ttl)
+
+    async def get(self, key: str, **kwargs) -> Optional[CachedRetrieval]:
+        if not self.enabled:
+            return None
+
+        async with self.redis() as redis:
+            result: Optional[bytes] = await redis.get(key)
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return CachedRetrieval.model_validate_json(result)
+
+    async def delete(self, key: str, **kwargs) -> None:
+        async with self.redis() as redis:
+            await redis.delete(key)
+
+    async def exists(self, key: str, **kwargs) -> bool:
+        async with self.redis() as redis:
+            return bool(await redis.exists(key))
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bumps": self.bumps
+        }
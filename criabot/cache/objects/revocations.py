@@ -0,0 +1,49 @@
+import time
+from typing import Optional
+
+from criabot.cache.core import CacheObject
+from criabot.tokens import BotTokenPayload
+from app.core.constants import BOT_TOKEN_EXPIRE_TIME
+
+
+class TokenRevocations(CacheObject):
+    """
+    Bot token revocation list. Stores when a bot's tokens were revoked,
+    so tokens issued before then are rejected while newer ones still work.
+
+    """
+
+    KEY_PREFIX: str = "token:revoked"
+
+    @classmethod
+    def revocation_key(cls, bot_name: str) -> str:
+        return f"{cls.KEY_PREFIX}:{bot_name}"
+
+    async def set(self, bot_name: str, revoked_at: Optional[float] = None, **kwargs) -> None:
+        async with self.redis() as redis:
+            # Every token issued before this is expired once the TTL is up
+            await redis.set(
+                self.revocation_key(bot_name),
+                revoked_at or time.time(),
+                ex=kwargs.get('ex', BOT_TOKEN_EXPIRE_TIME)
+            )
+
+    async def get(self, bot_name: str, **kwargs) -> Optional[float]:
+        async with self.redis() as redis:
+            result: Optional[bytes] = await redis.get(self.revocation_key(bot_name))
+
+        return float(result) if result is not None else None
+
+    async def delete(self, bot_name: str, **kwargs) -> None:
+        async with self.redis() as redis:
+            await redis.delete(self.revocation_key(bot_name))
+
+    async def exists(self, bot_name: str, **kwargs) -> bool:
+        async with self.redis() as redis:
+            return bool(await redis.exists(self.revocation_key(bot_name)))
+
+    async def is_revoked(self, payload: BotTokenPayload) -> bool:
+        """Check if a token was issued before its bot's tokens were revoked"""
+
+        revoked_at: Optional[float] = await self.get(bot_name=payload.bot)
+        return revoked_at is not None and payload.iat <= revoked_at
@@ -1,7 +1,8 @@
 import asyncio
 import secrets
-from typing import Optional
+from typing import Optional, Tuple, Dict, Iterable, List
 
+import httpx
 from redis import asyncio as aioredis
 from CriadexSDK.ragflow_sdk import RAGFlowSDK
 from CriadexSDK.ragflow_schemas import AuthCreateConfig, GroupDeleteResponse
@@ -19,13 +20,19 @@ from criabot.schemas import (
     BotExistsError,
     BotCreateConfig,
     BotNotFoundError,
-    AboutBot
+    AboutBot,
+    ResolvedBotConfig
 )
 from .bot.schemas import ChatNotFoundError
 from .database.bots.bots import BotDatabaseAPI
 from .database.bots.tables.bot_params import BotParametersModel, BotParametersConfig, BotParametersBaseConfig
 from .database.bots.tables.bots import BotsModel, BotsConfig
+from .bot.chat.candidates import get_pruning_stats
+from .bot.chat.compaction import get_compactor
+from .bot.chat.prompts import PromptArtifacts
+from .offload import LoopLagMonitor, get_offloader
 from .schemas import InitializedAlreadyError
+from .tokens import BotTokenSigner
 
 
 class Criabot:
@@ -39,7 +46,9 @@ class Criabot:
             criadex_credentials: CriadexCredentials,
             mysql_credentials: MySQLCredentials,
             redis_credentials: RedisCredentials,
-            criadex_stacktrace: bool = False
+            criadex_stacktrace: bool = False,
+            bot_token_secret: Optional[str] = None,
+            bot_token_expire_time: Optional[int] = None
     ):
 
         # Credentials
@@ -53,6 +62,16 @@ class Criabot:
             error_stacktrace=criadex_stacktrace
         )
 
+        # Signed bot tokens (optional)
+        if bot_token_expire_time is None:
+            from app.core.constants import BOT_TOKEN_EXPIRE_TIME
+            bot_token_expire_time = BOT_TOKEN_EXPIRE_TIME
+
+        self._bot_tokens: Optional[BotTokenSigner] = (
+            BotTokenSigner(secret=bot_token_secret, expire_time=bot_token_expire_time)
+            if bot_token_secret else None
+        )
+
         # Database
         self._mysql_engine = None
         self._mysql_api = None
@@ -61,6 +80,9 @@ class Criabot:
         self._redis_pool = None
         self._redis_api = None
 
+        # Event loop blocking
+        self._loop_monitor: Optional[LoopLagMonitor] = None
+
         self._already_initialized = False
 
     async def initialize(self) -> None:
@@ -82,12 +104,7 @@ class Criabot:
         self._mysql_engine: AsyncEngine = await self._create_mysql_engine()
 
         # Redis DB Startup
-        self._redis_pool: ConnectionPool = aioredis.ConnectionPool(
-            host=self._redis_credentials.host,
-            port=self._redis_credentials.port,
-            username=self._redis_credentials.username,
-            password=self._redis_credentials.password
-        )
+        self._redis_pool: ConnectionPool = self._create_redis_pool()
 
         # SQL DB API Startup
         self._mysql_api: BotDatabaseAPI = BotDatabaseAPI(engine=self._mysql_engine)
@@ -97,6 +114,61 @@ class Criabot:
         from .cache.api import BotCacheAPI
         self._redis_api = BotCacheAPI(pool=self._redis_pool)
 
+        # Listen for bot config & authorization changes made by other workers
+        self._redis_api.bot_configs.start()
+        self._redis_api.auth.start()
+
+        # Watch how long CPU-heavy work blocks the event loop for
+        from app.core.constants import LOOP_LAG_INTERVAL
+        self._loop_monitor = LoopLagMonitor(interval=LOOP_LAG_INTERVAL)
+        self._loop_monitor.start()
+
+    async def shutdown(self) -> None:
+        """
+        Stop background tasks started by initialize()
+
+        :return: None
+
+        """
+
+        # Summarizations write to Redis, so they go first
+        await get_compactor().stop()
+
+        if self._redis_api is not None:
+            await self._redis_api.bot_configs.stop()
+            await self._redis_api.auth.stop()
+            await self._redis_api.close()
+
+        if self._loop_monitor is not None:
+            await self._loop_monitor.stop()
+
+        get_offloader().shutdown()
+
+    def _create_redis_pool(self) -> ConnectionPool:
+        """
+        Create the Redis pool. If it is bounded, callers wait for a free connection instead of erroring.
+
+        :return: The pool
+
+        """
+
+        credentials: RedisCredentials = self._redis_credentials
+
+        pool_kwargs: dict = dict(
+            host=credentials.host,
+            port=credentials.port,
+            username=credentials.username,
+            password=credentials.password,
+            health_check_interval=credentials.health_check_interval,
+            socket_timeout=credentials.socket_timeout,
+            socket_connect_timeout=credentials.socket_connect_timeout
+        )
+
+        if credentials.max_connections is None:
+            return aioredis.ConnectionPool(**pool_kwargs)
+
+        return aioredis.BlockingConnectionPool(max_connections=credentials.max_connections, **pool_kwargs)
+
     async def _create_mysql_engine(self) -> AsyncEngine:
         """
         Create the MYSQL pool & database if not found
@@ -175,6 +247,9 @@ class Criabot:
             )
         )
 
+        # Drop configs cached for a previous bot of the same name
+        await self._redis_api.bot_configs.delete(bot_name=name)
+
         # Return the config
         return new_auth
 
@@ -202,6 +277,31 @@ class Criabot:
 
         return await self._mysql_api.bots.exists(*names)
 
+    async def resolve_bots(self, names: Iterable[str]) -> Dict[str, int]:
+        """
+        Resolve bot names to their IDs, serving cached bots from the config cache & the rest in one query
+
+        :param names: The names of the bots
+        :return: The IDs of the bots that exist. Missing bots are left out.
+
+        """
+
+        resolved: Dict[str, int] = {}
+        uncached: List[str] = []
+
+        for name in dict.fromkeys(names):
+            config: Optional[ResolvedBotConfig] = await self._redis_api.bot_configs.get(bot_name=name)
+
+            if config is not None:
+                resolved[name] = config.about.info.id
+            else:
+                uncached.append(name)
+
+        if uncached:
+            resolved.update(await self._mysql_api.bots.resolve(*uncached))
+
+        return resolved
+
     async def delete(self, name: str) -> None:
         """
         Delete a bot, including its indexes (which will auto-delete the authorizations)
@@ -221,23 +321,38 @@ class Criabot:
         from .bot.bot import Bot
         bot: Bot = await self.get(name=name)
 
-        # Get index names
-        group_names = (
+        # Get index names. The cache one only exists if the answer cache was ever enabled.
+        group_names = [
             bot.group_name(index_type="QUESTION"),
-            bot.group_name(index_type="DOCUMENT"),
-            # bot.group_name(index_type="CACHE")
-        )
+            bot.group_name(index_type="DOCUMENT")
+        ]
+
+        if await self._group_exists(group_name=bot.group_name(index_type="CACHE")):
+            group_names.append(bot.group_name(index_type="CACHE"))
 
         # Delete the indexes
         for group_name in group_names:
             await self._criadex.manage.delete(group_name=group_name)
 
+        # Their authorizations are gone, so drop any cached decisions too
+        for group_name in group_names:
+            await self._redis_api.auth.delete(group_name=group_name)
+
+        # Signed tokens can't be deleted, so revoke them
+        await self._redis_api.revocations.set(bot_name=name)
+
+        # A bot created later with the same name must not be served this one's retrievals
+        await self._redis_api.retrievals.bump(bot_name=name)
+
         # Delete the bot params.py
         await self._mysql_api.bot_params.delete(bot_id=bot_id)
 
         # Delete from MySQL
         await self._mysql_api.bots.delete(name=name)
 
+        # Drop the cached config on every worker
+        await self._redis_api.bot_configs.delete(bot_name=name)
+
     async def about(self, name: str) -> AboutBot:
         """
         Retrieve the Bot's config
@@ -247,12 +362,14 @@ class Criabot:
 
         """
 
-        bots_model: BotsModel = await self._mysql_api.bots.retrieve(name=name)
+        result: Optional[Tuple[BotsModel, Optional[BotParametersModel]]] = await self._mysql_api.bots.retrieve_with_params(
+            name=name
+        )
 
-        if bots_model is None:
+        if result is None:
             raise BotNotFoundError()
 
-        params_model: BotParametersModel = await self._mysql_api.bot_params.retrieve(bot_id=bots_model.id)
+        bots_model, params_model = result
 
         # Build an about-me
         return AboutBot(
@@ -260,6 +377,49 @@ class Criabot:
             params=params_model
         )
 
+    async def get_bot_config(self, name: str) -> ResolvedBotConfig:
+        """
+        Retrieve everything a chat needs to know about a bot, served from the config cache when possible
+
+        :param name: Name of the bot
+        :return: The resolved config
+        :raises BotNotFoundError: If the bot does not exist
+
+        """
+
+        config: Optional[ResolvedBotConfig] = await self._redis_api.bot_configs.get(bot_name=name)
+
+        if config is not None:
+            return config
+
+        # Read the version first, so a change made while loading is never cached as current
+        version: int = await self._redis_api.bot_configs.version(bot_name=name)
+
+        from .bot.bot import Bot
+        bot: Bot = Bot(
+            name=name,
+            criadex=self._criadex,
+            bot_cache=self._redis_api
+        )
+
+        about_task: asyncio.Task = asyncio.create_task(self.about(name=name))
+        group_info_task: asyncio.Task = asyncio.create_task(bot.retrieve_group_info())
+
+        try:
+            about, group_info = await asyncio.gather(about_task, group_info_task)
+        finally:
+            await self._cancel_tasks(about_task, group_info_task)
+
+        config = ResolvedBotConfig(
+            about=about,
+            llm_model_id=group_info['info']['llm_model_id'],
+            rerank_model_id=group_info['info']['rerank_model_id'],
+            prompts=PromptArtifacts.compile(about.params)
+        )
+
+        await self._redis_api.bot_configs.set(bot_name=name, config=config, version=version)
+        return config
+
     async def get(self, name: str):
         """
         Retrieve an existing bot
@@ -292,27 +452,67 @@ class Criabot:
 
         """
 
-        from .cache.objects.chats import ChatModel
-        chat_model: ChatModel = await self._redis_api.chats.get(chat_id=chat_id)
-        bot_parameters: AboutBot = await self.about(name=bot_name)
-        bot = await self.get(name=bot_name)
-        group_info = await bot.retrieve_group_info()
+        # Bot existence is confirmed by the config lookup, so skip get()
+        from .bot.bot import Bot
+        bot: Bot = Bot(
+            name=bot_name,
+            criadex=self._criadex,
+            bot_cache=self._redis_api
+        )
 
-        # If the chat DNE
-        if chat_model is None:
-            raise ChatNotFoundError(chat_id=chat_id)
+        # With the config cached, only the part of the history that can fit in the buffer is read
+        bot_config: Optional[ResolvedBotConfig] = self._redis_api.bot_configs.get_cached(bot_name=bot_name)
+
+        # Otherwise, the chat & config reads are independent, so run them concurrently
+        chat_task: asyncio.Task = asyncio.create_task(
+            self._redis_api.chats.get_messages(
+                chat_id=chat_id,
+                max_tokens=bot_config.about.params.max_input_tokens if bot_config else None,
+                # Keep the chat alive while the reply is generated
+                refresh=True
+            )
+        )
+        config_task: Optional[asyncio.Task] = (
+            asyncio.create_task(self.get_bot_config(name=bot_name)) if bot_config is None else None
+        )
+
+        try:
+            # Fail fast if the chat DNE
+            from .cache.objects.chats import ChatModel
+            from .bot.chat.message import Message
+            chat: Optional[Tuple[ChatModel, List[Message]]] = await chat_task
+
+            if chat is None:
+                raise ChatNotFoundError(chat_id=chat_id)
+
+            if config_task is not None:
+                bot_config = await config_task
+        finally:
+            await self._cancel_tasks(*(task for task in (chat_task, config_task) if task is not None))
 
         # Create light-weight chat
         from criabot.bot.chat.chat import Chat
         return Chat(
             bot=bot,
-            llm_model_id=group_info['info']['llm_model_id'],
-            rerank_model_id=group_info['info']['rerank_model_id'],
-            chat_model=chat_model,
+            llm_model_id=bot_config.llm_model_id,
+            rerank_model_id=bot_config.rerank_model_id,
+            chat_model=chat[0],
+            history=chat[1],
             chat_id=chat_id,
-            bot_parameters=bot_parameters.params
+            bot_parameters=bot_config.about.params,
+            prompts=bot_config.prompts
         )
 
+    @classmethod
+    async def _cancel_tasks(cls, *tasks: asyncio.Task) -> None:
+        """Cancel any unfinished tasks & consume their results so errors aren't left unretrieved"""
+
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
     async def end_bot_chat(self, chat_id: str) -> None:
         """
         End a chat forcibly
@@ -327,8 +527,43 @@ class Criabot:
         await self._redis_api.chats.delete(chat_id=chat_id)
 
     async def update_parameters(self, name: str, params: BotParametersBaseConfig) -> None:
+        """
+        Update a bot's parameters
 
-        bot_id: Optional[int] = await self._mysql_api.bots.retrieve_id(name=name)
+        :param name: The name of the bot
+        :param params: The new parameters
+        :return: None
+        :raises BotNotFoundError: If the bot does not exist
+
+        """
+
+        bot_id: int = await self.get_id(name=name)
+
+        # Enabling the answer cache needs somewhere to store it
+        if params.answer_cache_enabled:
+            await self._ensure_cache_group(name=name)
+
+        await self._mysql_api.bot_params.update(bot_id=bot_id, config=params)
+
+        # Drop the cached config on every worker
+        await self._redis_api.bot_configs.delete(bot_name=name)
+
+        # Cached answers were written with the old parameters (e.g. the system message)
+        await self._redis_api.retrievals.bump(bot_name=name)
+
+    def create_bot_token(self, name: str) -> Optional[str]:
+        """
+        Issue a signed token for a bot that can be verified without Criadex
+
+        :param name: The name of the bot
+        :return: The token, or None if signed tokens are not enabled
+
+        """
+
+        if self._bot_tokens is None:
+            return None
+
+        return self._bot_tokens.issue(bot_name=name)
 
     async def _create_new_bot_auth(self):
         """
@@ -359,12 +594,11 @@ class Criabot:
         :param bot_name: The name of the bot
         :param bot_config: The config (model definitions pretty much)
         :param bot_api_key: The API key to authenticate on the indexes
-        :return: The indices, in the order of [DOCUMENT, QUESTION, CACHE]
+        :return: The indices, in the order of [QUESTION, DOCUMENT, CACHE]. CACHE only if the answer cache is enabled.
 
         """
 
-
-        async def create_group(index_type):
+        async def create_group(index_type, authorize: bool = True):
             from .bot.bot import Bot
             group_name = bot_name + Bot.INDEX_SUFFIX[index_type]
             new_group = await self._create_new_bot_group(
@@ -376,16 +610,72 @@ class Criabot:
                     "rerank_model_id": bot_config.rerank_model_id
                 }
             )
-            await self._create_new_bot_auth_group(
-                group_name=group_name,
-                bot_api_key=bot_api_key
-            )
+            if authorize:
+                await self._create_new_bot_auth_group(
+                    group_name=group_name,
+                    bot_api_key=bot_api_key
+                )
             return new_group
 
-        return (
+        groups = [
             await create_group("QUESTION"),
-            await create_group("DOCUMENT"),
-            # await create_group("CACHE")
+            await create_group("DOCUMENT")
+        ]
+
+        # Only Criabot reads & writes the answer cache (as master), so the bot key isn't given access to it.
+        # This keeps it the same as a CACHE group created later by _ensure_cache_group(), where the key isn't known.
+        if bot_config.answer_cache_enabled:
+            groups.append(await create_group("CACHE", authorize=False))
+
+        return tuple(groups)
+
+    async def _group_exists(self, group_name: str) -> bool:
+        """
+        Check if a Criadex group exists
+
+        :param group_name: The name of the group
+        :return: Whether it exists
+        :raises httpx.HTTPStatusError: If Criadex fails for any other reason than the group not existing
+
+        """
+
+        try:
+            response = await self._criadex.manage.about(group_name=group_name)
+        except httpx.HTTPStatusError as ex:
+            if ex.response.status_code == 404:
+                return False
+            raise
+
+        return not (isinstance(response, dict) and response.get("status") == 404)
+
+    async def _ensure_cache_group(self, name: str) -> None:
+        """
+        Create the answer cache group of a bot made before it had one, with the models of its DOCUMENT group.
+        The bot's API key isn't authorized on it, as with one made by create(). Only Criabot uses it.
+
+        :param name: The name of the bot
+        :return: None
+
+        """
+
+        from .bot.bot import Bot
+        group_name: str = Bot.bot_group_name(bot_name=name, index_type="CACHE")
+
+        if await self._group_exists(group_name=group_name):
+            return
+
+        document_info = await self._criadex.manage.about(
+            group_name=Bot.bot_group_name(bot_name=name, index_type="DOCUMENT")
+        )
+
+        await self._create_new_bot_group(
+            group_name=group_name,
+            group_config={
+                "type": "CACHE",
+                "llm_model_id": document_info['info']['llm_model_id'],
+                "embedding_model_id": document_info['info']['embedding_model_id'],
+                "rerank_model_id": document_info['info']['rerank_model_id']
+            }
         )
 
     async def _create_new_bot_group(
@@ -440,3 +730,23 @@ class Criabot:
     @property
     def criadex(self):
         return self._criadex
+
+    @property
+    def bot_tokens(self) -> Optional[BotTokenSigner]:
+        return self._bot_tokens
+
+    @property
+    def stats(self) -> dict:
+        """
+        Cache hit rates, where CPU-heavy work ran, chat summarizations, how much smaller rerank requests were made
+        & how long the event loop was blocked for
+
+        """
+
+        return {
+            **(self._redis_api.stats if self._redis_api is not None else {}),
+            "offload": get_offloader().stats,
+            "compaction": get_compactor().stats,
+            "rerank_candidates": get_pruning_stats().stats,
+            "event_loop": self._loop_monitor.stats if self._loop_monitor is not None else {}
+        }
@@ -1,7 +1,8 @@
 from typing import Optional
 
-from pydantic import BaseModel
-from sqlalchemy import Integer, Numeric, Boolean, Text, ForeignKey, insert, delete, select, update, \
+import tiktoken
+from pydantic import BaseModel, field_validator
+from sqlalchemy import Integer, Numeric, Boolean, Text, String, ForeignKey, insert, delete, select, update, \
     CursorResult, ChunkedIteratorResult
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -16,6 +17,7 @@ class BotParametersTable(BaseTable):
 
     max_input_tokens: Mapped[int] = mapped_column(Integer, nullable=False)
     max_reply_tokens: Mapped[int] = mapped_column(Integer, nullable=False)
+    max_context_tokens: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
     temperature: Mapped[float] = mapped_column(Numeric(2, 1), nullable=False)
     top_p: Mapped[float] = mapped_column(Numeric(2, 1), nullable=False)
 
@@ -24,6 +26,7 @@ class BotParametersTable(BaseTable):
 
     top_n: Mapped[int] = mapped_column(Integer, nullable=False)
     min_n: Mapped[float] = mapped_column(Numeric(2, 1), nullable=False)
+    max_rerank_candidates: Mapped[int] = mapped_column(Integer, nullable=False, server_default="20")
 
     llm_generate_related_prompts: Mapped[bool] = mapped_column(Boolean, nullable=False)
 
@@ -32,12 +35,22 @@ class BotParametersTable(BaseTable):
     no_context_llm_guess: Mapped[bool] = mapped_column(Boolean, nullable=False)
     system_message: Mapped[str] = mapped_column(Text, nullable=True)
 
+    tokenizer_encoding: Mapped[str] = mapped_column(String(64), nullable=False, server_default="cl100k_base")
+
+    compaction_enabled: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="0")
+    compaction_threshold_tokens: Mapped[int] = mapped_column(Integer, nullable=False, server_default="1000")
+    compaction_summary_tokens: Mapped[int] = mapped_column(Integer, nullable=False, server_default="300")
+
+    answer_cache_enabled: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="0")
+    answer_cache_min_score: Mapped[float] = mapped_column(Numeric(3, 2), nullable=False, server_default="0.95")
+
 
 class BotParametersBaseConfig(BaseModel):
     # Model Params
 
     max_input_tokens: int = 2000  # Max context in chats
     max_reply_tokens: int = 1024  # Max REPLY TOKENS
+    max_context_tokens: int = 0  # Max tokens of retrieved documents in a prompt, 0 for half of max_input_tokens
     temperature: float = 0.9  # Max REPLY temperature
     top_p: float = 0  # Max REPLY P
 
@@ -48,6 +61,7 @@ class BotParametersBaseConfig(BaseModel):
     # Rerank Params
     top_n: int = 3
     min_n: float = 0.7
+    max_rerank_candidates: int = 20  # Max search results sent to the reranker, shared evenly by the groups. 0 for no limit
 
     # Context Params
     llm_generate_related_prompts: bool = True
@@ -57,6 +71,26 @@ class BotParametersBaseConfig(BaseModel):
     no_context_llm_guess: bool = False
     system_message: Optional[str] = None  # System message to embed
 
+    # Token counting
+    tokenizer_encoding: str = "cl100k_base"  # tiktoken encoding matching the bot's LLM
+
+    # Compaction Params
+    compaction_enabled: bool = False  # Summarize the turns that no longer fit in max_input_tokens
+    compaction_threshold_tokens: int = 1000  # Dropped tokens that trigger a summarization
+    compaction_summary_tokens: int = 300  # Max tokens of the summary, reserved in every prompt
+
+    # Answer Cache Params
+    answer_cache_enabled: bool = False  # Answer first prompts similar to an earlier one with its reply
+    answer_cache_min_score: float = 0.95  # Min similarity of the earlier prompt
+
+    @field_validator("tokenizer_encoding")
+    @classmethod
+    def validate_tokenizer_encoding(cls, value: str) -> str:
+        if value not in tiktoken.list_encoding_names():
+            raise ValueError(f"Unknown tokenizer encoding '{value}'. Options: {tiktoken.list_encoding_names()}")
+
+        return value
+
 
 class BotParametersConfig(BotParametersBaseConfig):
     # Ref
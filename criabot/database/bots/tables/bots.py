@@ -1,10 +1,11 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple, Dict
 
 from pydantic import BaseModel
-from sqlalchemy import Integer, TIMESTAMP, String, func, insert, delete, select, ChunkedIteratorResult, CursorResult
+from sqlalchemy import Integer, TIMESTAMP, String, func, insert, delete, select, ChunkedIteratorResult, CursorResult, Row
 from sqlalchemy.orm import Mapped, mapped_column
 
+from criabot.database.bots.tables.bot_params import BotParametersTable, BotParametersModel
 from criabot.database.table import TableAPI, BaseTable
 
 
@@ -54,20 +55,56 @@ class BotsAPI(TableAPI):
             entry: BotsTable = self.fetchone_or_none(result)
         return self.to_model(entry, BotsModel)
 
+    async def retrieve_with_params(self, name: str) -> Optional[Tuple[BotsModel, Optional[BotParametersModel]]]:
+        """Retrieve a bot & its parameters (None if it has none) in a single joined query"""
+
+        async with self.get_async_session() as session:
+            result: Optional[ChunkedIteratorResult] = await session.execute(
+                select(self.Schema, BotParametersTable)
+                .outerjoin(BotParametersTable, BotParametersTable.bot_id == self.Schema.id)
+                .where(self.Schema.name == name)
+            )
+
+            row: Optional[Row] = result.fetchone()
+
+        if row is None:
+            return None
+
+        entry, params_entry = row.tuple()
+        return self.to_model(entry, BotsModel), self.to_model(params_entry, BotParametersModel)
+
     async def retrieve_id(self, name: str) -> Optional[int]:
         model: Optional[BotsModel] = await self.retrieve(name=name)
         return model.id if model else None
 
-    async def exists(self, *names: str) -> bool:
-        async with self.get_async_session() as session:
+    @classmethod
+    def name_key(cls, name: str) -> str:
+        """Names compare case-insensitively, like the table's collation does"""
+        return name.casefold()
+
+    async def resolve(self, *names: str) -> Dict[str, int]:
+        """
+        Map each existing bot name to its ID in a single query. Missing bots are left out.
+        The IDs are keyed by the names as given, which may differ in case from the stored ones.
+
+        """
 
+        if not names:
+            return {}
+
+        async with self.get_async_session() as session:
             result: Optional[ChunkedIteratorResult] = await session.execute(
-                select(self.Schema)
-                .filter(self.Schema.name.in_(names))
+                select(self.Schema.name, self.Schema.id)
+                .where(self.Schema.name.in_(set(names)))
             )
 
-            entry: BotsTable = self.fetchone_or_none(result)
+            found: Dict[str, int] = {self.name_key(name): bot_id for name, bot_id in result.all()}
+
+        return {name: found[self.name_key(name)] for name in names if self.name_key(name) in found}
+
+    async def exists(self, *names: str) -> bool:
+        """Check that EVERY named bot exists"""
 
-        return bool(entry)
+        return len(await self.resolve(*names)) == len(set(names))
 
 
@@ -3,7 +3,8 @@ from contextlib import asynccontextmanager
 from typing import TypeVar, Type, AsyncGenerator, Optional
 
 from pydantic import BaseModel
-from sqlalchemy import Row, Connection, ChunkedIteratorResult
+from sqlalchemy import Row, Connection, ChunkedIteratorResult, inspect, text
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncAttrs, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
@@ -51,10 +52,28 @@ class TableAPI:
     async def initialize(self) -> None:
         def create_all(sync_conn: Connection):
             self.Schema.metadata.create_all(sync_conn, checkfirst=True)
+            self.add_missing_columns(sync_conn)
 
         async with self._engine.begin() as connection:
             await connection.run_sync(create_all)
 
+    @classmethod
+    def add_missing_columns(cls, sync_conn: Connection) -> None:
+        """
+        create_all() won't alter existing tables, so add columns introduced since the table was created.
+        New columns must be nullable or have a server default.
+
+        """
+
+        existing: set = {column["name"] for column in inspect(sync_conn).get_columns(cls.Schema.__tablename__)}
+
+        for column in cls.Schema.__table__.columns:
+            if column.name in existing:
+                continue
+
+            column_ddl: str = str(CreateColumn(column).compile(dialect=sync_conn.dialect))
+            sync_conn.execute(text(f"ALTER TABLE {cls.Schema.__tablename__} ADD COLUMN {column_ddl}"))
+
     @asynccontextmanager
     async def get_async_session(self) -> AsyncGenerator[AsyncSession, None]:
         """Get a session from the engine"""
@@ -0,0 +1,191 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial, lru_cache
+from typing import Callable, TypeVar, Optional, Dict, Any
+
+T = TypeVar('T')
+
+
+class Offloader:
+    """
+    Runs CPU-heavy work off the event loop thread, so one big payload doesn't stall every other request.
+
+    Threads suit work that releases the GIL (tiktoken). Processes suit pure-Python work, at the cost of
+    pickling the arguments & result. Either way, small payloads run inline, where that's cheaper than the hand-off.
+
+    """
+
+    def __init__(self, threads: int, processes: int, min_thread_size: int, min_process_size: int):
+        """
+        Instantiate the offloader. The pools are created on first use.
+
+        :param threads: Max threads. 0 runs everything inline.
+        :param processes: Max processes. 0 runs process work in the threads instead.
+        :param min_thread_size: Smallest payload (e.g. in characters) worth running in a thread
+        :param min_process_size: Smallest payload worth running in a process
+
+        """
+
+        self._threads: int = threads
+        self._processes: int = processes
+        self.min_thread_size: int = min_thread_size
+        self.min_process_size: int = min_process_size
+
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+        self.inline_calls: int = 0
+        self.thread_calls: int = 0
+        self.process_calls: int = 0
+
+    def _thread_executor(self) -> Optional[ThreadPoolExecutor]:
+        if self._threads < 1:
+            return None
+
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self._threads, thread_name_prefix="offload")
+
+        return self._thread_pool
+
+    def _process_executor(self) -> Optional[Executor]:
+        if self._processes < 1:
+            return self._thread_executor()
+
+        if self._process_pool is None:
+            # Forking a process with a running event loop & threads isn't safe
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self._processes,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+
+        return self._process_pool
+
+    async def run_in_thread(self, size: int, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run a function in the thread pool if the payload is big enough, otherwise inline
+
+        :param size: Size of the payload, in the same unit as the threshold
+        :param fn: The function, which must be thread-safe
+        :return: Its result
+
+        """
+
+        return await self._run(self._thread_executor() if size >= self.min_thread_size else None, fn, *args, **kwargs)
+
+    async def run_in_process(self, size: int, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run a function in the process pool if the payload is big enough, otherwise inline
+
+        :param size: Size of the payload, in the same unit as the threshold
+        :param fn: The function, which must be importable & take/return picklable values
+        :return: Its result
+
+        """
+
+        return await self._run(self._process_executor() if size >= self.min_process_size else None, fn, *args, **kwargs)
+
+    async def _run(self, executor: Optional[Executor], fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if executor is None:
+            self.inline_calls += 1
+            return fn(*args, **kwargs)
+
+        if executor is self._process_pool:
+            self.process_calls += 1
+        else:
+            self.thread_calls += 1
+
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(fn, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        """Stop the pools. They are recreated if used again."""
+
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        self._thread_pool = None
+        self._process_pool = None
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Where calls ran"""
+
+        return {
+            "inline": self.inline_calls,
+            "thread": self.thread_calls,
+            "process": self.process_calls
+        }
+
+
+class LoopLagMonitor:
+    """Measures how long the event loop is blocked for, by how late a periodic wake-up runs"""
+
+    def __init__(self, interval: float):
+        """
+        Instantiate the monitor
+
+        :param interval: Seconds between samples. 0 disables it.
+
+        """
+
+        self._interval: float = interval
+        self._task: Optional[asyncio.Task] = None
+
+        self.samples: int = 0
+        self.total_lag: float = 0
+        self.max_lag: float = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._interval > 0
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def record(self, lag: float) -> None:
+        self.samples += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+
+    async def run(self) -> None:
+        while True:
+            started_at: float = time.monotonic()
+            await asyncio.sleep(self._interval)
+            self.record(max(0.0, time.monotonic() - started_at - self._interval))
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """Lag in milliseconds. The total is roughly how long the loop spent blocked."""
+
+        return {
+            "samples": self.samples,
+            "total_lag_ms": round(self.total_lag * 1000, 3),
+            "mean_lag_ms": round(self.total_lag * 1000 / self.samples, 3) if self.samples else 0,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "monitoring": self._task is not None and not self._task.done()
+        }
+
+
+@lru_cache(maxsize=None)
+def get_offloader() -> Offloader:
+    """Get this process's offloader, configured from the environment"""
+
+    from app.core.constants import OFFLOAD_THREADS, OFFLOAD_PROCESSES, OFFLOAD_MIN_THREAD_SIZE, OFFLOAD_MIN_PROCESS_SIZE
+
+    return Offloader(
+        threads=OFFLOAD_THREADS,
+        processes=OFFLOAD_PROCESSES,
+        min_thread_size=OFFLOAD_MIN_THREAD_SIZE,
+        min_process_size=OFFLOAD_MIN_PROCESS_SIZE
+    )
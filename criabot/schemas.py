@@ -1,5 +1,8 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
+from criabot.bot.chat.prompts import PromptArtifacts
 from criabot.database.bots.tables.bot_params import BotParametersModel, BotParametersBaseConfig
 from criabot.database.bots.tables.bots import BotsModel
 
@@ -27,6 +30,15 @@ class AboutBot(BaseModel):
     params: BotParametersModel
 
 
+class ResolvedBotConfig(BaseModel):
+    """Everything a chat needs to know about its bot"""
+
+    about: AboutBot
+    llm_model_id: int
+    rerank_model_id: int
+    prompts: Optional[PromptArtifacts] = None  # Compiled from the params when the config is loaded
+
+
 class CriadexCredentials(BaseModel):
     """
     Credentials for Criadex SDK
@@ -61,3 +73,9 @@ class RedisCredentials(BaseModel):
     port: int
     username: str
     password: str
+
+    # Connection pool tuning, unset means the redis-py default
+    max_connections: Optional[int] = None  # Bounds the pool, requests wait for a free connection
+    health_check_interval: int = 0  # Seconds a connection may be idle before it is checked with a PING
+    socket_timeout: Optional[float] = None
+    socket_connect_timeout: Optional[float] = None
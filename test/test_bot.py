@@ -48,4 +48,13 @@ async def test_search_group(bot, criadex_api):
 async def test_set_chat_model(bot):
     chat_model = MagicMock()
     await bot.set_chat_model(chat_id="test_chat", chat_model=chat_model)
-    bot.cache_api.chats.set.assert_called_once_with(chat_id="test_chat", chat_model=chat_model)
\ No newline at end of file
+    bot.cache_api.chats.set.assert_called_once_with(chat_id="test_chat", chat_model=chat_model)
+
+
+@pytest.mark.asyncio
+async def test_content_changes_bump_retrieval_generation(bot, bot_cache_api):
+    await bot.add_group_content(index_type="DOCUMENT", file=MagicMock(model_dump=MagicMock(return_value={})))
+    await bot.delete_group_file(index_type="QUESTION", document_name="file")
+
+    assert bot_cache_api.retrievals.bump.call_count == 2
+    bot_cache_api.retrievals.bump.assert_called_with(bot_name="test_bot")
@@ -0,0 +1,102 @@
+from unittest.mock import patch
+
+from criabot.bot.chat.buffer import ChatBuffer
+from criabot.bot.chat.message import Message
+from criabot.bot.chat.tokenizer import Tokenizer
+
+
+def _history(*token_counts):
+    return [
+        Message(role="user", text="x", metadata={ChatBuffer.TOKEN_COUNT_META_NAME: count})
+        for count in token_counts
+    ]
+
+
+def test_window_start_keeps_longest_fitting_tail():
+    history = _history(50, 10, 20, 30)
+    assert ChatBuffer.window_start(history, available_tokens=60) == 1
+    assert ChatBuffer.window_start(history, available_tokens=110) == 0
+    assert ChatBuffer.window_start(history, available_tokens=59) == 2
+    assert ChatBuffer.window_start(history, available_tokens=49) == 3
+
+
+def test_window_start_always_keeps_newest_message():
+    assert ChatBuffer.window_start(_history(10, 100), available_tokens=50) == 1
+    assert ChatBuffer.window_start([], available_tokens=50) == 0
+
+
+def test_buffer_message_truncates_with_one_encode():
+    tokenizer = Tokenizer()
+    message = Message(role="user", text="word " * 500)
+    with patch.object(tokenizer._encoding, "encode_ordinary", wraps=tokenizer._encoding.encode_ordinary) as encode:
+        ChatBuffer.buffer_message(message, max_tokens=100, tokenizer=tokenizer)
+
+    assert encode.call_count == 1
+    assert ChatBuffer.get_token_metadata(message) == 100
+    assert tokenizer.count(message.text) <= 100
+
+
+def test_buffer_message_keeps_head_or_tail():
+    tokenizer = Tokenizer()
+    text = "start " + "middle " * 200 + "end"
+    head = Message(role="user", text=text)
+    tail = Message(role="user", text=text)
+
+    ChatBuffer.buffer_message(head, max_tokens=20, tokenizer=tokenizer, keep="head")
+    ChatBuffer.buffer_message(tail, max_tokens=20, tokenizer=tokenizer, keep="tail")
+
+    assert head.text.startswith("start") and not head.text.endswith("end")
+    assert tail.text.endswith("end") and "start" not in tail.text
+
+
+def test_truncate_drops_partial_multibyte_characters():
+    tokenizer = Tokenizer()
+    text = "日本語のテキスト" * 50
+    for max_tokens in range(1, 40):
+        for keep in ("head", "tail"):
+            truncated, token_count = tokenizer.truncate(text, max_tokens=max_tokens, keep=keep)
+            assert "�" not in truncated
+            assert token_count <= max_tokens
+            assert tokenizer.count(truncated) <= max_tokens
+            assert text.startswith(truncated) if keep == "head" else text.endswith(truncated)
+
+
+def test_add_message_only_counts_the_new_message():
+    tokenizer = Tokenizer()
+    buffer = ChatBuffer(max_tokens=1000, history=[Message(role="system", text="system"), *_history(10, 20)], tokenizer=tokenizer)
+
+    with patch.object(tokenizer, "count_batch", wraps=tokenizer.count_batch) as count_batch:
+        buffer.add_message(Message(role="user", text="hello"))
+
+    count_batch.assert_called_once_with(["hello"])
+    assert buffer.tokens == tokenizer.count("system") + 30 + tokenizer.count("hello")
+    assert [m.role for m in buffer.history] == ["system", "user", "user", "user"]
+
+
+def test_buffer_trims_oldest_and_places_ephemeral_before_prompt():
+    system = Message(role="system", text="x", metadata={})
+    buffer = ChatBuffer(max_tokens=60 + ChatBuffer.EXTRA_TOKEN_MARGIN, history=[system, *_history(30, 20)])
+    system_tokens = ChatBuffer.get_token_metadata(system)
+
+    buffer.add_message(_history(30 - system_tokens)[0])
+    assert [ChatBuffer.get_token_metadata(m) for m in buffer.history[1:]] == [20, 30 - system_tokens]
+
+    ephemeral = Message(role="system", text="some retrieved context " * 3)
+    history = buffer.buffer(system_ephemeral=ephemeral)
+    assert history[0] is system and history[-2] is ephemeral
+    assert ephemeral not in buffer.history
+    assert buffer.tokens - system_tokens <= buffer.available_tokens(system_ephemeral=ephemeral)
+    assert buffer.history[-1] is history[-1]
+
+
+def test_summary_is_pinned_after_system_and_reserved():
+    system = Message(role="system", text="x", metadata={})
+    summary = Message(role="system", text="summary", metadata={ChatBuffer.TOKEN_COUNT_META_NAME: 20})
+    buffer = ChatBuffer(max_tokens=60 + ChatBuffer.EXTRA_TOKEN_MARGIN, history=[system, *_history(30, 20)], summary=summary)
+
+    assert buffer.available_tokens() == 60 - ChatBuffer.get_token_metadata(system) - 20
+
+    history = buffer.buffer()
+    assert history[0] is system and history[1] is summary
+    assert summary not in buffer.history
+    assert buffer.dropped == 1
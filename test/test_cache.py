@@ -0,0 +1,441 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from criabot.cache.local import LocalCache
+from criabot.cache.objects.auth import AuthCache, AuthDecision
+from app.core.security.handlers.any import GetApiKeyAny
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the oldest
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_local_cache_expires_entries():
+    cache = LocalCache(max_size=2, ttl=60)
+    with patch("criabot.cache.local.time.monotonic", return_value=0):
+        cache.set("a", 1)
+    with patch("criabot.cache.local.time.monotonic", return_value=61):
+        assert cache.get("a") is None
+    assert cache.stats == {"hits": 0, "misses": 1, "size": 0}
+
+def test_local_cache_delete_where():
+    cache = LocalCache(max_size=10, ttl=60)
+    cache.set(("key", "group-a"), 1)
+    cache.set(("key", "group-b"), 2)
+    assert cache.delete_where(lambda key: key[1] == "group-a") == 1
+    assert cache.get(("key", "group-a")) is None
+    assert cache.get(("key", "group-b")) == 2
+
+def test_auth_decision_from_response():
+    decision = AuthDecision.from_response({"api_key": "key", "master": False, "authorized": True})
+    assert decision.authorized is True
+    assert decision.master is False
+
+@pytest.mark.asyncio
+async def test_auth_cache_serves_local_tier_without_redis():
+    auth_cache = AuthCache(pool=MagicMock(), ttl=30, max_size=10)
+    auth_cache.redis = MagicMock()
+    auth_cache._local.set((AuthCache.hash_key("key"), "group"), AuthDecision(authorized=True))
+
+    decision = await auth_cache.get(api_key="key", group_name="group")
+
+    assert decision.authorized is True
+    auth_cache.redis.assert_not_called()
+    assert auth_cache.stats["local_hits"] == 1
+
+def test_auth_decision_rejects_errors_and_malformed_responses():
+    assert AuthDecision.from_response({"status": 500, "authorized": False}) is None
+    assert AuthDecision.from_response({"message": "Internal error"}) is None
+    assert AuthDecision.from_response(None) is None
+    assert AuthDecision.from_response({"status": 200, "authorized": False}).authorized is False
+
+class _FakeAuthRedis:
+    def __init__(self):
+        self.data, self.expiry, self.sets, self.published = {}, {}, {}, []
+
+    def pipeline(self, transaction=True):
+        redis, queued = self, []
+
+        class _Pipe:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                return False
+
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: queued.append(getattr(redis, name)(*args, **kwargs))
+
+            async def execute(self):
+                return [await command for command in queued]
+
+        return _Pipe()
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value.encode()
+        self.expiry[key] = ex * 1000
+
+    async def pttl(self, key):
+        return self.expiry.get(key, -2) if key in self.data else -2
+
+    async def sadd(self, key, member):
+        self.sets.setdefault(key, set()).add(member)
+
+    async def expire(self, key, ttl):
+        pass
+
+    async def smembers(self, key):
+        return self.sets.get(key, set())
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.sets.pop(key, None)
+
+    async def eval(self, script, numkeys, key, channel, message):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        self.published.append((channel, message))
+
+def _auth_cache_with_redis(redis):
+    from contextlib import asynccontextmanager
+    auth_cache = AuthCache(pool=MagicMock(), ttl=30, max_size=10)
+
+    @asynccontextmanager
+    async def _redis():
+        yield redis
+
+    @asynccontextmanager
+    async def _pipeline(transaction=True):
+        async with redis.pipeline(transaction) as pipe:
+            yield pipe
+
+    auth_cache.redis = _redis
+    auth_cache.pipeline = _pipeline
+    return auth_cache
+
+@pytest.mark.asyncio
+async def test_auth_cache_does_not_cache_denials():
+    redis = _FakeAuthRedis()
+    auth_cache = _auth_cache_with_redis(redis)
+
+    await auth_cache.set(api_key="key", decision=AuthDecision(authorized=False))
+
+    assert redis.data == {}
+    assert await auth_cache.get(api_key="key") is None
+
+@pytest.mark.asyncio
+async def test_auth_cache_local_tier_expires_with_redis():
+    redis = _FakeAuthRedis()
+    auth_cache = _auth_cache_with_redis(redis)
+    await auth_cache.set(api_key="key", decision=AuthDecision(authorized=True), group_name="group")
+    auth_cache._local.clear()
+    redis.expiry[AuthCache.decision_key(AuthCache.hash_key("key"), "group")] = 5000
+
+    with patch("criabot.cache.local.time.monotonic", return_value=0):
+        assert (await auth_cache.get(api_key="key", group_name="group")).authorized is True
+    with patch("criabot.cache.local.time.monotonic", return_value=6):
+        assert auth_cache._local.get((AuthCache.hash_key("key"), "group")) is None
+
+@pytest.mark.asyncio
+async def test_auth_cache_delete_invalidates_key_level_decisions():
+    redis = _FakeAuthRedis()
+    auth_cache = _auth_cache_with_redis(redis)
+    other_worker = _auth_cache_with_redis(redis)
+    await auth_cache.set(api_key="key", decision=AuthDecision(authorized=True))
+    await other_worker.set(api_key="key", decision=AuthDecision(authorized=True))
+
+    await auth_cache.delete(group_name="group")
+
+    # The other worker drops its copy when the invalidation is published to it
+    assert redis.published == [(AuthCache.CHANNEL, "group")]
+    other_worker._on_invalidate(group_name=redis.published[0][1])
+    assert await auth_cache.get(api_key="key") is None
+    assert await other_worker.get(api_key="key") is None
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_cache_only_their_own_key():
+    import asyncio
+    from app.core.security.get_api_key import BadAPIKeyException
+    auth_cache = _auth_cache_with_redis(_FakeAuthRedis())
+    good_key_checking = asyncio.Event()
+    bad_key_checked = asyncio.Event()
+
+    async def _check(api_key):
+        if api_key == "good_key":
+            good_key_checking.set()
+            await bad_key_checked.wait()
+            return {"authorized": True, "master": False}
+
+        bad_key_checked.set()
+        return {"authorized": False, "master": False}
+
+    request = MagicMock()
+    request.app.criabot.redis_api.auth = auth_cache
+    request.app.criabot.criadex._error_stacktrace = False
+    request.app.criabot.criadex.auth.check = AsyncMock(side_effect=_check)
+
+    # Both requests go through the one instance their routes share
+    shared = GetApiKeyAny()
+    good = asyncio.create_task(shared(request, query_api_key="good_key", header_api_key=None))
+    await good_key_checking.wait()
+
+    with pytest.raises(BadAPIKeyException):
+        await shared(request, query_api_key="bad_key", header_api_key=None)
+
+    assert await good == "good_key"
+    assert await auth_cache.get(api_key="good_key") is not None
+    assert await auth_cache.get(api_key="bad_key") is None
+
+@pytest.mark.asyncio
+async def test_get_auth_uses_cached_decision():
+    get_api_key_any = GetApiKeyAny()
+    get_api_key_any.api_key = "non_master_key"
+    get_api_key_any.criadex = MagicMock()
+    get_api_key_any.criadex._error_stacktrace = False
+    get_api_key_any.criadex.auth.check = AsyncMock()
+    get_api_key_any.criabot = MagicMock()
+    get_api_key_any.criabot.redis_api.auth.get = AsyncMock(return_value=AuthDecision(authorized=True))
+
+    result = await get_api_key_any.execute()
+
+    assert result == "non_master_key"
+    get_api_key_any.criadex.auth.check.assert_not_called()
+
+def _bot_config(bot_name="test_bot"):
+    from criabot.schemas import AboutBot, ResolvedBotConfig
+    from criabot.database.bots.tables.bots import BotsModel
+    from criabot.database.bots.tables.bot_params import BotParametersModel
+    return ResolvedBotConfig(
+        about=AboutBot(
+            info=BotsModel(name=bot_name, id=1, created="2024-01-01T00:00:00"),
+            params=BotParametersModel(id=1, bot_id=1)
+        ),
+        llm_model_id=1,
+        rerank_model_id=2
+    )
+
+@pytest.mark.asyncio
+async def test_bot_config_cache_invalidation_drops_older_versions():
+    from criabot.cache.objects.bot_config import BotConfigCache
+    config_cache = BotConfigCache(pool=MagicMock(), ttl=60, max_size=10)
+    await config_cache.set(bot_name="test_bot", config=_bot_config(), version=1)
+
+    # A stale (or our own) message must not evict a newer entry
+    config_cache._on_invalidate(bot_name="test_bot", version=1)
+    assert await config_cache.get(bot_name="test_bot") is not None
+
+    config_cache._on_invalidate(bot_name="test_bot", version=2)
+    assert await config_cache.get(bot_name="test_bot") is None
+    assert config_cache.stats["invalidations"] == 1
+
+    # A config loaded before the change must not be cached
+    await config_cache.set(bot_name="test_bot", config=_bot_config(), version=1)
+    assert await config_cache.get(bot_name="test_bot") is None
+
+@pytest.mark.asyncio
+async def test_get_bot_config_skips_mysql_and_criadex_on_hit():
+    from criabot.criabot import Criabot
+    from criabot.cache.objects.bot_config import BotConfigCache
+    with patch('criabot.criabot.RAGFlowSDK'):
+        criabot = Criabot(MagicMock(), MagicMock(), MagicMock())
+    criabot._mysql_api = MagicMock()
+    criabot._mysql_api.bots.retrieve_with_params = AsyncMock(return_value=(
+        _bot_config().about.info, _bot_config().about.params
+    ))
+    criabot._criadex = MagicMock()
+    criabot._criadex.manage.about = AsyncMock(return_value={"info": {"llm_model_id": 1, "rerank_model_id": 2}})
+    criabot._redis_api = MagicMock()
+    criabot._redis_api.bot_configs = BotConfigCache(pool=MagicMock(), ttl=60, max_size=10)
+    criabot._redis_api.bot_configs.version = AsyncMock(return_value=0)
+
+    first = await criabot.get_bot_config(name="test_bot")
+    second = await criabot.get_bot_config(name="test_bot")
+
+    assert first.rerank_model_id == second.rerank_model_id == 2
+    criabot._mysql_api.bots.retrieve_with_params.assert_called_once()
+    criabot._criadex.manage.about.assert_called_once()
+    assert criabot._redis_api.bot_configs.stats["hits"] == 1
+
+def _chats_with_redis(redis):
+    from contextlib import asynccontextmanager
+    from criabot.cache.objects.chats import Chats
+
+    @asynccontextmanager
+    async def _redis():
+        yield redis
+
+    chats = Chats(pool=MagicMock())
+    chats.redis = _redis
+    return chats
+
+@pytest.mark.asyncio
+async def test_chats_get_reads_header_and_tail():
+    from CriadexSDK.ragflow_schemas import ChatMessage
+    system = ChatMessage(role="system", blocks=[{"type": "text", "text": "be nice"}])
+    reply = ChatMessage(role="assistant", blocks=[{"type": "text", "text": "hi"}])
+    chats = _chats_with_redis(MagicMock())
+    chats._read_tail_script = AsyncMock(return_value=[
+        [b"started_at", b"123", b"schema_version", b"2", b"system", system.model_dump_json().encode()],
+        [reply.model_dump_json().encode()],
+        0
+    ])
+
+    chat_model = await chats.get(chat_id="chat", max_tokens=100)
+
+    assert chat_model.started_at == 123
+    assert [m.role for m in chat_model.history] == ["system", "assistant"]
+    assert chats._read_tail_script.call_args[1]["args"] == [100, 0]
+
+    await chats.get(chat_id="chat", refresh=True, ex=60)
+    assert chats._read_tail_script.call_args[1]["args"] == [-1, 60]
+
+@pytest.mark.asyncio
+async def test_chats_get_messages_skips_chat_message():
+    from CriadexSDK.ragflow_schemas import ChatMessage
+    from criabot.bot.chat.message import Message
+    system = ChatMessage(role="system", blocks=[{"type": "text", "text": "be nice"}])
+    reply = ChatMessage(role="assistant", blocks=[{"type": "text", "text": "hi"}], metadata={"token_count": 1})
+    chats = _chats_with_redis(MagicMock())
+    chats._read_tail_script = AsyncMock(return_value=[
+        [b"started_at", b"123", b"schema_version", b"2", b"system", system.model_dump_json().encode()],
+        [reply.model_dump_json().encode()],
+        0
+    ])
+
+    chat_model, history = await chats.get_messages(chat_id="chat", max_tokens=100)
+
+    assert chat_model.started_at == 123 and chat_model.history == []
+    assert all(isinstance(m, Message) for m in history)
+    assert [(m.role, m.text) for m in history] == [("system", "be nice"), ("assistant", "hi")]
+    assert history[1].metadata == {"token_count": 1}
+
+@pytest.mark.asyncio
+async def test_chats_get_reads_summary():
+    from criabot.bot.chat.compaction import build_summary_message
+    summary = build_summary_message("they asked about fees")
+    chats = _chats_with_redis(MagicMock())
+    chats._read_tail_script = AsyncMock(return_value=[
+        [b"started_at", b"123", b"system", b"", b"summary", summary.to_json().encode(), b"summarized", b"4"],
+        [],
+        6
+    ])
+
+    chat_model, _ = await chats.get_messages(chat_id="chat", max_tokens=100)
+
+    assert chat_model.summary.blocks[0].text == summary.text
+    assert chat_model.summarized == 4 and chat_model.history_start == 6
+
+@pytest.mark.asyncio
+async def test_chats_set_summary_compares_summarized():
+    from criabot.bot.chat.compaction import build_summary_message
+    chats = _chats_with_redis(MagicMock())
+    chats._set_summary_script = AsyncMock(return_value=0)
+
+    saved = await chats.set_summary(
+        chat_id="chat", summary=build_summary_message("summary"), summarized=6, read_summarized=4
+    )
+
+    assert saved is False
+    assert chats._set_summary_script.call_args[1]["keys"] == [chats.header_key("chat")]
+    assert chats._set_summary_script.call_args[1]["args"][:2] == [4, 6]
+
+@pytest.mark.asyncio
+async def test_chats_tokens_between_uses_running_totals():
+    chats = _chats_with_redis(MagicMock())
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=[b"70", b"30"])
+    pipe_context = MagicMock()
+    pipe_context.__aenter__ = AsyncMock(return_value=pipe)
+    pipe_context.__aexit__ = AsyncMock(return_value=False)
+    chats.pipeline = MagicMock(return_value=pipe_context)
+
+    assert await chats.tokens_between(chat_id="chat", start=2, end=5) == 40
+    pipe.lindex.assert_any_call(chats.tokens_key("chat"), 4)
+    pipe.lindex.assert_any_call(chats.tokens_key("chat"), 1)
+    assert await chats.tokens_between(chat_id="chat", start=0, end=5) == 70
+
+def test_chats_decode_messages_batches_current_schema():
+    from CriadexSDK.ragflow_schemas import ChatMessage
+    from criabot.cache.objects.chats import Chats
+    messages = [ChatMessage(role="user", blocks=[{"type": "text", "text": f"message {i}"}]) for i in range(3)]
+    raw = [m.model_dump_json().encode() for m in messages]
+
+    with patch("criabot.cache.objects.chats.ChatMessage.model_validate_json") as validate_one:
+        assert Chats.decode_messages(raw, schema_version=Chats.SCHEMA_VERSION) == messages
+        validate_one.assert_not_called()
+
+    assert Chats.decode_messages(raw, schema_version=1) == messages
+    assert Chats.decode_messages([], schema_version=Chats.SCHEMA_VERSION) == []
+
+@pytest.mark.asyncio
+async def test_chats_get_migrates_legacy_blob():
+    from criabot.cache.objects.chats import ChatModel
+    legacy = ChatModel(started_at=123, history=[])
+    legacy.add_user_message(prompt="hello", bot_name="bot")
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(side_effect=[[legacy.model_dump_json().encode(), 60], []])
+    redis = MagicMock()
+    redis.pipeline.return_value.__aenter__ = AsyncMock(return_value=pipe)
+    redis.pipeline.return_value.__aexit__ = AsyncMock(return_value=False)
+    chats = _chats_with_redis(redis)
+    chats._read_tail_script = AsyncMock(return_value=1)
+
+    chat_model = await chats.get(chat_id="chat")
+
+    assert chat_model.history[0].metadata["bot_asked"] == "bot"
+    assert chats._read_tail_script.call_args[1]["keys"] == [*chats.keys("chat"), "chat"]
+    # The new layout is written & the blob dropped in one transaction, keeping the remaining TTL
+    redis.pipeline.assert_called_with(transaction=True)
+    pipe.hset.assert_called_once()
+    pipe.expire.assert_any_call(chats.header_key("chat"), 60)
+    pipe.delete.assert_called_with("chat")
+
+@pytest.mark.asyncio
+async def test_chats_get_missing_chat_skips_legacy_read():
+    chats = _chats_with_redis(MagicMock())
+    chats._read_tail_script = AsyncMock(return_value=0)
+    chats._migrate = AsyncMock()
+
+    assert await chats.get(chat_id="chat") is None
+    assert await chats.get_messages(chat_id="chat") is None
+    chats._migrate.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_chats_exists_does_not_read_history():
+    redis = MagicMock()
+    redis.exists = AsyncMock(return_value=1)
+    chats = _chats_with_redis(redis)
+    chats.get = AsyncMock()
+
+    assert await chats.exists(chat_id="chat") is True
+    redis.exists.assert_called_once_with(chats.header_key("chat"), "chat")
+    chats.get.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_chats_touch_extends_expiry_of_every_key():
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=[True, True, False, False])
+    redis = MagicMock()
+    redis.pipeline.return_value.__aenter__ = AsyncMock(return_value=pipe)
+    redis.pipeline.return_value.__aexit__ = AsyncMock(return_value=False)
+    chats = _chats_with_redis(redis)
+
+    assert await chats.touch(chat_id="chat", ex=60) is True
+    assert pipe.expire.call_count == 4
+    pipe.expire.assert_any_call(chats.messages_key("chat"), 60)
+
+@pytest.mark.asyncio
+async def test_cache_objects_share_one_client():
+    from criabot.cache.api import BotCacheAPI
+    cache_api = BotCacheAPI(pool=MagicMock())
+
+    for cache_object in (cache_api.chats, cache_api.auth, cache_api.revocations, cache_api.bot_configs, cache_api.retrievals):
+        async with cache_object.redis() as redis:
+            assert redis is cache_api.client
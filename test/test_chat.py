@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 from criabot.bot.chat.chat import Chat
@@ -136,3 +137,220 @@ async def test_history_management(bot_mock, chat_model, bot_parameters):
         await chat.send(prompt=long_string, metadata_filter=None, extra_bots=[])
 
     assert len(chat.history()) <= 4
+
+@pytest.mark.asyncio
+async def test_send_appends_only_new_messages(chat, bot_mock):
+    await chat.send(prompt="hello", metadata_filter=None, extra_bots=[])
+
+    bot_mock.cache_api.chats.set.assert_not_called()
+    appended = bot_mock.cache_api.chats.append.call_args[1]
+    assert [m.role for m in appended["messages"]] == ["user", "assistant"]
+    assert appended["system_message"].role == "system"
+
+def test_message_round_trips_through_chat_message():
+    from criabot.bot.chat.message import Message
+    shared_metadata = {"bot_asked": "bot"}
+    message = Message(role="user", text="hello", metadata=shared_metadata)
+    message.metadata["token_count"] = 1
+
+    assert shared_metadata == {"bot_asked": "bot"}
+    chat_message = message.to_chat_message()
+    assert chat_message.blocks[0].text == "hello"
+    round_trip = Message.from_chat_message(chat_message)
+    assert (round_trip.role, round_trip.text, round_trip.metadata) == ("user", "hello", message.metadata)
+    assert Message.from_dict({"role": "assistant", "content": "hi"}).text == "hi"
+
+@pytest.mark.asyncio
+async def test_chat_model_is_converted_on_request(chat, chat_model):
+    await chat.send(prompt="hello", metadata_filter=None, extra_bots=[])
+
+    assert chat_model.history == []
+    assert [m.role for m in chat.chat_model.history] == ["system", "user", "assistant"]
+    assert all(isinstance(m, ChatMessage) for m in chat.chat_model.history)
+
+@pytest.mark.asyncio
+async def test_compaction_summarizes_dropped_turns_in_background(bot_mock, bot_parameters):
+    from criabot.bot.chat.compaction import ChatCompactor
+    from criabot.bot.chat.message import Message
+    bot_parameters.max_input_tokens = 40
+    bot_parameters.compaction_enabled = True
+    bot_parameters.compaction_threshold_tokens = 10
+    history = [Message(role="user", text="old turn", metadata={"token_count": 30}) for _ in range(3)]
+    chat_model = ChatModel(started_at=123, summarized=1, history_start=1)
+    bot_mock.cache_api.chats.tokens_between = AsyncMock(return_value=60)
+    bot_mock.cache_api.chats.read_range = AsyncMock(return_value=history[:2])
+    bot_mock.cache_api.chats.set_summary = AsyncMock(return_value=True)
+    compactor = ChatCompactor()
+
+    with patch('criabot.bot.chat.chat.ContextRetriever'):
+        chat = Chat(bot=bot_mock, llm_model_id=1, rerank_model_id=1, chat_model=chat_model,
+                    bot_parameters=bot_parameters, chat_id="test_chat", history=history)
+
+    with patch('criabot.bot.chat.chat.get_compactor', return_value=compactor):
+        chat._buffer.buffer()
+        assert chat._schedule_compaction() is True
+        # One summarization per chat at a time
+        assert chat._schedule_compaction() is False
+        await asyncio.gather(*compactor._tasks.values())
+
+    # The first read message is already summarized, the next one was trimmed
+    bot_mock.cache_api.chats.tokens_between.assert_called_once_with(chat_id="test_chat", start=1, end=3)
+    agent_config = bot_mock.criadex.agents.azure.chat.call_args[1]["agent_config"]
+    assert agent_config["max_reply_tokens"] == bot_parameters.compaction_summary_tokens
+    saved = bot_mock.cache_api.chats.set_summary.call_args[1]
+    assert (saved["summarized"], saved["read_summarized"]) == (3, 1)
+    assert saved["summary"].text.endswith("assistant reply")
+    assert compactor.stats == {"running": 0, "completed": 1, "failed": 0}
+
+@pytest.mark.asyncio
+async def test_compaction_waits_for_threshold(chat, bot_mock, bot_parameters):
+    bot_parameters.compaction_threshold_tokens = 100
+    bot_mock.cache_api.chats.tokens_between = AsyncMock(return_value=99)
+
+    assert await chat._compact(summarized=0, window_start=2) is False
+    bot_mock.criadex.agents.azure.chat.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_send_only_tokenizes_the_dynamic_text(chat):
+    with patch.object(chat._tokenizer, "_lookup", wraps=chat._tokenizer._lookup) as lookup:
+        await chat.send(prompt="hello", metadata_filter=None, extra_bots=[])
+
+    counted = [text for call in lookup.call_args_list for text in call[0][0]]
+    assert "system message" not in counted
+    assert not any(text.startswith("[INSTRUCTIONS]") for text in counted)
+    assert "some context" in counted
+
+def _cache_node(file_name: str, score: float = 0.97) -> TextNodeWithScore:
+    return TextNodeWithScore(
+        node=TextNode(
+            text="hello",
+            metadata={"answer": "cached reply", "file_name": file_name, "related_prompts": []},
+            text_template="", metadata_template="", class_name=""
+        ),
+        score=score
+    )
+
+@pytest.mark.asyncio
+async def test_answer_cache_hit_skips_retrieval_and_llm(chat, bot_mock, bot_parameters):
+    from criabot.bot.chat.answer_cache import AnswerCacheLookup
+    bot_parameters.answer_cache_enabled = True
+    chat._answer_cache.lookup = AsyncMock(
+        return_value=AnswerCacheLookup(node=_cache_node("answer-cache-3-x"), search_units=1, generation=3)
+    )
+
+    reply = await chat.send(prompt="hello", metadata_filter=None, extra_bots=[])
+
+    assert reply.content.content == "cached reply"
+    assert reply.search_units == 1
+    assert reply.context is None
+    bot_mock.criadex.agents.azure.chat.assert_not_called()
+    bot_mock.cache_api.chats.append.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_answer_cache_miss_stores_reply(chat, bot_parameters):
+    from criabot.bot.chat.answer_cache import AnswerCacheLookup
+    bot_parameters.answer_cache_enabled = True
+    retrieve = chat._retriever.retrieve
+    retrieval_started = asyncio.Event()
+
+    async def _retrieve(**kwargs):
+        retrieval_started.set()
+        return await retrieve(**kwargs)
+
+    async def _lookup(prompt):
+        # The retrieval doesn't wait for the lookup
+        await asyncio.wait_for(retrieval_started.wait(), timeout=1)
+        return AnswerCacheLookup(node=None, search_units=1, generation=3)
+
+    chat._retriever.retrieve = _retrieve
+    chat._answer_cache.lookup = _lookup
+    chat._answer_cache.store_later = MagicMock()
+
+    reply = await chat.send(prompt="hello", metadata_filter=None, extra_bots=[])
+
+    assert reply.content.content == "assistant reply"
+    chat._answer_cache.store_later.assert_called_once_with(
+        prompt="hello", answer="assistant reply", related_prompts=[], generation=3
+    )
+
+@pytest.mark.asyncio
+async def test_answer_cache_skips_filtered_searches(chat, bot_parameters):
+    bot_parameters.answer_cache_enabled = True
+    chat._answer_cache.lookup = AsyncMock()
+
+    await chat.send(
+        prompt="hello",
+        metadata_filter={"must": [{"key": "lang", "match": {"value": "en"}}], "must_not": [], "should": []},
+        extra_bots=[]
+    )
+
+    chat._answer_cache.lookup.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_answer_cache_searched_with_default_send_config(chat, bot_parameters):
+    from criabot.bot.chat.answer_cache import AnswerCacheLookup
+    from app.controllers.schemas import ChatSendConfig
+    bot_parameters.answer_cache_enabled = True
+    chat._answer_cache.lookup = AsyncMock(return_value=AnswerCacheLookup(node=None, search_units=1, generation=3))
+    chat._answer_cache.store_later = MagicMock()
+    chat_config = ChatSendConfig(prompt="hello", bot_name="test_bot")
+
+    # The same call as the send route's, whose default filter has no clauses
+    await chat.send(
+        prompt=chat_config.prompt,
+        metadata_filter=chat_config.metadata_filter,
+        extra_bots=chat_config.extra_bots
+    )
+
+    chat._answer_cache.lookup.assert_called_once_with(prompt="hello")
+
+def test_answer_cache_file_generation():
+    from criabot.bot.chat.answer_cache import AnswerCache
+    assert AnswerCache.file_generation(AnswerCache.file_name(12)) == 12
+    assert AnswerCache.file_generation("some-document") is None
+    assert AnswerCache.file_generation(None) is None
+
+@pytest.mark.asyncio
+async def test_answer_cache_stale_entry_is_a_miss_and_deleted():
+    from criabot.bot.chat.answer_cache import AnswerCache
+    bot = AsyncMock()
+    bot.name = "test_bot"
+    bot.group_name = MagicMock(return_value="test_bot-cache-index")
+    bot.search_group = AsyncMock(
+        return_value={"response": MagicMock(nodes=[_cache_node("answer-cache-3-x")], search_units=1)}
+    )
+    generations = MagicMock()
+    generations.generations = AsyncMock(return_value=[4])
+
+    lookup = await AnswerCache(bot=bot, generations=generations, min_score=0.95).lookup(prompt="hello")
+    await asyncio.sleep(0)
+
+    assert lookup.node is None
+    assert lookup.generation == 4
+    bot.criadex.content.delete.assert_called_once_with(group_name="test_bot-cache-index", document_name="answer-cache-3-x")
+
+@pytest.mark.asyncio
+async def test_answer_cache_serves_fresh_entry_below_stale_ones():
+    from criabot.bot.chat.answer_cache import AnswerCache
+    bot = AsyncMock()
+    bot.name = "test_bot"
+    bot.group_name = MagicMock(return_value="test_bot-cache-index")
+    bot.search_group = AsyncMock(return_value={"response": MagicMock(
+        nodes=[
+            _cache_node("answer-cache-3-a", score=0.99),
+            _cache_node("answer-cache-3-b", score=0.98),
+            _cache_node("answer-cache-4-c", score=0.97)
+        ],
+        search_units=1
+    )})
+    generations = MagicMock()
+    generations.generations = AsyncMock(return_value=[4])
+
+    lookup = await AnswerCache(bot=bot, generations=generations, min_score=0.95).lookup(prompt="hello")
+    await asyncio.sleep(0)
+
+    assert lookup.node.node.metadata["file_name"] == "answer-cache-4-c"
+    assert bot.search_group.call_args[1]["search_config"]["top_k"] == AnswerCache.LOOKUP_CANDIDATES
+    assert sorted(c[1]["document_name"] for c in bot.criadex.content.delete.call_args_list) == [
+        "answer-cache-3-a", "answer-cache-3-b"
+    ]
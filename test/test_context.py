@@ -40,3 +40,89 @@ def test_is_llm_reply():
 
     node.node.metadata = {"answer": "some answer", "llm_reply": False}
     assert ContextRetriever.is_llm_reply(node) is False
+
+def _scored_node(text, score):
+    from CriadexSDK.ragflow_schemas import TextNodeWithScore, TextNode
+    return TextNodeWithScore(
+        node=TextNode(text=text, metadata={}, text_template="", metadata_template="", class_name="TextNode"),
+        score=score
+    )
+
+def test_context_packer_takes_best_scores_and_skips_overlaps():
+    from criabot.bot.chat.packing import ContextPacker
+    from criabot.bot.chat.tokenizer import Tokenizer
+    chunk = "the library opens at nine on weekdays and at noon on weekends"
+    nodes = [
+        _scored_node("parking costs five dollars per day for visitors on campus", 0.5),
+        _scored_node(chunk, 0.9),
+        _scored_node("Note: " + chunk + ".", 0.8),
+        _scored_node(chunk, 0.7),
+    ]
+
+    packed = ContextPacker(tokenizer=Tokenizer(), max_tokens=1000).pack(nodes)
+
+    assert [n.score for n in packed.nodes] == [0.9, 0.5]
+    assert packed.duplicates == 2
+    assert packed.text.startswith("[DOCUMENT #1]\n" + chunk)
+    assert "[DOCUMENT #2]\nparking" in packed.text
+
+def test_context_packer_truncates_last_node_to_budget():
+    from criabot.bot.chat.packing import ContextPacker
+    from criabot.bot.chat.tokenizer import Tokenizer
+    tokenizer = Tokenizer()
+    nodes = [_scored_node(" ".join(f"first{i}" for i in range(100)), 0.9), _scored_node(" ".join(f"second{i}" for i in range(200)), 0.8)]
+    budget = tokenizer.count("[DOCUMENT #1]\n" + nodes[0].node.text) + 100
+
+    packed = ContextPacker(tokenizer=tokenizer, max_tokens=budget).pack(nodes)
+
+    assert packed.truncated and len(packed.nodes) == 2
+    assert packed.tokens <= budget
+    assert tokenizer.count(packed.text) <= budget
+
+    # A sliver of a node isn't worth including
+    assert len(ContextPacker(tokenizer=tokenizer, max_tokens=budget - 90).pack(nodes).nodes) == 1
+
+def test_build_context_uses_packer():
+    packer = MagicMock()
+    nodes = [_scored_node("text 1", 0.9)]
+    packer.pack.return_value.text = "packed"
+    packer.pack.return_value.nodes = nodes
+
+    context = ContextRetriever.build_context(ranked_nodes=nodes, packer=packer)
+
+    assert context.text == "packed"
+    packer.pack.assert_called_once_with(nodes)
+
+def test_build_context_keeps_only_packed_nodes():
+    from criabot.bot.chat.packing import ContextPacker
+    from criabot.bot.chat.tokenizer import Tokenizer
+    nodes = [_scored_node("the library opens at nine", 0.9), _scored_node(" ".join(f"word{i}" for i in range(200)), 0.8)]
+
+    context = ContextRetriever.build_context(ranked_nodes=nodes, packer=ContextPacker(tokenizer=Tokenizer(), max_tokens=40))
+
+    assert [n.score for n in context.nodes] == [0.9]
+    assert "word0" not in context.text
+
+def test_prompt_artifacts_compile_static_prompts_once():
+    from criabot.bot.chat.prompts import PromptArtifacts
+    from criabot.bot.chat.tokenizer import get_tokenizer
+    from criabot.database.bots.tables.bot_params import BotParametersModel
+    params = BotParametersModel(id=1, bot_id=1, system_message="be nice", no_context_llm_guess=True)
+
+    prompts = PromptArtifacts.compile(params)
+
+    tokenizer = get_tokenizer(params.tokenizer_encoding)
+    assert prompts.system_message_tokens == tokenizer.count("be nice")
+    assert prompts.context_prefix_tokens == tokenizer.count(prompts.context_prefix)
+    assert "use your knowledge to guess" in prompts.context_prefix
+    context = TextContext(text="[DOCUMENT #1]\nsome context", nodes=[], related_prompts=[])
+    assert build_context_prompt(context, prompts=prompts) == prompts.context_prefix + context.text
+    assert build_context_prompt(context, best_guess=True).endswith("[INFORMATION]\n" + context.text)
+
+def test_build_context_prompt_collapses_document_spaces():
+    from criabot.bot.chat.prompts import context_prompt_prefix
+    context = TextContext(text="[DOCUMENT #1]\nopen   from  9 to 5  \n\n  closed on Sundays ", nodes=[], related_prompts=[])
+
+    prompt = build_context_prompt(context)
+
+    assert prompt == context_prompt_prefix(best_guess=False) + "[DOCUMENT #1]\nopen from 9 to 5 \n\n closed on Sundays"
@@ -36,6 +36,7 @@ async def test_create_bot(criabot_instance):
     criabot_instance._criadex.group_auth.create = AsyncMock()
     criabot_instance._mysql_api.bots.insert = AsyncMock(return_value=1)
     criabot_instance._mysql_api.bot_params.insert = AsyncMock(return_value=None)
+    criabot_instance._redis_api.bot_configs.delete = AsyncMock()
 
     config = BotCreateConfig(llm_model_id=1, embedding_model_id=1, rerank_model_id=1)
     new_auth = await criabot_instance.create(name="new_bot", config=config)
@@ -47,6 +48,24 @@ async def test_create_bot(criabot_instance):
     criabot_instance._mysql_api.bots.insert.assert_called_once()
     criabot_instance._mysql_api.bot_params.insert.assert_called_once()
 
+@pytest.mark.asyncio
+async def test_create_bot_with_answer_cache(criabot_instance):
+    criabot_instance._mysql_api.bots.exists = AsyncMock(return_value=False)
+    criabot_instance._criadex.auth.create = AsyncMock(return_value={"api_key": "new_key"})
+    criabot_instance._criadex.manage.create = AsyncMock(return_value=MagicMock())
+    criabot_instance._criadex.group_auth.create = AsyncMock()
+    criabot_instance._mysql_api.bots.insert = AsyncMock(return_value=1)
+    criabot_instance._mysql_api.bot_params.insert = AsyncMock(return_value=None)
+    criabot_instance._redis_api.bot_configs.delete = AsyncMock()
+
+    config = BotCreateConfig(llm_model_id=1, embedding_model_id=1, rerank_model_id=1, answer_cache_enabled=True)
+    await criabot_instance.create(name="new_bot", config=config)
+
+    assert criabot_instance._criadex.manage.create.call_count == 3
+
+    # Only Criabot uses the CACHE group, so the bot key isn't authorized on it (as when it's created later)
+    assert criabot_instance._criadex.group_auth.create.call_count == 2
+
 @pytest.mark.asyncio
 async def test_create_bot_that_exists(criabot_instance):
     criabot_instance._mysql_api.bots.exists = AsyncMock(return_value=True)
@@ -74,4 +93,140 @@ async def test_table_creation_on_initialize(criabot_instance):
         await criabot_instance.initialize()
 
         assert mock_create_async_engine.call_count == 2
-        mock_mysql_api.initialize.assert_called_once()
\ No newline at end of file
+        mock_mysql_api.initialize.assert_called_once()
+@pytest.mark.asyncio
+async def test_get_bot_chat_fails_fast_on_missing_chat(criabot_instance):
+    from criabot.bot.schemas import ChatNotFoundError
+    criabot_instance._redis_api.chats.get_messages = AsyncMock(return_value=None)
+    criabot_instance._mysql_api.bots.retrieve_with_params = AsyncMock(return_value=None)
+    criabot_instance._criadex.manage.about = AsyncMock(return_value={})
+
+    with pytest.raises(ChatNotFoundError):
+        await criabot_instance.get_bot_chat(bot_name="test_bot", chat_id="missing_chat")
+
+@pytest.mark.asyncio
+async def test_about_uses_single_joined_query(criabot_instance):
+    from criabot.database.bots.tables.bots import BotsModel
+    from criabot.database.bots.tables.bot_params import BotParametersModel
+    bots_model = BotsModel(name="test_bot", id=1, created="2024-01-01T00:00:00")
+    params_model = BotParametersModel(id=1, bot_id=1)
+    criabot_instance._mysql_api.bots.retrieve_with_params = AsyncMock(return_value=(bots_model, params_model))
+    criabot_instance._mysql_api.bot_params.retrieve = AsyncMock()
+
+    about = await criabot_instance.about(name="test_bot")
+
+    assert about.info.name == "test_bot"
+    assert about.params.bot_id == 1
+    criabot_instance._mysql_api.bot_params.retrieve.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_retrieve_with_params_keeps_bots_without_params():
+    from contextlib import asynccontextmanager
+    from criabot.database.bots.tables.bots import BotsAPI, BotsTable
+    entry = BotsTable(id=1, name="test_bot", created="2024-01-01T00:00:00")
+    session = MagicMock()
+    session.execute = AsyncMock(return_value=MagicMock(fetchone=MagicMock(return_value=MagicMock(tuple=lambda: (entry, None)))))
+
+    @asynccontextmanager
+    async def _session():
+        yield session
+
+    bots_api = BotsAPI.__new__(BotsAPI)
+    bots_api.get_async_session = _session
+
+    bot, params = await bots_api.retrieve_with_params(name="test_bot")
+
+    assert bot.name == "test_bot" and params is None
+    assert "LEFT OUTER JOIN" in str(session.execute.call_args.args[0])
+
+@pytest.mark.asyncio
+async def test_update_parameters_invalidates_bot_config(criabot_instance):
+    from criabot.database.bots.tables.bot_params import BotParametersBaseConfig
+    criabot_instance._mysql_api.bots.retrieve_id = AsyncMock(return_value=1)
+    criabot_instance._mysql_api.bot_params.update = AsyncMock()
+    criabot_instance._redis_api.bot_configs.delete = AsyncMock()
+    criabot_instance._redis_api.retrievals.bump = AsyncMock()
+
+    params = BotParametersBaseConfig(top_n=5)
+    await criabot_instance.update_parameters(name="test_bot", params=params)
+
+    criabot_instance._mysql_api.bot_params.update.assert_called_once_with(bot_id=1, config=params)
+    criabot_instance._redis_api.bot_configs.delete.assert_called_once_with(bot_name="test_bot")
+    # Cached answers were written with the old parameters
+    criabot_instance._redis_api.retrievals.bump.assert_called_once_with(bot_name="test_bot")
+
+@pytest.mark.asyncio
+async def test_resolve_bots_queries_only_uncached_names(criabot_instance):
+    from criabot.schemas import ResolvedBotConfig, AboutBot
+    from criabot.database.bots.tables.bots import BotsModel
+    from criabot.database.bots.tables.bot_params import BotParametersModel
+    cached = ResolvedBotConfig(
+        about=AboutBot(
+            info=BotsModel(name="cached_bot", id=7, created="2024-01-01T00:00:00"),
+            params=BotParametersModel(id=1, bot_id=7)
+        ),
+        llm_model_id=1,
+        rerank_model_id=1
+    )
+    criabot_instance._redis_api.bot_configs.get = AsyncMock(
+        side_effect=lambda bot_name: cached if bot_name == "cached_bot" else None
+    )
+    criabot_instance._mysql_api.bots.resolve = AsyncMock(return_value={"other_bot": 3})
+
+    resolved = await criabot_instance.resolve_bots(["cached_bot", "other_bot", "missing_bot", "other_bot"])
+
+    assert resolved == {"cached_bot": 7, "other_bot": 3}
+    criabot_instance._mysql_api.bots.resolve.assert_called_once_with("other_bot", "missing_bot")
+
+@pytest.mark.asyncio
+async def test_bots_resolve_matches_names_case_insensitively():
+    from contextlib import asynccontextmanager
+    from criabot.database.bots.tables.bots import BotsAPI
+    session = MagicMock()
+    session.execute = AsyncMock(return_value=MagicMock(all=MagicMock(return_value=[("TestBot", 1)])))
+
+    @asynccontextmanager
+    async def _session():
+        yield session
+
+    bots_api = BotsAPI.__new__(BotsAPI)
+    bots_api.get_async_session = _session
+
+    assert await bots_api.resolve("testbot", "TESTBOT", "other") == {"testbot": 1, "TESTBOT": 1}
+    assert await bots_api.exists("testbot")
+    assert not await bots_api.exists("testbot", "other")
+
+def _http_error(status_code):
+    import httpx
+    request = httpx.Request("GET", "http://criadex/groups/test_bot-cache-index/about")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status_code, request=request))
+
+@pytest.mark.asyncio
+async def test_group_exists_only_treats_not_found_as_missing(criabot_instance):
+    import httpx
+    criabot_instance._criadex.manage.about = AsyncMock(side_effect=_http_error(404))
+    assert await criabot_instance._group_exists(group_name="test_bot-cache-index") is False
+
+    criabot_instance._criadex.manage.about = AsyncMock(side_effect=_http_error(503))
+    with pytest.raises(httpx.HTTPStatusError):
+        await criabot_instance._group_exists(group_name="test_bot-cache-index")
+
+@pytest.mark.asyncio
+async def test_update_parameters_creates_missing_cache_group(criabot_instance):
+    from criabot.database.bots.tables.bot_params import BotParametersBaseConfig
+    criabot_instance._mysql_api.bots.retrieve_id = AsyncMock(return_value=1)
+    criabot_instance._mysql_api.bot_params.update = AsyncMock()
+    criabot_instance._redis_api.bot_configs.delete = AsyncMock()
+    criabot_instance._redis_api.retrievals.bump = AsyncMock()
+    document_info = {"info": {"llm_model_id": 1, "embedding_model_id": 2, "rerank_model_id": 3}}
+    criabot_instance._criadex.manage.about = AsyncMock(side_effect=[_http_error(404), document_info])
+    criabot_instance._criadex.manage.create = AsyncMock()
+    criabot_instance._criadex.group_auth.create = AsyncMock()
+
+    await criabot_instance.update_parameters(name="test_bot", params=BotParametersBaseConfig(answer_cache_enabled=True))
+
+    criabot_instance._criadex.manage.create.assert_called_once_with(
+        group_name="test_bot-cache-index",
+        group_config={"type": "CACHE", "llm_model_id": 1, "embedding_model_id": 2, "rerank_model_id": 3}
+    )
+    criabot_instance._criadex.group_auth.create.assert_not_called()
@@ -0,0 +1,43 @@
+from fastapi import FastAPI
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.testclient import TestClient
+from app.core.middleware import StatusMiddleware, STATE_STATUS_KEY
+
+app = FastAPI()
+app.add_middleware(StatusMiddleware)
+
+@app.get("/out-of-band")
+async def out_of_band(request: Request):
+    setattr(request.state, STATE_STATUS_KEY, 404)
+    return {"status": 404, "message": "Not found"}
+
+@app.get("/in-body")
+async def in_body():
+    return JSONResponse({"status": 409, "error": "stacktrace"})
+
+@app.get("/plain")
+async def plain():
+    return {"hello": "world"}
+
+client = TestClient(app)
+
+def test_out_of_band_status():
+    response = client.get("/out-of-band")
+    assert response.status_code == 404
+    assert response.json() == {"status": 404, "message": "Not found"}
+
+def test_status_read_from_body_and_error_stripped():
+    response = client.get("/in-body")
+    assert response.status_code == 409
+    assert "error" not in response.json()
+    assert int(response.headers["content-length"]) == len(response.content)
+
+def test_error_kept_when_stacktrace_requested():
+    response = client.get("/in-body", headers={"x-api-stacktrace": "true"})
+    assert response.json()["error"] == "stacktrace"
+
+def test_json_without_status_untouched():
+    response = client.get("/plain")
+    assert response.status_code == 200
+    assert response.json() == {"hello": "world"}
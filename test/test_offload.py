@@ -0,0 +1,50 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from criabot.offload import Offloader, LoopLagMonitor
+from criabot.bot.chat.tokenizer import Tokenizer
+
+@pytest.mark.asyncio
+async def test_only_big_payloads_leave_the_event_loop():
+    offloader = Offloader(threads=1, processes=0, min_thread_size=100, min_process_size=1000)
+    try:
+        assert await offloader.run_in_thread(99, threading.get_ident) == threading.get_ident()
+        assert await offloader.run_in_thread(100, threading.get_ident) != threading.get_ident()
+        # Without processes, process work goes to the threads
+        assert await offloader.run_in_process(1000, threading.get_ident) != threading.get_ident()
+        assert offloader.stats == {"inline": 1, "thread": 2, "process": 0}
+    finally:
+        offloader.shutdown()
+
+@pytest.mark.asyncio
+async def test_no_threads_runs_everything_inline():
+    offloader = Offloader(threads=0, processes=0, min_thread_size=0, min_process_size=0)
+    assert await offloader.run_in_process(10 ** 9, threading.get_ident) == threading.get_ident()
+    assert offloader.stats["inline"] == 1
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor_sees_blocking():
+    monitor = LoopLagMonitor(interval=0.01)
+    monitor.start()
+    await asyncio.sleep(0.02)
+    time.sleep(0.1)  # Block the loop
+    await asyncio.sleep(0.02)
+    await monitor.stop()
+
+    assert monitor.samples > 0
+    assert monitor.max_lag >= 0.05
+    assert monitor.stats["monitoring"] is False
+
+@pytest.mark.asyncio
+async def test_count_batch_async_memoizes_like_count_batch():
+    tokenizer = Tokenizer()
+    offloader = Offloader(threads=1, processes=0, min_thread_size=0, min_process_size=0)
+    with patch("criabot.bot.chat.tokenizer.get_offloader", return_value=offloader):
+        counts = await tokenizer.count_batch_async(["hello world", "a " * 1000])
+    offloader.shutdown()
+
+    assert counts == tokenizer.count_batch(["hello world", "a " * 1000])
+    assert offloader.stats["thread"] == 1
+    assert tokenizer.stats["hits"] == 2
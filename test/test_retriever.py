@@ -128,7 +128,7 @@ async def test_hybrid_rerank(retriever, criadex_api):
         model_id=retriever._rerank_model_id,
         agent_config={
             "prompt": "hello",
-            "nodes": [node.model_dump(mode='json') for node in nodes],
+            "nodes": [{"node": {"id_": "0", "text": "text 1", "metadata": {}}, "score": 0.8}],
             "top_n": retriever._bot_params.top_n,
             "min_n": retriever._bot_params.min_n
         }
@@ -153,3 +153,188 @@ def test_merge_responses():
     assert len(merged["group1"].nodes) == 2
     assert merged["group1"].search_units == 2
     assert "group2" in merged
+
+class _FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value.encode() if isinstance(value, str) else value
+
+    async def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        return int(self.data[key])
+
+def _retrieval_cache():
+    from contextlib import asynccontextmanager
+    from criabot.cache.objects.retrievals import RetrievalCache
+    redis = _FakeRedis()
+
+    @asynccontextmanager
+    async def _redis():
+        yield redis
+
+    cache = RetrievalCache(pool=MagicMock(), ttl=60)
+    cache.redis = _redis
+    return cache
+
+@pytest.mark.asyncio
+async def test_retrieve_cache_hit_skips_search_and_rerank(criadex_api, bot_mock, bot_params):
+    cache = _retrieval_cache()
+    retriever = ContextRetriever(
+        criadex=criadex_api, rerank_model_id=1, llm_model_id=1, bot=bot_mock, bot_params=bot_params, cache=cache
+    )
+    bot_mock.name = "test_bot"
+    nodes = [create_text_node("text 1")]
+    bot_mock.search_group.return_value = {
+        "group_name": "test_group",
+        "response": GroupSearchResponse(nodes=nodes, search_units=1, metadata={}, assets=[])
+    }
+    retriever.hybrid_rerank = AsyncMock(return_value={"ranked_nodes": nodes, "search_units": 1})
+
+    first = await retriever.retrieve(prompt="Hello ?", metadata_filter=None, extra_bots=[])
+    second = await retriever.retrieve(prompt="hello", metadata_filter=None, extra_bots=[])
+
+    assert retriever.hybrid_rerank.call_count == 1
+    assert bot_mock.search_group.call_count == len(retriever.INDEX_TYPES)
+    assert isinstance(second.context, TextContext) and second.context.text == first.context.text
+    assert second.search_units == 0 and len(second.nodes) == 1
+    assert cache.stats == {"hits": 1, "misses": 1, "bumps": 0}
+
+    # Changing the content of the bot (or of an extra bot) misses
+    await cache.bump(bot_name="test_bot")
+    await retriever.retrieve(prompt="hello", metadata_filter=None, extra_bots=[])
+    assert retriever.hybrid_rerank.call_count == 2
+
+def test_cached_retrieval_keeps_context_type():
+    from criabot.cache.objects.retrievals import CachedRetrieval
+    node = create_text_node("question text", metadata={"answer": "the answer", "llm_reply": False})
+    question = QuestionContext(file_name="f", group_name="g", node=node)
+
+    cached = CachedRetrieval.model_validate_json(CachedRetrieval(context=question).model_dump_json())
+
+    assert isinstance(cached.context, QuestionContext)
+    assert cached.context.node.node.metadata["answer"] == "the answer"
+
+def _rerank_cache():
+    from contextlib import asynccontextmanager
+    from criabot.cache.objects.reranks import RerankCache
+    redis = _FakeRedis()
+
+    @asynccontextmanager
+    async def _redis():
+        yield redis
+
+    cache = RerankCache(pool=MagicMock(), ttl=60)
+    cache.redis = _redis
+    return cache
+
+@pytest.mark.asyncio
+async def test_hybrid_rerank_cache_rebuilds_ranking(criadex_api, bot_mock, bot_params):
+    cache = _rerank_cache()
+    retriever = ContextRetriever(
+        criadex=criadex_api, rerank_model_id=1, llm_model_id=1, bot=bot_mock, bot_params=bot_params, rerank_cache=cache
+    )
+    nodes = [create_text_node("text 1"), create_text_node("text 2")]
+    criadex_api.agents.cohere.rerank.return_value = {
+        "reranked_documents": [
+            {"node": {"id_": "1", "text": "text 2", "metadata": {}}, "score": 0.9},
+            {"node": {"id_": "0", "text": "text 1", "metadata": {}}, "score": 0.4}
+        ]
+    }
+
+    first = await retriever.hybrid_rerank(prompt="Hello?", nodes=nodes)
+    second = await retriever.hybrid_rerank(prompt="hello", nodes=nodes)
+
+    criadex_api.agents.cohere.rerank.assert_called_once()
+    assert [n.node.text for n in second["ranked_nodes"]] == ["text 2", "text 1"]
+    assert [n.score for n in second["ranked_nodes"]] == [n.score for n in first["ranked_nodes"]]
+    assert cache.stats == {"hits": 1, "misses": 1}
+
+    # Different candidates are a different rerank
+    await retriever.hybrid_rerank(prompt="hello", nodes=[nodes[0], create_text_node("text 3")])
+    assert criadex_api.agents.cohere.rerank.call_count == 2
+
+def test_candidate_pruner_dedupes_and_drops_low_scores():
+    from criabot.bot.chat.candidates import CandidatePruner
+    pruner = CandidatePruner(min_k=0.5, top_n=2, max_candidates=0)
+
+    pruned = pruner.prune({
+        "docs": [create_text_node("a", score=0.9), create_text_node("b", score=0.3), create_text_node("c", score=0.2)],
+        "questions": [create_text_node("a", score=0.95)]
+    })
+
+    # "a" keeps its best copy, "b" survives min_k to keep top_n
+    assert [(n.node.text, n.score) for n in pruned.nodes] == [("a", 0.95), ("b", 0.3)]
+    assert (pruned.candidates, pruned.duplicates, pruned.below_min_k, pruned.over_quota) == (4, 1, 1, 0)
+
+def test_candidate_pruner_shares_cap_between_groups():
+    from criabot.bot.chat.candidates import CandidatePruner
+    pruner = CandidatePruner(min_k=0, top_n=1, max_candidates=4)
+
+    pruned = pruner.prune({
+        "bot": [create_text_node(f"bot {i}", score=0.9 - i / 100) for i in range(5)],
+        "extra": [create_text_node(f"extra {i}", score=0.5 - i / 100) for i in range(5)],
+        "empty": []
+    })
+
+    assert [n.node.text for n in pruned.nodes] == ["bot 0", "extra 0", "bot 1", "extra 1"]
+    assert pruned.over_quota == 6
+
+@pytest.mark.asyncio
+async def test_retrieve_reranks_pruned_candidates(criadex_api, bot_mock, bot_params):
+    from criabot.bot.chat.candidates import CandidatePruner
+    retriever = ContextRetriever(
+        criadex=criadex_api, rerank_model_id=1, llm_model_id=1, bot=bot_mock, bot_params=bot_params,
+        pruner=CandidatePruner(min_k=0.5, top_n=1, max_candidates=10)
+    )
+    bot_mock.search_group.return_value = {
+        "group_name": "test_group",
+        "response": GroupSearchResponse(nodes=[create_text_node("same"), create_text_node("same")], search_units=1, metadata={}, assets=[])
+    }
+    retriever.hybrid_rerank = AsyncMock(return_value={"ranked_nodes": [], "search_units": 0})
+
+    await retriever.retrieve(prompt="hello", metadata_filter=None, extra_bots=[])
+
+    assert len(retriever.hybrid_rerank.call_args.kwargs["nodes"]) == 1
+
+@pytest.mark.asyncio
+async def test_hybrid_rerank_rehydrates_original_nodes(retriever, criadex_api):
+    nodes = [
+        create_text_node("question", metadata={"answer": "the answer", "related_prompts": [{"label": "a", "prompt": "b"}]}),
+        create_text_node("document")
+    ]
+    criadex_api.agents.cohere.rerank.return_value = {
+        "reranked_documents": [
+            {"node": {"id_": "1", "text": "document", "metadata": {}}, "score": 0.9},
+            {"node": {"id_": "0", "text": "question", "metadata": {}}, "score": 0.6},
+            {"node": {"id_": "7", "text": "unknown", "metadata": {}}, "score": 0.5}
+        ]
+    }
+
+    response = await retriever.hybrid_rerank(prompt="hello", nodes=nodes)
+
+    sent = criadex_api.agents.cohere.rerank.call_args.kwargs["agent_config"]["nodes"]
+    assert all(node["node"]["metadata"] == {} for node in sent)
+    assert [(n.node.text, n.score) for n in response["ranked_nodes"]] == [("document", 0.9), ("question", 0.6)]
+    assert response["ranked_nodes"][1].node.metadata["answer"] == "the answer"
+
+def test_candidate_pruner_quotas_source_groups_within_a_response():
+    from criabot.bot.chat.candidates import CandidatePruner
+    pruner = CandidatePruner(min_k=0, top_n=1, max_candidates=4)
+
+    # The extra bot's group comes back in the same response as the bot's own
+    pruned = pruner.prune({
+        "bot-document-index": [
+            *[create_text_node(f"bot {i}", metadata={"group_name": "bot-document-index"}, score=0.9 - i / 100) for i in range(4)],
+            *[create_text_node(f"extra {i}", metadata={"group_name": "extra-document-index"}, score=0.5 - i / 100) for i in range(4)],
+        ]
+    })
+
+    assert [n.node.text for n in pruned.nodes] == ["bot 0", "extra 0", "bot 1", "extra 1"]
@@ -4,6 +4,8 @@ from app.core.security.handlers.master import GetApiKeyMaster
 from app.core.security.handlers.any import GetApiKeyAny
 from app.core.security.handlers.bots import GetApiKeyBots
 from app.core.security.get_api_key import BadAPIKeyException
+from criabot.tokens import BotTokenSigner
+from starlette.datastructures import State
 from CriadexSDK.ragflow_schemas import AuthCheckResponse, GroupAuthCheckResponse
 
 @pytest.mark.asyncio
@@ -146,3 +148,66 @@ async def test_get_api_key_bots_non_master_key_no_bot_name():
         await get_api_key_bots.execute()
     assert excinfo.value.status_code == 400
     assert "Bot name not included in params!" in excinfo.value.detail
+
+@pytest.mark.asyncio
+async def test_get_api_key_bots_token_for_other_bot():
+    """Test that a signed token is rejected for a bot it was not issued for."""
+    # Arrange
+    signer = BotTokenSigner(secret="secret", expire_time=3600)
+    get_api_key_bots = GetApiKeyBots()
+    get_api_key_bots.api_key = signer.issue(bot_name="other_bot")
+    get_api_key_bots.get_auth = AsyncMock()
+    get_api_key_bots.read_bot_name = AsyncMock(return_value="test_bot")
+    get_api_key_bots.criabot = MagicMock()
+    get_api_key_bots.criabot.bot_tokens = signer
+    get_api_key_bots.criabot.redis_api.revocations.is_revoked = AsyncMock(return_value=False)
+    get_api_key_bots.criadex = MagicMock()
+    get_api_key_bots.criadex._error_stacktrace = False
+
+    # Act & Assert
+    with pytest.raises(BadAPIKeyException) as excinfo:
+        await get_api_key_bots.execute()
+    assert excinfo.value.status_code == 401
+    get_api_key_bots.get_auth.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_get_api_key_bots_token_success():
+    """Test that a signed token is accepted locally for its own bot."""
+    # Arrange
+    signer = BotTokenSigner(secret="secret", expire_time=3600)
+    get_api_key_bots = GetApiKeyBots()
+    get_api_key_bots.api_key = signer.issue(bot_name="test_bot")
+    get_api_key_bots.get_auth = AsyncMock()
+    get_api_key_bots.read_bot_name = AsyncMock(return_value="test_bot")
+    get_api_key_bots.criabot = MagicMock()
+    get_api_key_bots.criabot.bot_tokens = signer
+    get_api_key_bots.criabot.redis_api.revocations.is_revoked = AsyncMock(return_value=False)
+    get_api_key_bots.criadex = MagicMock()
+    get_api_key_bots.criadex._error_stacktrace = False
+
+    # Act
+    result = await get_api_key_bots.execute()
+
+    # Assert
+    assert result == get_api_key_bots.api_key
+    get_api_key_bots.get_auth.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_get_api_key_bots_reads_body_once():
+    """Test that the JSON body is decoded once & shared on the request state."""
+    # Arrange
+    get_api_key_bots = GetApiKeyBots()
+    get_api_key_bots.request = MagicMock()
+    get_api_key_bots.request.path_params = {}
+    get_api_key_bots.request.query_params = {}
+    get_api_key_bots.request.state = State()
+    get_api_key_bots.request.json = AsyncMock(return_value={"bot_name": "test_bot"})
+
+    # Act
+    first = await get_api_key_bots.read_bot_name()
+    second = await get_api_key_bots.read_bot_name()
+
+    # Assert
+    assert first == second == "test_bot"
+    assert get_api_key_bots.request.state.json_body == {"bot_name": "test_bot"}
+    get_api_key_bots.request.json.assert_called_once()
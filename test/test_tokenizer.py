@@ -0,0 +1,33 @@
+from unittest.mock import patch
+from criabot.bot.chat.tokenizer import Tokenizer, get_tokenizer
+from criabot.bot.chat.buffer import ChatBuffer
+from criabot.bot.chat.message import Message
+
+def test_get_tokenizer_is_shared_per_encoding():
+    assert get_tokenizer("cl100k_base") is get_tokenizer("cl100k_base")
+
+def test_count_batch_only_encodes_unseen_strings():
+    tokenizer = Tokenizer()
+    with patch.object(tokenizer._encoding, "encode_ordinary", wraps=tokenizer._encoding.encode_ordinary) as encode:
+        first = tokenizer.count_batch(["system message", "hello world", "system message"])
+        second = tokenizer.count_batch(["hello world", "system message"])
+
+    assert first == [first[0], first[1], first[0]]
+    assert second == [first[1], first[0]]
+    assert encode.call_count == 2
+    assert tokenizer.stats["hits"] == 2
+
+def test_count_treats_special_tokens_as_text():
+    assert Tokenizer().count("<|endoftext|>") > 1
+
+def test_history_token_metadata_is_counted_in_one_batch():
+    tokenizer = Tokenizer()
+    history = [
+        Message(role="user", text="hello"),
+        Message(role="assistant", blocks=[{"type": "text", "text": "hi"}, {"type": "text", "text": "there"}]),
+    ]
+    with patch.object(tokenizer, "count_batch", wraps=tokenizer.count_batch) as count_batch:
+        ChatBuffer.create_history_token_metadata(history, tokenizer=tokenizer)
+
+    count_batch.assert_called_once_with(["hello", "hi", "there"])
+    assert ChatBuffer.get_token_metadata(history[1]) == tokenizer.count("hi") + tokenizer.count("there")
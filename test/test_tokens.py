@@ -0,0 +1,42 @@
+import pytest
+from unittest.mock import patch
+from criabot.tokens import BotTokenSigner, BotTokenError
+
+@pytest.fixture
+def signer():
+    return BotTokenSigner(secret="secret", expire_time=3600)
+
+def test_issue_and_verify(signer):
+    token = signer.issue(bot_name="test_bot")
+    assert BotTokenSigner.is_token(token)
+    payload = signer.verify(token)
+    assert payload.bot == "test_bot"
+    assert payload.scope == BotTokenSigner.BOT_SCOPE
+
+def test_opaque_keys_are_not_tokens():
+    assert not BotTokenSigner.is_token("some-opaque-criadex-key")
+    assert not BotTokenSigner.is_token(None)
+
+def test_verify_rejects_other_secret(signer):
+    token = BotTokenSigner(secret="other", expire_time=3600).issue(bot_name="test_bot")
+    with pytest.raises(BotTokenError):
+        signer.verify(token)
+
+def test_verify_rejects_tampered_payload(signer):
+    prefix, _, signature = signer.issue(bot_name="test_bot").split(".")
+    forged_payload = signer.issue(bot_name="other_bot").split(".")[1]
+    with pytest.raises(BotTokenError):
+        signer.verify(".".join([prefix, forged_payload, signature]))
+
+def test_verify_rejects_expired(signer):
+    token = signer.issue(bot_name="test_bot")
+    with patch("criabot.tokens.time.time", return_value=10 ** 12):
+        with pytest.raises(BotTokenError):
+            signer.verify(token)
+
+@pytest.mark.parametrize("part", [0, 1, 2])
+def test_verify_rejects_non_ascii_token(signer, part):
+    parts = signer.issue(bot_name="test_bot").split(".")
+    parts[part] = parts[part] + "é"
+    with pytest.raises(BotTokenError):
+        signer.verify(".".join(parts))